@@ -1,6 +1,9 @@
-from fastapi import FastAPI, Request, HTTPException, Depends, Response, status
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi import FastAPI, APIRouter, Request, HTTPException, Depends, Response, Query, BackgroundTasks, status
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from fastapi.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException as StarletteHTTPException
 from pydantic import BaseModel
 import argon2
 import os
@@ -20,17 +23,86 @@ import hmac
 from typing import Optional, Dict, Any
 import uvicorn
 import app_details
+import migrations
+import build_assets
+import metrics
+from app_metrics import (
+    REQUEST_DURATION, REQUESTS_IN_FLIGHT, DB_TRANSACTION_DURATION, DB_READ_DURATION, DB_POOL_WAIT,
+    PASSWORD_HASH_DURATION, LOGIN_THROTTLED, FEEDBACK_REJECTED,
+)
+import queries
 import logging
 import secrets
+import queue
+import threading
+import time
+import concurrent.futures
+import multiprocessing
+import asyncio
+import collections
+import math
+import gzip
+import csv
+import io
+import html
+import ipaddress
+import brotli
+import httpx
 from authlib.integrations.requests_client import OAuth2Session
 
-# Global variables that will be set by create_app
-app = FastAPI()
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    yield
+    if oauth_http_client is not None:
+        await oauth_http_client.aclose()
+    # Drain queued writes and close the pools before the process exits
+    await run_in_threadpool(shutdown_app)
+
+# Routes are registered on the router, and create_app builds an app around them
+router = APIRouter()
 
 # Make sure the static directory exists
 os.makedirs('./static', exist_ok=True)
-# Mount static files
-app.mount("/static", StaticFiles(directory="static"), name="static")
+
+
+def route_label(scope):
+    """The route template a request matched, keeping the metric labels few."""
+    route = scope.get('route')
+    if route is not None:
+        return route.path
+    # Mounted apps, such as the static files, set the mount point as the root path
+    return scope.get('root_path') or 'unmatched'
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording each request's latency and the number in flight."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            REQUEST_DURATION.observe(
+                time.perf_counter() - start,
+                (scope['method'], route_label(scope), str(status_code)),
+            )
 
 
 AUTH_COOKIE_NAME = "auth_token"
@@ -38,11 +110,141 @@ AUTH_COOKIE_MAX_DAYS = 360
 AUTH_COOKIE_MAX_AGE = AUTH_COOKIE_MAX_DAYS * 24 * 60 * 60  # 360 days in seconds
 
 
+def open_db_connection(db_filepath, read_only=False, **connect_kwargs):
+    """Open a SQLite connection with the performance pragmas from config applied.
+
+    A read-only connection is opened with a mode=ro URI and refuses to write
+    even to temporary tables; it runs in autocommit mode, so each query reads
+    its own snapshot and there is never a transaction to commit.
+    """
+    if read_only:
+        db = sqlite3.connect(
+            f"file:{db_filepath}?mode=ro", uri=True, isolation_level=None, check_same_thread=False, **connect_kwargs
+        )
+    else:
+        db = sqlite3.connect(db_filepath, check_same_thread=False, **connect_kwargs)
+    db.row_factory = sqlite3.Row  # Enable dictionary-like access
+
+    busy_timeout_ms = int(config.get('dbBusyTimeoutMs', 5000))
+    db.execute(f"PRAGMA busy_timeout = {busy_timeout_ms}")
+    if read_only:
+        # WAL mode is a property of the database file, set by the read-write connections
+        db.execute("PRAGMA query_only = ON")
+    else:
+        if db_filepath != ':memory:':
+            db.execute("PRAGMA journal_mode = WAL")
+        db.execute("PRAGMA synchronous = NORMAL")
+    db.execute(f"PRAGMA mmap_size = {int(config.get('dbMmapSize', 64 * 1024 * 1024))}")
+    # Negative cache_size values are in KiB rather than pages
+    db.execute(f"PRAGMA cache_size = -{int(config.get('dbCacheSizeKb', 16 * 1024))}")
+    return db
+
+
+class ConnectionPool:
+    """A fixed-size pool of pre-tuned SQLite connections.
+
+    Connections are opened lazily, up to `size`, and handed out one at a time.
+    When every connection is checked out, callers wait up to `timeout` seconds
+    for one to be returned.
+    """
+
+    def __init__(self, db_filepath, size, timeout, **connect_kwargs):
+        self.db_filepath = db_filepath
+        self.size = size
+        self.timeout = timeout
+        self.connect_kwargs = connect_kwargs
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._closed = False
+
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def acquire(self):
+        start = time.perf_counter()
+        try:
+            db = self._idle.get_nowait()
+        except queue.Empty:
+            db = self._open_or_wait()
+        waited = time.perf_counter() - start
+        DB_POOL_WAIT.observe(waited)
+
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            if waited > self.wait_seconds_max:
+                self.wait_seconds_max = waited
+        return db
+
+    def _open_or_wait(self):
+        with self._lock:
+            can_open = self._opened < self.size
+            if can_open:
+                self._opened += 1
+        if can_open:
+            try:
+                return open_db_connection(self.db_filepath, **self.connect_kwargs)
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self.timeouts += 1
+            raise HTTPException(status_code=503, detail="Database busy, please retry")
+
+    def release(self, db):
+        if self._closed:
+            self._discard(db)
+            return
+        # Left open by an error escaping mid-transaction, it mustn't pass its locks to the next borrower
+        if db.in_transaction:
+            try:
+                db.rollback()
+            except sqlite3.Error:
+                self._discard(db)
+                return
+        self._idle.put(db)
+
+    def _discard(self, db):
+        with self._lock:
+            self._opened -= 1
+        db.close()
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                db = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(db)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'open': self._opened,
+                'idle': self._idle.qsize(),
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_seconds_total': self.wait_seconds_total,
+                'wait_seconds_max': self.wait_seconds_max,
+            }
+
+
+db_pool = None
+
 @contextlib.contextmanager
 def db_transaction():
     """Context manager for SQLite database transactions."""
-    db = sqlite3.connect(config['dbFilepath'])
-    db.row_factory = sqlite3.Row  # Enable dictionary-like access
+    db = db_pool.acquire()
+    start = time.perf_counter()
 
     try:
         yield db
@@ -57,7 +259,229 @@ def db_transaction():
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
     finally:
-        db.close()
+        DB_TRANSACTION_DURATION.observe(time.perf_counter() - start)
+        db_pool.release(db)
+
+
+db_read_pool = None
+
+@contextlib.contextmanager
+def db_read():
+    """Context manager for read-only queries, on the read-only pool.
+
+    In WAL mode readers never wait for the writer, so reads through here
+    aren't held up by, and don't add to, contention for the write lock.
+    """
+    db = db_read_pool.acquire()
+    start = time.perf_counter()
+
+    try:
+        yield db
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    finally:
+        DB_READ_DURATION.observe(time.perf_counter() - start)
+        db_read_pool.release(db)
+
+
+def database_http_error(error):
+    """Translate an error raised during a write into the HTTPException db_transaction would raise."""
+    if isinstance(error, HTTPException):
+        return error
+    if isinstance(error, sqlite3.IntegrityError):
+        return HTTPException(status_code=500, detail=f"Database integrity error: {str(error)}")
+    return HTTPException(status_code=500, detail=f"Database error: {str(error)}")
+
+
+class DatabaseWriter:
+    """Runs every write on one dedicated connection, in a background thread.
+
+    Queued writes are group committed: each batch runs in a single transaction,
+    with a savepoint around each write so that a failing write is rolled back
+    on its own and its error goes only to its caller.
+    """
+
+    def __init__(self, db_filepath, batch_size):
+        self.db_filepath = db_filepath
+        self.batch_size = batch_size
+        self._jobs = queue.Queue()
+        self._db = open_db_connection(db_filepath, isolation_level=None)
+        self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+
+        self.batches = 0
+        self.writes = 0
+        self.failed_commits = 0
+
+        self._thread.start()
+
+    def submit(self, operation):
+        """Queue `operation(db)` and block until its batch has been committed."""
+        future = concurrent.futures.Future()
+        self._jobs.put((operation, future))
+        return future.result()
+
+    def stop(self):
+        """Commit everything already queued, then stop the writer thread."""
+        self._jobs.put(None)
+        self._thread.join()
+        self._db.close()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            job = self._jobs.get()
+            if job is None:
+                break
+            batch = [job]
+            while len(batch) < self.batch_size:
+                try:
+                    job = self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    stopping = True
+                    break
+                batch.append(job)
+            try:
+                self._commit_batch(batch)
+            except Exception as e:
+                self._abandon_batch(batch, e)
+
+    def _abandon_batch(self, batch, error):
+        """Fail a batch broken by an unexpected error, e.g. from a savepoint, keeping the thread alive."""
+        logging.exception(f"Abandoning a batch of {len(batch)} writes")
+        self.failed_commits += 1
+        try:
+            if self._db.in_transaction:
+                self._db.execute("ROLLBACK")
+        except Exception:
+            logging.exception("Could not roll back the abandoned batch")
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(database_http_error(error))
+
+    def _commit_batch(self, batch):
+        db = self._db
+        completed = []
+        try:
+            db.execute("BEGIN IMMEDIATE")
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(database_http_error(e))
+            return
+
+        for operation, future in batch:
+            db.execute("SAVEPOINT queued_write")
+            try:
+                result = operation(db)
+            except Exception as e:
+                db.execute("ROLLBACK TO queued_write")
+                db.execute("RELEASE queued_write")
+                future.set_exception(database_http_error(e))
+            else:
+                db.execute("RELEASE queued_write")
+                completed.append((future, result))
+
+        try:
+            db.execute("COMMIT")
+        except Exception as e:
+            self.failed_commits += 1
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            for future, _ in completed:
+                future.set_exception(database_http_error(e))
+            return
+
+        self.batches += 1
+        self.writes += len(completed)
+        for future, result in completed:
+            future.set_result(result)
+
+    def stats(self):
+        return {
+            'queued': self._jobs.qsize(),
+            'batches': self.batches,
+            'writes': self.writes,
+            'failed_commits': self.failed_commits,
+        }
+
+
+db_writer = None
+
+def run_write(operation):
+    """Run `operation(db)` in a write transaction and return its result.
+
+    When the single-writer mode is enabled (`dbWriterThread`) the operation is
+    queued for the writer thread, otherwise it runs in its own db_transaction.
+    Either way an error comes back as the HTTPException db_transaction raises.
+    """
+    if db_writer is not None:
+        return db_writer.submit(operation)
+    with db_transaction() as db:
+        return operation(db)
+
+class TokenCache:
+    """A bounded LRU cache of verified auth tokens.
+
+    Maps a digest of each token (so the tokens themselves aren't kept around)
+    to the user_id and expiry from its verified payload, so that a repeat
+    request with the same cookie skips the signature check.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def get(self, token):
+        """The cached user_id for this token, or None if it isn't cached (or has expired)."""
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            user_id, expires_at = entry
+            if expires_at is not None and time.time() >= expires_at:
+                del self._entries[key]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return user_id
+
+    def put(self, token, user_id, expires_at):
+        if self.max_size <= 0:
+            return
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (user_id, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'expired': self.expired,
+            }
+
+
+token_cache = None
 
 def get_user_id_from_cookie(request: Request) -> Optional[int]:
     """Extract user_id from cookie"""
@@ -65,12 +489,20 @@ def get_user_id_from_cookie(request: Request) -> Optional[int]:
     if not token:
         return None
 
+    user_id = token_cache.get(token)
+    if user_id is not None:
+        return user_id
+
     try:
         payload = jwt.decode(token, config["jwtSecret"], algorithms=[config["jwtAlgorithm"]])
-        return payload.get('user_id')
     except jwt.PyJWTError:
         return None
 
+    user_id = payload.get('user_id')
+    if user_id is not None:
+        token_cache.put(token, user_id, payload.get('exp'))
+    return user_id
+
 def get_current_user_id(request: Request) -> int:
     """FastAPI dependency for authentication"""
     user_id = get_user_id_from_cookie(request)
@@ -84,17 +516,34 @@ def require_admin_user(request: Request) -> int:
     if not user_id:
         raise HTTPException(status_code=401, detail="Authentication required")
 
-    with db_transaction() as db:
-        query = "SELECT admin FROM users WHERE id = ?"
-        result = db.execute(query, (user_id,)).fetchone()
-
-        if not result or result['admin'] != 1:
-            raise HTTPException(status_code=403, detail="Admin privileges required")
+    user = load_user(user_id)
+    if not user or not user['admin']:
+        raise HTTPException(status_code=403, detail="Admin privileges required")
 
     return user_id
 
 password_hasher = argon2.PasswordHasher()
 
+def password_hasher_params(config_dict):
+    """The argon2 parameters from config, defaulting to the library's."""
+    return {
+        'time_cost': int(config_dict.get('argon2TimeCost', argon2.DEFAULT_TIME_COST)),
+        'memory_cost': int(config_dict.get('argon2MemoryCost', argon2.DEFAULT_MEMORY_COST)),
+        'parallelism': int(config_dict.get('argon2Parallelism', argon2.DEFAULT_PARALLELISM)),
+    }
+
+def configure_password_hasher(params):
+    """Hash with the given argon2 parameters; also run in each hashing worker process as it starts."""
+    global password_hasher
+    password_hasher = argon2.PasswordHasher(**params)
+
+def password_needs_rehash(stored_password):
+    """Whether a stored hash was made with other parameters than ours (only reads its header)."""
+    try:
+        return password_hasher.check_needs_rehash(stored_password)
+    except argon2.exceptions.InvalidHashError:
+        return False
+
 def verify_password(stored_password, provided_password):
     """Verify password using argon2"""
     # Defensive checks: reject if either password is None or blank
@@ -109,6 +558,77 @@ def verify_password(stored_password, provided_password):
     except argon2.exceptions.VerifyMismatchError:
         return False
 
+def hash_password(password):
+    """Hash a password using argon2"""
+    return password_hasher.hash(password)
+
+
+class PasswordHashPool:
+    """Runs argon2 hashing and verification in a dedicated process pool.
+
+    At most `max_pending` hashes may be queued or running at once; beyond that
+    callers get a 503 straight away rather than queueing behind the backlog.
+    With no workers configured the work runs in the shared thread pool instead.
+    """
+
+    def __init__(self, workers, max_pending, hasher_params=None):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = None
+        if workers > 0:
+            # Workers are spawned afresh, so they must be given the argon2 parameters
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=configure_password_hasher if hasher_params else None,
+                initargs=(hasher_params,) if hasher_params else (),
+            )
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    async def hash(self, password):
+        return await self._run('hash', hash_password, password)
+
+    async def verify(self, stored_password, provided_password):
+        return await self._run('verify', verify_password, stored_password, provided_password)
+
+    async def _run(self, operation, function, *args):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HTTPException(status_code=503, detail="Server busy, please retry")
+            self.pending += 1
+        start = time.perf_counter()
+        try:
+            if self._executor is None:
+                result = await run_in_threadpool(function, *args)
+            else:
+                result = await asyncio.wrap_future(self._executor.submit(function, *args))
+        finally:
+            with self._lock:
+                self.pending -= 1
+            PASSWORD_HASH_DURATION.observe(time.perf_counter() - start, (operation,))
+        self.completed += 1
+        return result
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'max_pending': self.max_pending,
+            'pending': self.pending,
+            'completed': self.completed,
+            'rejected': self.rejected,
+        }
+
+
+password_hash_pool = None
+
 def set_auth_cookie(response: Response, user_id: int):
     """Create JWT token and set authentication cookie"""
     # Create JWT token with user_id embedded
@@ -130,13 +650,12 @@ def set_auth_cookie(response: Response, user_id: int):
         path='/'           # Available across the entire domain
     )
 
-def get_current_user(db, user_id):
-    """Get current user from database"""
-    query = "SELECT id, username, fullname, admin FROM users WHERE id = ?"
-    user = db.execute(query, (user_id,)).fetchone()
+def fetch_user(db, user_id):
+    """Get a user's id, username, fullname and admin flag from the database, or None"""
+    user = queries.execute(db, 'user_by_id', {'user_id': user_id}).fetchone()
 
     if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+        return None
 
     return {
         'id': user['id'],
@@ -145,110 +664,313 @@ def get_current_user(db, user_id):
         'admin': bool(user['admin'])
     }
 
+def get_current_user(db, user_id):
+    """Get current user from database"""
+    user = fetch_user(db, user_id)
 
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
 
-# Serve index.html for '/' and any path starting with '/app'
-@app.get("/", response_class=HTMLResponse)
-@app.get("/app", response_class=HTMLResponse)
-@app.get("/app/{path:path}", response_class=HTMLResponse)
-def serve_index(request: Request, path: str = None):
-    with db_transaction() as db:
-        user = None
-        user_id = get_user_id_from_cookie(request)
-        if user_id:
-            query = "SELECT id, username, fullname, password, admin FROM users WHERE id = ?"
-            user = db.execute(query, (user_id,)).fetchone()
+    return user
 
-        user_flags = {}
-        if user:
-            user_flags = {
-                "id": user['id'],
-                "username": user['username'],
-                "fullname": user['fullname'],
-                "admin": bool(user['admin'])
+
+def bump_cache_version(db, name):
+    """Bump a cache_versions counter, in the same transaction as the write that makes the cache stale."""
+    return queries.execute(db, 'cache_version_bump', {'name': name}).fetchone()['version']
+
+
+class UserCache:
+    """A size-bounded, TTL-limited cache of user records, keyed by id.
+
+    Writes made by this worker update or invalidate entries directly, and bump
+    the 'users' counter in cache_versions. To notice writes made by other
+    workers, each lookup checks PRAGMA data_version on a dedicated connection,
+    which only changes when another connection commits. Only then is the
+    counter re-read, and if it has moved on the whole cache is cleared.
+    """
+
+    def __init__(self, db_filepath, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._watch_db = None
+        if db_filepath != ':memory:':
+            self._watch_db = open_db_connection(db_filepath)
+        self._data_version = None
+        self._version = None
+
+        self.hits = 0
+        self.misses = 0
+        self.clears = 0
+
+        with self._lock:
+            self._check_version()
+
+    def _check_version(self):
+        """Clear the cache if another worker has bumped the users counter. Called holding the lock."""
+        if self._watch_db is None:
+            return
+        data_version = self._watch_db.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return
+        self._data_version = data_version
+
+        row = queries.execute(self._watch_db, 'cache_version', {'name': 'users'}).fetchone()
+        version = row['version'] if row else 0
+        if version != self._version:
+            if self._entries:
+                self._entries.clear()
+                self.clears += 1
+            self._version = version
+
+    def get(self, user_id):
+        with self._lock:
+            self._check_version()
+            entry = self._entries.get(user_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            user, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return user
+
+    def put(self, user):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[user['id']] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user['id'])
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def wrote(self, version):
+        """Record that this worker bumped the users counter to `version`.
+
+        If nobody else has bumped it since we last looked, the cache is still
+        current and need not be cleared when the change is noticed.
+        """
+        with self._lock:
+            if self._version == version - 1:
+                self._version = version
+
+    def close(self):
+        if self._watch_db is not None:
+            self._watch_db.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'clears': self.clears,
             }
-        debug_mode = config.get('debug', False)
-        user_flags_json = json.dumps(user_flags)
-        main_js_src = "/static/main-debug.js" if debug_mode else "/static/main.js"
-        main_css_src ="/static/styles.css" if debug_mode else "/static/styles.min.css"
-        main_title = f"DEBUG - {app_details.title}" if debug_mode else app_details.title
-
-        index_html = f"""<!DOCTYPE html>
-                <html>
-                <head>
-                    <meta charset="UTF-8">
-                    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-                    <title>{main_title}</title>
-                    <link rel="icon" type="image/svg" href="data:image/svg+xml,<svg xmlns='http://www.w3.org/2000/svg' width='48' height='48' viewBox='0 0 16 16'><text x='0' y='14'>{app_details.favicon_emoji}</text></svg>"/>
-
-                    <link rel="preconnect" href="https://fonts.googleapis.com">
-                    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
-                    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap" rel="stylesheet">
-
-                    <link rel="stylesheet" href="{main_css_src}">
-                    <script src="{main_js_src}"></script>
-                </head>
-                <body>
-                    <h1>{app_details.title}</h1>
-                    <script>
-                        const safeLocalStorage = {{
-                              getItem(key) {{
-                                try {{
-                                  return localStorage.getItem(key);
-                                }} catch(e) {{
-                                  return null;
-                                }}
-                              }},
-                              setItem(key, value) {{
-                                try {{
-                                  localStorage.setItem(key, value);
-                                }} catch(e) {{
-                                  //
-                                }}
-                              }},
-                              removeItem(key, value) {{
-                                try {{
-                                  localStorage.removeItem(key, value);
-                                }} catch(e) {{
-                                  //
-                                }}
-                              }}
-                        }};
-
-                        const user_flags = {user_flags_json};
-                        const flags = {{ "flags" : 
-                            {{ "now": Date.now(), "user": user_flags, debug_mode: {str(debug_mode).lower()} }}
-                        }};
-                        var app = Elm.Main.init(flags);
-
-
-                        app.ports.set_local_storage.subscribe(function (args) {{
-                            safeLocalStorage.setItem(args.key, JSON.stringify(args.value));
-                        }});
-
-                        app.ports.clear_local_storage.subscribe(function (args) {{
-                            safeLocalStorage.removeItem(args);
-                        }});
-
-
-                        app.ports.native_alert.subscribe(function (message) {{
-                            alert(message);
-                        }});
-
-                        window.addEventListener('storage', function(event) {{
-                            console.log('local storage event');
-                            console.log(event);
-                            if (event.key === 'user') {{
-                                app.ports.local_storage_changed.send(
-                                    {{ key: event.key,
-                                      newValue: JSON.parse(event.newValue) }}
-                                );
+
+
+user_cache = None
+
+def load_user(user_id):
+    """Get a user's record through the user cache, or None if there is no such user"""
+    user = user_cache.get(user_id)
+    if user is None:
+        with db_read() as db:
+            user = fetch_user(db, user_id)
+        if user:
+            user_cache.put(user)
+    return user
+
+
+
+asset_manifest = {}
+
+def static_url(name):
+    """The URL of a static asset, its fingerprinted copy if build_assets.py has made one."""
+    return "/static/" + asset_manifest.get(name, name)
+
+
+USER_FLAGS_PLACEHOLDER = "__USER_FLAGS__"
+
+def render_index_html(user_flags_json):
+    """Render the index page with the given (already JSON encoded) user flags."""
+    debug_mode = config.get('debug', False)
+    main_js_src = static_url("main-debug.js" if debug_mode else "main.js")
+    main_css_src = static_url("styles.css" if debug_mode else "styles.min.css")
+    main_title = f"DEBUG - {app_details.title}" if debug_mode else app_details.title
+
+    index_html = f"""<!DOCTYPE html>
+            <html>
+            <head>
+                <meta charset="UTF-8">
+                <meta name="viewport" content="width=device-width, initial-scale=1.0">
+                <title>{main_title}</title>
+                <link rel="icon" type="image/svg" href="data:image/svg+xml,<svg xmlns='http://www.w3.org/2000/svg' width='48' height='48' viewBox='0 0 16 16'><text x='0' y='14'>{app_details.favicon_emoji}</text></svg>"/>
+
+                <link rel="preconnect" href="https://fonts.googleapis.com">
+                <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
+                <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap" rel="stylesheet">
+
+                <link rel="stylesheet" href="{main_css_src}">
+                <script src="{main_js_src}"></script>
+            </head>
+            <body>
+                <h1>{app_details.title}</h1>
+                <script>
+                    const safeLocalStorage = {{
+                          getItem(key) {{
+                            try {{
+                              return localStorage.getItem(key);
+                            }} catch(e) {{
+                              return null;
+                            }}
+                          }},
+                          setItem(key, value) {{
+                            try {{
+                              localStorage.setItem(key, value);
+                            }} catch(e) {{
+                              //
                             }}
-                        }});
-                    </script>
-                </body>
-                </html>"""
-        return index_html
+                          }},
+                          removeItem(key, value) {{
+                            try {{
+                              localStorage.removeItem(key, value);
+                            }} catch(e) {{
+                              //
+                            }}
+                          }}
+                    }};
+
+                    const user_flags = {user_flags_json};
+                    const flags = {{ "flags" : 
+                        {{ "now": Date.now(), "user": user_flags, debug_mode: {str(debug_mode).lower()} }}
+                    }};
+                    var app = Elm.Main.init(flags);
+
+
+                    app.ports.set_local_storage.subscribe(function (args) {{
+                        safeLocalStorage.setItem(args.key, JSON.stringify(args.value));
+                    }});
+
+                    app.ports.clear_local_storage.subscribe(function (args) {{
+                        safeLocalStorage.removeItem(args);
+                    }});
+
+
+                    app.ports.native_alert.subscribe(function (message) {{
+                        alert(message);
+                    }});
+
+                    window.addEventListener('storage', function(event) {{
+                        console.log('local storage event');
+                        console.log(event);
+                        if (event.key === 'user') {{
+                            app.ports.local_storage_changed.send(
+                                {{ key: event.key,
+                                  newValue: JSON.parse(event.newValue) }}
+                            );
+                        }}
+                    }});
+                </script>
+            </body>
+            </html>"""
+    return index_html
+
+
+def choose_content_encoding(accept_encoding):
+    """Pick the best encoding we precompress for, given an Accept-Encoding header."""
+    accepted = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    for encoding in ('br', 'gzip'):
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return 'identity'
+
+def compress_body(body, encoding, best=False):
+    """Compress a response body; `best` trades time for size, for content compressed once."""
+    if encoding == 'br':
+        return brotli.compress(body, quality=11 if best else 5)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=9 if best else 6, mtime=0)
+    return body
+
+def etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header matches our ETag (using the weak comparison it calls for)."""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip().removeprefix('W/') for candidate in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates
+
+
+class IndexPage:
+    """The index page, rendered once at startup with a hole for the user flags.
+
+    The anonymous page is the same for everyone, so it is also compressed ahead
+    of time and given a strong ETag for each encoding.
+    """
+
+    def __init__(self):
+        html = render_index_html(USER_FLAGS_PLACEHOLDER)
+        self.prefix, self.suffix = html.split(USER_FLAGS_PLACEHOLDER)
+
+        anonymous = self.render({})
+        digest = hashlib.sha256(anonymous).hexdigest()[:32]
+        self.anonymous = {}
+        for encoding in ('identity', 'gzip', 'br'):
+            etag = f'"{digest}"' if encoding == 'identity' else f'"{digest}-{encoding}"'
+            self.anonymous[encoding] = (compress_body(anonymous, encoding, best=True), etag)
+
+    def render(self, user_flags):
+        return (self.prefix + json.dumps(user_flags) + self.suffix).encode('utf-8')
+
+
+index_page = None
+
+# Serve index.html for '/' and any path starting with '/app'
+@router.get("/", response_class=HTMLResponse)
+@router.get("/app", response_class=HTMLResponse)
+@router.get("/app/{path:path}", response_class=HTMLResponse)
+def serve_index(request: Request, path: str = None):
+    encoding = choose_content_encoding(request.headers.get('accept-encoding', ''))
+
+    user = None
+    user_id = get_user_id_from_cookie(request)
+    if user_id:
+        user = load_user(user_id)
+
+    headers = {'Vary': 'Accept-Encoding, Cookie'}
+    if user:
+        body = compress_body(index_page.render(user), encoding)
+        headers['Cache-Control'] = 'private, no-cache'
+    else:
+        body, etag = index_page.anonymous[encoding]
+        headers['ETag'] = etag
+        headers['Cache-Control'] = 'no-cache'
+        if etag_matches(request.headers.get('if-none-match'), etag):
+            return Response(status_code=304, headers=headers)
+
+    if encoding != 'identity':
+        headers['Content-Encoding'] = encoding
+    return Response(content=body, media_type='text/html; charset=utf-8', headers=headers)
 
 # Authentication routes
 class UserResponse(BaseModel):
@@ -267,93 +989,340 @@ class LoginRequest(BaseModel):
     username: str
     password: str
 
-@app.post('/api/login')
-def login(login_data: LoginRequest, response: Response) -> AuthResponse:
-    with db_transaction() as db:
-        username = login_data.username
-        password = login_data.password
-
-        if not username or not password:
-            raise HTTPException(status_code=400, detail="Username and password required")
-
-        # Get user from database
-        query = "SELECT id, username, email, fullname, password, admin FROM users WHERE username = ?"
-        user = db.execute(query, (username,)).fetchone()
-
-        # Check if user exists and has a password set (OAuth users may not have a password)
-        if not user or not user["password"]:
-            raise HTTPException(status_code=401, detail="Invalid credentials")
-
-        # Verify password
-        if not verify_password(user["password"], password):
-            raise HTTPException(status_code=401, detail="Invalid credentials")
-
-        # Set authentication cookie
-        set_auth_cookie(response, user['id'])
-
-        return AuthResponse(
-            success=True,
-            message='Login successful',
-            user=UserResponse(
-                id=user['id'],
-                username=user['username'],
-                fullname=user['fullname'],
-                email=user['email'],
-                admin=bool(user['admin'])
-            )
+
+# Addresses of the reverse proxies in front of the app; only these are believed about X-Forwarded-For
+trusted_proxies = ()
+
+
+def is_trusted_proxy(address):
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in trusted_proxies)
+
+
+def client_ip(request: Request):
+    """The client's IP address: the peer's, unless that is a trusted proxy.
+
+    Each proxy appends the address it was connected from to X-Forwarded-For,
+    so the header is read from the right, past the trusted proxies, to the
+    first address they didn't vouch for. Anything left of that was sent by
+    the client and may be made up.
+    """
+    peer = request.client.host if request.client else None
+    if not is_trusted_proxy(peer):
+        return peer
+
+    forwarded = [
+        address.strip()
+        for header in request.headers.getlist('x-forwarded-for')
+        for address in header.split(',')
+        if address.strip()
+    ]
+    for address in reversed(forwarded):
+        if not is_trusted_proxy(address):
+            return address
+    if forwarded:
+        return forwarded[0]
+    return request.headers.get('x-real-ip') or peer
+
+
+class LoginBackoff:
+    """How long a key is blocked after repeated login failures.
+
+    The first `free_attempts` failures cost nothing; after that each one blocks
+    the key for `base_delay` seconds, doubling every time up to `max_delay`.
+    A key's failures are forgotten `window` seconds after its last one.
+    """
+
+    def __init__(self, free_attempts, base_delay, max_delay, window):
+        self.free_attempts = free_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.window = window
+
+    def delay(self, failures):
+        if failures < self.free_attempts:
+            return 0
+        return min(self.max_delay, self.base_delay * 2 ** (failures - self.free_attempts))
+
+
+def login_throttle_keys(username, ip_address):
+    return [f"username:{username}", f"ip:{ip_address}"]
+
+
+class LoginThrottle:
+    """Base for the login failure stores, which block keys by the same rules."""
+
+    def __init__(self, username_backoff, ip_backoff, max_entries):
+        self.username_backoff = username_backoff
+        self.ip_backoff = ip_backoff
+        self.max_entries = max_entries
+
+    def backoff(self, key):
+        return self.ip_backoff if key.startswith('ip:') else self.username_backoff
+
+
+class MemoryLoginThrottle(LoginThrottle):
+    """Login failures held in this worker's memory, with a size cap.
+
+    Every failure moves its key to the end, and every key's failures are
+    forgotten the same time after its last one, so the front is always the
+    next to expire; expired keys are swept from there, and beyond
+    `max_entries` the oldest go. Only suitable for a single worker.
+    """
+
+    def __init__(self, username_backoff, ip_backoff, max_entries):
+        super().__init__(username_backoff, ip_backoff, max_entries)
+        # key -> (failures, blocked_until, expires_at)
+        self._failures = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def retry_after(self, keys):
+        """Seconds until any of `keys` may try again, or 0 if all may now."""
+        now = time.time()
+        with self._lock:
+            self._sweep(now)
+            blocked_until = max((self._failures[key][1] for key in keys if key in self._failures), default=0)
+        return max(0, blocked_until - now)
+
+    def record_failure(self, keys):
+        now = time.time()
+        with self._lock:
+            self._sweep(now)
+            for key in keys:
+                failures, _, _ = self._failures.pop(key, (0, 0, 0))
+                failures += 1
+                backoff = self.backoff(key)
+                delay = backoff.delay(failures)
+                self._failures[key] = (failures, now + delay if delay else 0, now + backoff.window)
+            while len(self._failures) > self.max_entries:
+                self._failures.popitem(last=False)
+
+    def record_success(self, keys):
+        with self._lock:
+            for key in keys:
+                self._failures.pop(key, None)
+
+    def _sweep(self, now):
+        while self._failures:
+            key, (_, _, expires_at) = next(iter(self._failures.items()))
+            if expires_at > now:
+                break
+            del self._failures[key]
+
+    def stats(self):
+        with self._lock:
+            return {'tracked': len(self._failures)}
+
+
+class SqliteLoginThrottle(LoginThrottle):
+    """Login failures in the login_failures table, shared by every worker on the host.
+
+    The same rules as MemoryLoginThrottle. Every `sweep_interval` seconds
+    forgotten failures are deleted, `sweep_batch_size` at a time, and then
+    those beyond `max_entries` that expire soonest.
+    """
+
+    def __init__(self, username_backoff, ip_backoff, max_entries, sweep_batch_size=500, sweep_interval=60):
+        super().__init__(username_backoff, ip_backoff, max_entries)
+        self.sweep_batch_size = sweep_batch_size
+        self.sweep_interval = sweep_interval
+        self._next_sweep = 0.0
+
+    def retry_after(self, keys):
+        now = time.time()
+        with db_transaction() as db:
+            parameters = {'keys': json.dumps(keys), 'now': now}
+            blocked_until = queries.execute(db, 'login_failures_blocked_until', parameters).fetchone()[0] or 0
+        return max(0, blocked_until - now)
+
+    def record_failure(self, keys):
+        now = time.time()
+
+        def count_failures(db):
+            for key in keys:
+                backoff = self.backoff(key)
+                parameters = {'key': key, 'now': now, 'expires_at': now + backoff.window}
+                failures = queries.execute(db, 'login_failure_record', parameters).fetchone()[0]
+                delay = backoff.delay(failures)
+                if delay:
+                    queries.execute(db, 'login_failure_block', {'blocked_until': now + delay, 'key': key})
+
+        run_write(count_failures)
+        if now >= self._next_sweep:
+            self._next_sweep = now + self.sweep_interval
+            self.sweep(now)
+
+    def record_success(self, keys):
+        def forget_failures(db):
+            queries.execute(db, 'login_failures_forget', {'keys': json.dumps(keys)})
+
+        run_write(forget_failures)
+
+    def sweep(self, now=None):
+        if now is None:
+            now = time.time()
+
+        def delete_expired(db):
+            parameters = {'now': now, 'batch_size': self.sweep_batch_size}
+            return queries.execute(db, 'login_failures_delete_expired', parameters).rowcount
+
+        while run_write(delete_expired) == self.sweep_batch_size:
+            pass
+
+        def delete_oldest(db):
+            queries.execute(db, 'login_failures_delete_beyond_max', {'max_entries': self.max_entries})
+
+        run_write(delete_oldest)
+
+    def stats(self):
+        with db_transaction() as db:
+            return {'tracked': queries.execute(db, 'login_failures_count').fetchone()[0]}
+
+
+login_throttle = None
+
+async def rehash_password(user_id, old_password_hash, password):
+    """Upgrade a stored hash to the current argon2 parameters.
+
+    Run after the login response has been sent. The update only applies if
+    the hash is unchanged, so a password changed meanwhile is left alone.
+    """
+    try:
+        new_password_hash = await password_hash_pool.hash(password)
+
+        def update_password(db):
+            queries.execute(db, 'user_password_rehash', {
+                'password': new_password_hash, 'user_id': user_id, 'old_password': old_password_hash,
+            })
+
+        await run_in_threadpool(run_write, update_password)
+    except HTTPException as e:
+        # Not a problem, it will be tried again at the next login
+        logging.warning(f"Could not rehash the password of user {user_id}: {e.detail}")
+    except Exception:
+        # Nor is anything else, but it is unexpected; the login has already succeeded either way
+        logging.exception(f"Could not rehash the password of user {user_id}")
+
+@router.post('/api/login')
+async def login(
+    login_data: LoginRequest, request: Request, response: Response, background_tasks: BackgroundTasks
+) -> AuthResponse:
+    username = login_data.username
+    password = login_data.password
+
+    if not username or not password:
+        raise HTTPException(status_code=400, detail="Username and password required")
+
+    # Refuse throttled attempts before they cost a lookup or an argon2 verify
+    throttle_keys = login_throttle_keys(username, client_ip(request))
+    retry_after = await run_in_threadpool(login_throttle.retry_after, throttle_keys)
+    if retry_after > 0:
+        LOGIN_THROTTLED.inc()
+        raise HTTPException(
+            status_code=429,
+            detail="Too many failed logins, please try again later",
+            headers={'Retry-After': str(math.ceil(retry_after))},
         )
 
+    # Get user from database
+    def fetch_user():
+        with db_transaction() as db:
+            return queries.execute(db, 'user_login_by_username', {'username': username}).fetchone()
+
+    user = await run_in_threadpool(fetch_user)
+
+    # Check if user exists and has a password set (OAuth users may not have a password)
+    if not user or not user["password"]:
+        await run_in_threadpool(login_throttle.record_failure, throttle_keys)
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+
+    # Verify password
+    if not await password_hash_pool.verify(user["password"], password):
+        await run_in_threadpool(login_throttle.record_failure, throttle_keys)
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+
+    # Only the username is forgiven, or a login to one account would clear an IP guessing at others
+    await run_in_threadpool(login_throttle.record_success, throttle_keys[:1])
+
+    if password_needs_rehash(user["password"]):
+        background_tasks.add_task(rehash_password, user['id'], user["password"], password)
+
+    # Set authentication cookie
+    set_auth_cookie(response, user['id'])
+
+    return AuthResponse(
+        success=True,
+        message='Login successful',
+        user=UserResponse(
+            id=user['id'],
+            username=user['username'],
+            fullname=user['fullname'],
+            email=user['email'],
+            admin=bool(user['admin'])
+        )
+    )
+
 class RegisterRequest(BaseModel):
     username: str
     password: str
     email: str
     fullname: Optional[str] = None
 
-@app.post('/api/register')
-def register(register_data: RegisterRequest, response: Response) -> AuthResponse:
-    with db_transaction() as db:
-        username = register_data.username
-        password = register_data.password
-        email = register_data.email
-        fullname = register_data.fullname
+@router.post('/api/register')
+async def register(register_data: RegisterRequest, response: Response) -> AuthResponse:
+    username = register_data.username
+    password = register_data.password
+    email = register_data.email
+    fullname = register_data.fullname
 
-        if not username or not password or not email:
-            raise HTTPException(status_code=400, detail="Username, password and email required")
+    if not username or not password or not email:
+        raise HTTPException(status_code=400, detail="Username, password and email required")
 
-        # Check if username already exists
-        check_query = "select exists(select 1 from users where username = :username) as user_exists"
-        existing_user = db.execute(check_query, {'username': username}).fetchone()
+    # Check if username already exists
+    def fetch_existing_user():
+        with db_transaction() as db:
+            return queries.execute(db, 'username_exists', {'username': username}).fetchone()
 
-        if existing_user['user_exists']:
-            raise HTTPException(status_code=409, detail="Username already exists")
+    existing_user = await run_in_threadpool(fetch_existing_user)
 
-        # Hash the password
-        hashed_password = password_hasher.hash(password)
+    if existing_user['user_exists']:
+        raise HTTPException(status_code=409, detail="Username already exists")
 
-        # Insert new user
-        insert_query = """
-            insert into users (username, email, fullname, password, admin)
-            values (?, ?, ?, ?, ?)
-        """
-        cursor = db.execute(insert_query, (username, email, fullname, hashed_password, False))
-        user_id = cursor.lastrowid
-
-        # Set authentication cookie
-        set_auth_cookie(response, user_id)
-
-        return AuthResponse(
-            success=True,
-            message='Registration successful',
-            user=UserResponse(
-                id=user_id,
-                username=username,
-                fullname=fullname,
-                email=email,
-                admin=False
-            )
+    # Hash the password, outside of the write so the write lock isn't held during it
+    hashed_password = await password_hash_pool.hash(password)
+
+    def insert_user(db):
+        # Check again, the username may have been taken while we were hashing
+        if queries.execute(db, 'username_exists', {'username': username}).fetchone()['user_exists']:
+            raise HTTPException(status_code=409, detail="Username already exists")
+
+        cursor = queries.execute(db, 'user_insert', {
+            'username': username, 'email': email, 'fullname': fullname, 'password': hashed_password,
+        })
+        return cursor.lastrowid
+
+    user_id = await run_in_threadpool(run_write, insert_user)
+    user_cache.put({'id': user_id, 'username': username, 'fullname': fullname, 'admin': False})
+
+    # Set authentication cookie
+    set_auth_cookie(response, user_id)
+
+    return AuthResponse(
+        success=True,
+        message='Registration successful',
+        user=UserResponse(
+            id=user_id,
+            username=username,
+            fullname=fullname,
+            email=email,
+            admin=False
         )
+    )
 
-@app.post('/api/logout')
+@router.post('/api/logout')
 def logout(response: Response):
     response.delete_cookie(AUTH_COOKIE_NAME, path='/')
     return {'success': True, 'message': 'Logged out successfully'}
@@ -367,10 +1336,103 @@ GOOGLE_AUTHORIZE_URL = 'https://accounts.google.com/o/oauth2/v2/auth'
 GOOGLE_TOKEN_URL = 'https://oauth2.googleapis.com/token'
 GOOGLE_USERINFO_URL = 'https://www.googleapis.com/oauth2/v2/userinfo'
 
-# Store OAuth states temporarily (in production, use Redis or database)
-oauth_states = {}
+class MemoryOAuthStateStore:
+    """Pending OAuth states held in this worker's memory, with a TTL and a size cap.
+
+    Every state gets the same TTL, so insertion order is also expiry order and
+    expired states are swept from the front. Only suitable for a single worker.
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._states = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, state):
+        now = time.time()
+        with self._lock:
+            self._sweep(now)
+            self._states[state] = now + self.ttl
+            while len(self._states) > self.max_entries:
+                self._states.popitem(last=False)
+
+    def consume(self, state):
+        """Remove a state, returning whether it was pending and has not expired."""
+        with self._lock:
+            expires_at = self._states.pop(state, None)
+        return expires_at is not None and time.time() < expires_at
+
+    def _sweep(self, now):
+        while self._states:
+            state, expires_at = next(iter(self._states.items()))
+            if expires_at > now:
+                break
+            del self._states[state]
+
+    def stats(self):
+        with self._lock:
+            return {'pending': len(self._states)}
+
+
+class SqliteOAuthStateStore:
+    """Pending OAuth states in the oauth_states table, shared by every worker on the host.
+
+    Every `sweep_interval` seconds expired states are deleted, `sweep_batch_size`
+    at a time so that no single write holds the lock for long, and then the
+    oldest states beyond `max_entries` are deleted too.
+    """
+
+    def __init__(self, ttl, max_entries, sweep_batch_size=500, sweep_interval=60):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.sweep_batch_size = sweep_batch_size
+        self.sweep_interval = sweep_interval
+        self._next_sweep = 0.0
+
+    def add(self, state):
+        now = time.time()
+
+        def insert_state(db):
+            queries.execute(db, 'oauth_state_insert', {'state': state, 'expires_at': now + self.ttl})
+
+        run_write(insert_state)
+        if now >= self._next_sweep:
+            self._next_sweep = now + self.sweep_interval
+            self.sweep(now)
+
+    def consume(self, state):
+        """Remove a state, returning whether it was pending and has not expired."""
+        def delete_state(db):
+            return queries.execute(db, 'oauth_state_consume', {'state': state}).fetchall()
+
+        rows = run_write(delete_state)
+        return bool(rows) and time.time() < rows[0]['expires_at']
+
+    def sweep(self, now=None):
+        if now is None:
+            now = time.time()
+
+        def delete_expired(db):
+            parameters = {'now': now, 'batch_size': self.sweep_batch_size}
+            return queries.execute(db, 'oauth_states_delete_expired', parameters).rowcount
+
+        while run_write(delete_expired) == self.sweep_batch_size:
+            pass
+
+        def delete_oldest(db):
+            queries.execute(db, 'oauth_states_delete_beyond_max', {'max_entries': self.max_entries})
+
+        run_write(delete_oldest)
+
+    def stats(self):
+        with db_transaction() as db:
+            return {'pending': queries.execute(db, 'oauth_states_count').fetchone()[0]}
 
-@app.get('/api/auth/google/login')
+
+oauth_state_store = None
+
+@router.get('/api/auth/google/login')
 def google_oauth_login():
     """Initiate Google OAuth flow"""
     state = secrets.token_urlsafe(32)
@@ -382,51 +1444,85 @@ def google_oauth_login():
     )
 
     authorization_url, _ = oauth.create_authorization_url(
-        GOOGLE_AUTHORIZE_URL,
+        config.get('googleAuthorizeUrl', GOOGLE_AUTHORIZE_URL),
         state=state
     )
 
-    print(f"AND THE AUTH URL IS: {authorization_url}")
+    logging.debug(f"Redirecting to Google OAuth: {authorization_url}")
 
-    # Store state temporarily (use Redis/database in production)
-    oauth_states[state] = True
+    # Remember the state until the callback, which may be handled by another worker
+    oauth_state_store.add(state)
 
     # Return the URL for frontend to redirect to
     # return {'authorization_url': authorization_url}
     return RedirectResponse(url=authorization_url)
 
-@app.get('/api/auth/google/callback')
-def google_oauth_callback(request: Request, response: Response, code: Optional[str] = None, state: Optional[str] = None, error: Optional[str] = None):
+oauth_http_client = None
+
+def create_oauth_http_client():
+    """A shared HTTP client for the OAuth provider, with pooled keep-alive connections and explicit timeouts."""
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(
+            float(config.get('oauthReadTimeout', 10.0)),
+            connect=float(config.get('oauthConnectTimeout', 5.0)),
+        ),
+        limits=httpx.Limits(
+            max_connections=int(config.get('oauthMaxConnections', 20)),
+            max_keepalive_connections=int(config.get('oauthMaxConnections', 20)),
+            keepalive_expiry=float(config.get('oauthKeepaliveExpiry', 60.0)),
+        ),
+    )
+
+def close_oauth_http_client():
+    """Close the OAuth client's pooled connections, unless the lifespan already has."""
+    global oauth_http_client
+    client, oauth_http_client = oauth_http_client, None
+    if client is not None and not client.is_closed:
+        try:
+            asyncio.run(client.aclose())
+        except Exception:
+            logging.exception("Could not close the OAuth HTTP client")
+
+async def fetch_google_user_info(code):
+    """Exchange an authorization code for an access token, and use it to get the user's info from Google."""
+    token_response = await oauth_http_client.post(
+        config.get('googleTokenUrl', GOOGLE_TOKEN_URL),
+        data={
+            'grant_type': 'authorization_code',
+            'code': code,
+            'redirect_uri': f"{config['base_url']}/api/auth/google/callback",
+            'client_id': GOOGLE_CLIENT_ID,
+            'client_secret': GOOGLE_CLIENT_SECRET,
+        },
+        headers={'Accept': 'application/json'},
+    )
+    token_response.raise_for_status()
+    access_token = token_response.json()['access_token']
+
+    userinfo_response = await oauth_http_client.get(
+        config.get('googleUserinfoUrl', GOOGLE_USERINFO_URL),
+        headers={'Authorization': f"Bearer {access_token}"},
+    )
+    userinfo_response.raise_for_status()
+    return userinfo_response.json()
+
+@router.get('/api/auth/google/callback')
+async def google_oauth_callback(request: Request, response: Response, code: Optional[str] = None, state: Optional[str] = None, error: Optional[str] = None):
     """Handle Google OAuth callback"""
 
     if error:
         raise HTTPException(status_code=400, detail=f'OAuth error: {error}')
 
-    if not code or not state or state not in oauth_states:
+    # Each state can only be used once
+    if not code or not state or not await run_in_threadpool(oauth_state_store.consume, state):
         raise HTTPException(status_code=400, detail='Invalid OAuth callback')
 
-    # Clean up state
-    del oauth_states[state]
-
     try:
-        # Exchange code for token
-        oauth = OAuth2Session(
-            GOOGLE_CLIENT_ID,
-            redirect_uri=f"{config['base_url']}/api/auth/google/callback"
-        )
-
-        token = oauth.fetch_token(
-            GOOGLE_TOKEN_URL,
-            code=code,
-            client_secret=GOOGLE_CLIENT_SECRET
-        )
-
-        # Get user info from Google
-        resp = oauth.get(GOOGLE_USERINFO_URL)
-        user_info = resp.json()
+        # Exchange code for token, and get user info from Google
+        user_info = await fetch_google_user_info(code)
 
         # Process the OAuth login
-        oauth_result = process_oauth_login('google', user_info)
+        oauth_result = await run_in_threadpool(process_oauth_login, 'google', user_info)
 
         if not oauth_result["success"]:
             return RedirectResponse(url=f"{config['base_url']}#/login?error=oauth_failed", status_code=303)
@@ -441,123 +1537,126 @@ def google_oauth_callback(request: Request, response: Response, code: Optional[s
         logging.error(f"OAuth error: {repr(e)}")
         raise HTTPException(status_code=500, detail='OAuth authentication failed')
 
+def allocate_username(db, base):
+    """A free username: `base` itself, or else `base` with the next numeric suffix.
+
+    Call within the write transaction that inserts the user. The last suffix
+    given out for each base is kept in username_suffixes, so a common base
+    costs the same few queries however many users already share it. The
+    counter is (re)started after the highest suffix in use, found with one
+    range query, when there is none yet or its next suffix has been taken
+    some other way, e.g. by someone registering 'john2'.
+    """
+    def is_taken(username):
+        return queries.execute(db, 'username_exists', {'username': username}).fetchone()['user_exists']
+
+    if not is_taken(base):
+        return base
+
+    row = queries.execute(db, 'username_suffix_claim', {'base': base}).fetchone()
+    if row is not None and not is_taken(f"{base}{row['last_suffix']}"):
+        return f"{base}{row['last_suffix']}"
+
+    highest = queries.execute(db, 'username_highest_suffix', {'base': base}).fetchone()[0] or 0
+    suffix = highest + 1
+    queries.execute(db, 'username_suffix_set', {'base': base, 'last_suffix': suffix})
+    return f"{base}{suffix}"
+
 def process_oauth_login(provider, user_info):
     """Process OAuth login and create/update user"""
-    with db_transaction() as db:
-        provider_user_id = user_info.get('id')
-        email = user_info.get('email')
-        display_name = user_info.get('name')
-        
-        if not provider_user_id or not email:
-            return {'success': False, 'message': 'Incomplete user information from OAuth provider'}
-        
+    provider_user_id = user_info.get('id')
+    email = user_info.get('email')
+    display_name = user_info.get('name')
+
+    if not provider_user_id or not email:
+        return {'success': False, 'message': 'Incomplete user information from OAuth provider'}
+
+    def find_or_create_user(db):
         # Check if OAuth account already exists
-        oauth_query = """
-            select u.id, u.username, u.email, u.fullname, u.admin 
-            from users u
-            join user_oauth_accounts uoa on u.id = uoa.user_id
-            where uoa.provider = :provider and uoa.provider_user_id = :provider_user_id
-        """
-        
-        existing_oauth_user = db.execute(oauth_query, {
+        existing_oauth_user = queries.execute(db, 'user_by_oauth_account', {
             "provider": provider,
             "provider_user_id": provider_user_id
         }).fetchone()
         
         if existing_oauth_user:
             # User exists with this OAuth account
-            user = existing_oauth_user
+            return existing_oauth_user
+
+        # Check if user exists by email
+        existing_email_user = queries.execute(db, 'user_by_email', {"email": email}).fetchone()
+        
+        if existing_email_user:
+            # Link OAuth account to existing user
+            user = existing_email_user
         else:
-            # Check if user exists by email
-            email_query = "select id, username, email, fullname, admin from users where email = :email"
-            existing_email_user = db.execute(email_query, {"email": email}).fetchone()
+            # Create new user, with a username made from their email
+            username = allocate_username(db, email.split('@')[0])
+            user = queries.execute(db, 'user_insert_from_oauth', {
+                "email": email,
+                "fullname": display_name or email,
+                "username": username
+            }).fetchone()
             
-            if existing_email_user:
-                # Link OAuth account to existing user
-                user = existing_email_user
-                db.execute("""
-                    insert into user_oauth_accounts (user_id, provider, provider_user_id, email)
-                    values (:user_id, :provider, :provider_user_id, :email)
-                """, {
-                    "user_id": user['id'],
-                    "provider": provider,
-                    "provider_user_id": provider_user_id,
-                    "email": email
-                })
-            else:
-                # Create new user
-                insert_user_query = """
-                    insert into users (email, fullname, username, admin)
-                    values (:email, :fullname, :username, false)
-                    returning id, username, email, fullname, admin
-                """
-                
-                # Generate username from email if not provided
-                username = email.split('@')[0]
-                # Handle username conflicts by appending numbers
-                base_username = username
-                counter = 1
-                while True:
-                    check_username = db.execute("select id from users where username = :username", 
-                                              {"username": username}).fetchone()
-                    if not check_username:
-                        break
-                    username = f"{base_username}{counter}"
-                    counter += 1
-                
-                user = db.execute(insert_user_query, {
-                    "email": email,
-                    "fullname": display_name or email,
-                    "username": username
-                }).fetchone()
-                
-                # Create OAuth account link
-                db.execute("""
-                    insert into user_oauth_accounts (user_id, provider, provider_user_id, email)
-                    values (:user_id, :provider, :provider_user_id, :email)
-                """, {
-                    "user_id": user['id'],
-                    "provider": provider,
-                    "provider_user_id": provider_user_id,
-                    "email": email
-                })
+        # Create OAuth account link
+        queries.execute(db, 'oauth_account_insert', {
+            "user_id": user['id'],
+            "provider": provider,
+            "provider_user_id": provider_user_id,
+            "email": email
+        })
+        return user
 
-        return {
-            'success': True, 
-            'message': 'OAuth login successful',
-            'user': {
-                'id': user['id'],
-                'username': user['username'],
-                'fullname': user['fullname'],
-                'email': user['email'],
-                'admin': bool(user['admin'])
-            }
+    user = run_write(find_or_create_user)
+    user_cache.put({
+        'id': user['id'],
+        'username': user['username'],
+        'fullname': user['fullname'],
+        'admin': bool(user['admin'])
+    })
+
+    return {
+        'success': True, 
+        'message': 'OAuth login successful',
+        'user': {
+            'id': user['id'],
+            'username': user['username'],
+            'fullname': user['fullname'],
+            'email': user['email'],
+            'admin': bool(user['admin'])
         }
+    }
 
 
 
-@app.get('/api/me')
+@router.get('/api/me')
 def get_me(user_id: int = Depends(get_current_user_id)):
-    with db_transaction() as db:
-        return get_current_user(db, user_id)
+    user = load_user(user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
 
 class ProfileUpdateRequest(BaseModel):
     fullname: str
 
-@app.post('/api/profile')
+@router.post('/api/profile')
 def update_profile(profile_data: ProfileUpdateRequest, user_id: int = Depends(get_current_user_id)):
-    with db_transaction() as db:
-        fullname = profile_data.fullname
+    fullname = profile_data.fullname
 
-        if fullname is None:
-            raise HTTPException(status_code=400, detail="Full name is required")
+    if fullname is None:
+        raise HTTPException(status_code=400, detail="Full name is required")
 
+    def update_fullname(db):
         # Update user profile
-        query = "UPDATE users SET fullname = ? WHERE id = ?"
-        db.execute(query, (fullname, user_id))
+        queries.execute(db, 'user_fullname_update', {'fullname': fullname, 'user_id': user_id})
+        version = bump_cache_version(db, 'users')
 
         # Return updated user data
-        return get_current_user(db, user_id)
+        return get_current_user(db, user_id), version
+
+    user, version = run_write(update_fullname)
+    user_cache.wrote(version)
+    user_cache.put(user)
+    return user
 
 
 class ChangePasswordRequest(BaseModel):
@@ -566,133 +1665,735 @@ class ChangePasswordRequest(BaseModel):
     confirm_password: str
 
 
-@app.post("/api/change-password")
-def change_password(
+@router.post("/api/change-password")
+async def change_password(
     password_data: ChangePasswordRequest, user_id: int = Depends(get_current_user_id)
 ):
-    with db_transaction() as db:
-        current_password = password_data.current_password
-        new_password = password_data.new_password
-        confirm_password = password_data.confirm_password
+    current_password = password_data.current_password
+    new_password = password_data.new_password
+    confirm_password = password_data.confirm_password
+
+    # Validate new password is not blank
+    if not new_password or not new_password.strip():
+        raise HTTPException(status_code=400, detail="New password is required")
+
+    # Validate confirmation password is not blank
+    if not confirm_password or not confirm_password.strip():
+        raise HTTPException(status_code=400, detail="Password confirmation is required")
+
+    # Verify new password and confirmation match
+    if new_password != confirm_password:
+        raise HTTPException(
+            status_code=400, detail="New password and confirmation do not match"
+        )
 
-        # Validate new password is not blank
-        if not new_password or not new_password.strip():
-            raise HTTPException(status_code=400, detail="New password is required")
+    # Get current password hash from database
+    def fetch_password_hash():
+        with db_transaction() as db:
+            return queries.execute(db, 'user_password_by_id', {'user_id': user_id}).fetchone()
 
-        # Validate confirmation password is not blank
-        if not confirm_password or not confirm_password.strip():
-            raise HTTPException(status_code=400, detail="Password confirmation is required")
+    user = await run_in_threadpool(fetch_password_hash)
+
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
 
-        # Verify new password and confirmation match
-        if new_password != confirm_password:
+    # Verify current password if user has one (OAuth users might not have a password)
+    if user["password"]:
+        # If user has a password, current_password must be provided and correct
+        if not current_password:
+            raise HTTPException(status_code=401, detail="Current password is required")
+
+        if not await password_hash_pool.verify(user["password"], current_password):
+            raise HTTPException(status_code=401, detail="Current password is incorrect")
+
+        # Verify new password is different from current
+        if current_password == new_password:
             raise HTTPException(
-                status_code=400, detail="New password and confirmation do not match"
+                status_code=400, detail="New password must be different from current password"
             )
 
-        # Get current password hash from database
-        query = "SELECT password FROM users WHERE id = ?"
-        user = db.execute(query, (user_id,)).fetchone()
+    # Hash new password
+    new_password_hash = await password_hash_pool.hash(new_password)
+
+    def update_password(db):
+        queries.execute(db, 'user_password_update', {'password': new_password_hash, 'user_id': user_id})
+        return bump_cache_version(db, 'users')
+
+    version = await run_in_threadpool(run_write, update_password)
+    user_cache.wrote(version)
+    user_cache.invalidate(user_id)
+
+    return {"success": True, "message": "Password updated successfully"}
 
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
 
-        # Verify current password if user has one (OAuth users might not have a password)
-        if user["password"]:
-            # If user has a password, current_password must be provided and correct
-            if not current_password:
-                raise HTTPException(status_code=401, detail="Current password is required")
+class RateLimiter:
+    """Token buckets per key (an IP address or a user id) in this worker's memory.
 
-            if not verify_password(user["password"], current_password):
-                raise HTTPException(status_code=401, detail="Current password is incorrect")
+    Each key may make `burst` requests at once, refilled at `rate` per second.
+    Buckets are kept in least recently used order: one idle long enough to
+    have refilled is no different from a new one, so those are swept from the
+    front, and beyond `max_keys` the least recently used are dropped.
+    """
+
+    def __init__(self, rate, burst, max_keys):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.limited = 0
+
+    def allow(self, key):
+        """Take a token for `key`, returning (allowed, seconds until one is available)."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            else:
+                self.limited += 1
+            self._buckets[key] = (tokens, now)
+            self._sweep(now)
+        return allowed, 0 if allowed else (1 - tokens) / self.rate
 
-            # Verify new password is different from current
-            if current_password == new_password:
-                raise HTTPException(
-                    status_code=400, detail="New password must be different from current password"
-                )
+    def _sweep(self, now):
+        refill_seconds = self.burst / self.rate
+        while self._buckets:
+            key, (_, updated) = next(iter(self._buckets.items()))
+            if now - updated < refill_seconds and len(self._buckets) <= self.max_keys:
+                break
+            del self._buckets[key]
 
-        # Hash new password
-        new_password_hash = password_hasher.hash(new_password)
+    def stats(self):
+        with self._lock:
+            return {'keys': len(self._buckets), 'limited': self.limited}
 
-        # Update password in database
-        update_query = "UPDATE users SET password = ? WHERE id = ?"
-        db.execute(update_query, (new_password_hash, user_id))
 
-        return {"success": True, "message": "Password updated successfully"}
+class RecentSet:
+    """Hashes of recently seen values, each remembered for `ttl` seconds.
+
+    As with MemoryOAuthStateStore, insertion order is expiry order, so expired
+    hashes are swept from the front, and beyond `max_entries` the oldest go.
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.duplicates = 0
+
+    @staticmethod
+    def _key(value):
+        return hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+
+    def add(self, value):
+        """Remember a value, returning False if it was already remembered (a duplicate)."""
+        key = self._key(value)
+        now = time.monotonic()
+        with self._lock:
+            while self._entries:
+                oldest, expires_at = next(iter(self._entries.items()))
+                if expires_at > now:
+                    break
+                del self._entries[oldest]
+            if key in self._entries:
+                self.duplicates += 1
+                return False
+            self._entries[key] = now + self.ttl
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return True
+
+    def discard(self, value):
+        """Forget a value, e.g. when what it stood for was not kept after all."""
+        with self._lock:
+            self._entries.pop(self._key(value), None)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'duplicates': self.duplicates}
+
+
+feedback_ip_limiter = None
+feedback_user_limiter = None
+recent_feedback = None
+
+def check_feedback_limits(ip_address, user_id, comments):
+    """Turn away feedback over the rate limits, or repeating the sender's recent comments, with a 429.
+
+    Returns the key the comments are remembered under, or None; it must be
+    discarded from recent_feedback if the feedback isn't stored after all.
+    """
+    checks = [('ip_rate', feedback_ip_limiter, ip_address)]
+    if user_id:
+        checks.append(('user_rate', feedback_user_limiter, user_id))
+    for reason, limiter, key in checks:
+        if limiter is None:
+            continue
+        allowed, retry_after = limiter.allow(key)
+        if not allowed:
+            FEEDBACK_REJECTED.inc(labels=(reason,))
+            raise HTTPException(
+                status_code=429,
+                detail="Too much feedback, please try again later",
+                headers={'Retry-After': str(math.ceil(retry_after))},
+            )
+
+    if recent_feedback is None:
+        return None
+    # Per sender, so that different people sending "Thanks" don't turn each other away
+    sender = f"user:{user_id}" if user_id else f"ip:{ip_address}"
+    duplicate_key = f"{sender}\n{comments}"
+    if not recent_feedback.add(duplicate_key):
+        FEEDBACK_REJECTED.inc(labels=('duplicate',))
+        raise HTTPException(status_code=429, detail="This feedback has already been received")
+    return duplicate_key
 
 
 class FeedbackRequest(BaseModel):
     comments: str
     email: Optional[str] = None
 
-@app.post('/api/feedback')
+@router.post('/api/feedback')
 def submit_feedback(feedback_data: FeedbackRequest, request: Request):
     """Submit user feedback.
 
     Accepts feedback from both authenticated and anonymous users.
     """
-    with db_transaction() as db:
-        comments = feedback_data.comments.strip()
-        if not comments:
-            raise HTTPException(status_code=400, detail="Comments are required and must be a non-empty string")
-
-        if len(comments) > 5000:  # Reasonable length limit
-            raise HTTPException(status_code=400, detail="Comments must be 5000 characters or less")
-
-        # Optional email validation
-        email = None
-        if feedback_data.email:
-            email = feedback_data.email.strip()
-            if len(email) > 255:  # Standard email field length
-                raise HTTPException(status_code=400, detail="Email must be 255 characters or less")
-            if not email:  # Empty string becomes None
-                email = None
-
-        # Get user ID if authenticated (optional)
-        user_id = get_user_id_from_cookie(request)
-
-        # Get user agent and IP address from request
-        user_agent = request.headers.get('user-agent', '')
-        # Get real IP address, accounting for proxies
-        ip_address = (request.headers.get('x-forwarded-for') or
-                     request.headers.get('x-real-ip') or
-                     request.client.host)
-
-        # If X-Forwarded-For contains multiple IPs, take the first one
-        if ip_address and ',' in ip_address:
-            ip_address = ip_address.split(',')[0].strip()
-
-        # Insert feedback into database
-        insert_query = """
-            insert into user_feedback (user_id, email, comments, user_agent, ip_address, status)
-            values (:user_id, :email, :comments, :user_agent, :ip_address, :status)
-        """
+    comments = feedback_data.comments.strip()
+    if not comments:
+        raise HTTPException(status_code=400, detail="Comments are required and must be a non-empty string")
+
+    if len(comments) > 5000:  # Reasonable length limit
+        raise HTTPException(status_code=400, detail="Comments must be 5000 characters or less")
+
+    # Optional email validation
+    email = None
+    if feedback_data.email:
+        email = feedback_data.email.strip()
+        if len(email) > 255:  # Standard email field length
+            raise HTTPException(status_code=400, detail="Email must be 255 characters or less")
+        if not email:  # Empty string becomes None
+            email = None
+
+    # Get user ID if authenticated (optional)
+    user_id = get_user_id_from_cookie(request)
 
-        cursor = db.execute(insert_query, {
-            "user_id": user_id,
-            "email": email,
-            "comments": comments,
-            "user_agent": user_agent,
-            "ip_address": ip_address,
-            "status": "new"
-        })
+    # Get user agent and IP address from request
+    user_agent = request.headers.get('user-agent', '')
+    ip_address = client_ip(request)
+
+    # Spam is turned away here, before it costs a database connection
+    duplicate_key = check_feedback_limits(ip_address, user_id, comments)
+
+    feedback = {
+        "user_id": user_id,
+        "email": email,
+        "comments": comments,
+        "user_agent": user_agent,
+        "ip_address": ip_address,
+        "status": "new"
+    }
+
+    def insert_feedback(db):
+        return queries.execute(db, 'feedback_insert', feedback).lastrowid
+
+    try:
+        if feedback_ingestor is not None:
+            feedback_id = feedback_ingestor.submit(feedback)
+        else:
+            feedback_id = run_write(insert_feedback)
+    except Exception:
+        # Not stored, so a retry mustn't be turned away as a duplicate
+        if duplicate_key is not None:
+            recent_feedback.discard(duplicate_key)
+        raise
+
+    return {
+        'success': True,
+        'message': 'Feedback submitted successfully',
+        'feedback_id': feedback_id
+    }
+
+
+def reserve_feedback_ids(db, count):
+    """Reserve `count` user_feedback ids, returning the first.
 
-        feedback_id = cursor.lastrowid
+    The ids are reserved by moving the table's autoincrement sequence past
+    them, so no other insert, in this worker or another, can be given them.
+    """
+    row = queries.execute(db, 'feedback_sequence').fetchone()
+    if row is None:
+        first_id = 1
+        queries.execute(db, 'feedback_sequence_insert', {'seq': count})
+    else:
+        first_id = row['seq'] + 1
+        queries.execute(db, 'feedback_sequence_update', {'seq': row['seq'] + count})
+    return first_id
+
+
+class FeedbackIngestor:
+    """Write-behind ingestion of feedback submissions.
+
+    Submissions are given an id straight away, from a block reserved with
+    reserve_feedback_ids (the next block is reserved once the current one is
+    half used, outside the submit lock), and queued in memory. A background thread inserts
+    them with executemany, flushing once `batch_size` rows are waiting or
+    `flush_interval` seconds after the first of them arrived. When the queue
+    is full, submissions are refused with a 503.
+    """
+
+    _STOP = object()
+    flush_attempts = 3
+    retry_delay = 0.1  # seconds, times the attempt number
+
+    def __init__(self, batch_size, flush_interval, max_queued, id_block_size):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.id_block_size = id_block_size
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._lock = threading.Lock()
+        self._reserve_lock = threading.Lock()
+        self._next_id = 0
+        self._end_id = 0
+        self._spare_id = None
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='feedback-ingestor', daemon=True)
+
+        self.submitted = 0
+        self.rejected = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.failed_rows = 0
+        self.flush_seconds_total = 0.0
+        self.flush_seconds_max = 0.0
+
+        self._thread.start()
+
+    def submit(self, feedback):
+        """Queue a feedback row for insertion and return the id it will be inserted with."""
+        while True:
+            with self._lock:
+                if self._stopped:
+                    raise HTTPException(status_code=503, detail="Feedback is not being accepted right now")
+                if self._queue.full():
+                    self.rejected += 1
+                    raise HTTPException(status_code=503, detail="Too much feedback right now, please retry")
+                feedback_id = self._take_id()
+                if feedback_id is not None:
+                    # Only this method adds to the queue (under the lock), so there is room
+                    self._queue.put_nowait(dict(feedback, id=feedback_id))
+                    self.submitted += 1
+                    reserve_ahead = self._spare_id is None and self._end_id - self._next_id <= self.id_block_size // 2
+            if feedback_id is not None:
+                break
+            # Out of ids: reserve a block, or wait while another thread does
+            with self._reserve_lock:
+                with self._lock:
+                    needed = self._spare_id is None and self._next_id == self._end_id
+                if needed:
+                    self._reserve_ids()
+
+        # Once the block is half used, reserve the next, so that submits rarely have to wait for one
+        if reserve_ahead and self._reserve_lock.acquire(blocking=False):
+            try:
+                with self._lock:
+                    needed = self._spare_id is None
+                if needed:
+                    self._reserve_ids()
+            except HTTPException as e:
+                # The submission is queued regardless; a later one will try again
+                logging.warning(f"Could not reserve feedback ids ahead: {e.detail}")
+            finally:
+                self._reserve_lock.release()
+        return feedback_id
+
+    def _take_id(self):
+        """The next reserved id, or None if they have all been used. Called holding the lock."""
+        if self._next_id == self._end_id:
+            if self._spare_id is None:
+                return None
+            self._next_id, self._end_id = self._spare_id, self._spare_id + self.id_block_size
+            self._spare_id = None
+        feedback_id = self._next_id
+        self._next_id += 1
+        return feedback_id
+
+    def _reserve_ids(self):
+        """Reserve a spare block of ids, holding the reservation lock but not the main lock."""
+        first_id = run_write(lambda db: reserve_feedback_ids(db, self.id_block_size))
+        with self._lock:
+            self._spare_id = first_id
+
+    def stop(self):
+        """Refuse new submissions, flush everything already queued and stop the thread."""
+        with self._lock:
+            self._stopped = True
+            self._queue.put(self._STOP)
+        self._thread.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is self._STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+
+    def _flush(self, batch):
+        """Insert a batch, retrying it, and then row by row so that only rows that can't be written are lost."""
+        start = time.perf_counter()
+        if self._insert(batch, self.flush_attempts):
+            self.flushed_rows += len(batch)
+        else:
+            for row in batch:
+                if self._insert([row], 1):
+                    self.flushed_rows += 1
+                else:
+                    self.failed_rows += 1
+                    logging.error(f"Dropped feedback {row['id']}, it could not be inserted")
+        elapsed = time.perf_counter() - start
+
+        self.flushes += 1
+        self.flush_seconds_total += elapsed
+        if elapsed > self.flush_seconds_max:
+            self.flush_seconds_max = elapsed
+
+    def _insert(self, rows, attempts):
+        """Insert rows in one transaction, trying up to `attempts` times; returns whether it worked."""
+        for attempt in range(1, attempts + 1):
+            try:
+                run_write(lambda db: queries.executemany(db, 'feedback_insert_with_id', rows))
+                return True
+            # Anything escaping would kill the ingestor thread
+            except Exception as e:
+                detail = e.detail if isinstance(e, HTTPException) else repr(e)
+                logging.warning(f"Failed to insert {len(rows)} feedback rows (attempt {attempt}): {detail}")
+                if attempt < attempts:
+                    time.sleep(self.retry_delay * attempt)
+        return False
 
+    def stats(self):
         return {
-            'success': True,
-            'message': 'Feedback submitted successfully',
-            'feedback_id': feedback_id
+            'queued': self._queue.qsize(),
+            'submitted': self.submitted,
+            'rejected': self.rejected,
+            'flushes': self.flushes,
+            'flushed_rows': self.flushed_rows,
+            'failed_rows': self.failed_rows,
+            'flush_seconds_total': self.flush_seconds_total,
+            'flush_seconds_max': self.flush_seconds_max,
         }
 
 
+feedback_ingestor = None
+
+
+FEEDBACK_STATUSES = ('new', 'reviewed', 'resolved')
+FEEDBACK_COLUMNS = queries.FEEDBACK_COLUMNS
+FEEDBACK_PAGE_MAX = 200
+FEEDBACK_EXPORT_CHUNK = 1000
+
+def encode_feedback_cursor(row):
+    """An opaque cursor for the position after `row` in (created_at, id) order."""
+    position = json.dumps([row['created_at'], row['id']]).encode('utf-8')
+    return base64.urlsafe_b64encode(position).decode('ascii')
+
+def decode_feedback_cursor(cursor):
+    try:
+        created_at, feedback_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(created_at, str) or not isinstance(feedback_id, int):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return created_at, feedback_id
+
+def check_feedback_statuses(statuses):
+    for feedback_status in statuses or []:
+        if feedback_status not in FEEDBACK_STATUSES:
+            raise HTTPException(status_code=400, detail=f"Status must be one of: {', '.join(FEEDBACK_STATUSES)}")
+
+def fetch_feedback_page(db, statuses, after, limit, newest_first=True):
+    """Up to `limit` feedback rows following the (created_at, id) position `after`.
+
+    Paging by keyset rather than offset means each page is one range scan of
+    the (status, created_at) or (created_at) index, however deep it is.
+    """
+    status_filter, parameters = queries.feedback_status_filter(statuses)
+    if after is not None:
+        parameters['created_at'], parameters['id'] = after
+    parameters['limit'] = limit
+    name = queries.feedback_page_query_name(newest_first, status_filter, after is not None)
+    return [dict(row) for row in queries.execute(db, name, parameters)]
+
+@router.get('/api/admin/feedback')
+def list_feedback(
+    statuses: Optional[list[str]] = Query(None, alias='status'),
+    cursor: Optional[str] = None,
+    limit: int = 50,
+    user_id: int = Depends(require_admin_user),
+):
+    """List feedback newest first, a page at a time; pass back `next_cursor` for the next page."""
+    check_feedback_statuses(statuses)
+    if not 1 <= limit <= FEEDBACK_PAGE_MAX:
+        raise HTTPException(status_code=400, detail=f"Limit must be between 1 and {FEEDBACK_PAGE_MAX}")
+    after = decode_feedback_cursor(cursor) if cursor else None
+
+    with db_transaction() as db:
+        # One extra row tells us whether there is another page
+        rows = fetch_feedback_page(db, statuses, after, limit + 1)
+
+    next_cursor = encode_feedback_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return {'feedback': rows[:limit], 'next_cursor': next_cursor}
+
+def iterate_feedback(statuses):
+    """Every matching feedback row, oldest first, reading a chunk per transaction.
+
+    No connection is held between chunks, so a slow download doesn't tie up
+    the pool.
+    """
+    after = None
+    while True:
+        with db_transaction() as db:
+            rows = fetch_feedback_page(db, statuses, after, FEEDBACK_EXPORT_CHUNK, newest_first=False)
+        yield rows
+        if len(rows) < FEEDBACK_EXPORT_CHUNK:
+            return
+        after = (rows[-1]['created_at'], rows[-1]['id'])
+
+def feedback_ndjson(statuses):
+    for rows in iterate_feedback(statuses):
+        if rows:
+            yield ''.join(json.dumps(row) + '\n' for row in rows)
+
+def feedback_csv(statuses):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=FEEDBACK_COLUMNS)
+    writer.writeheader()
+    for rows in iterate_feedback(statuses):
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+@router.get('/api/admin/feedback/export')
+def export_feedback(
+    format: str = 'ndjson',
+    statuses: Optional[list[str]] = Query(None, alias='status'),
+    user_id: int = Depends(require_admin_user),
+):
+    """Stream all the (matching) feedback as NDJSON or CSV, without loading it all into memory."""
+    check_feedback_statuses(statuses)
+    if format == 'ndjson':
+        content, media_type = feedback_ndjson(statuses), 'application/x-ndjson'
+    elif format == 'csv':
+        content, media_type = feedback_csv(statuses), 'text/csv; charset=utf-8'
+    else:
+        raise HTTPException(status_code=400, detail="Format must be ndjson or csv")
+    headers = {'Content-Disposition': f'attachment; filename="feedback.{format}"'}
+    return StreamingResponse(content, media_type=media_type, headers=headers)
+
+# Marks matches in snippets; control characters, so they can't occur in the text being escaped
+SNIPPET_MATCH_START = '\x02'
+SNIPPET_MATCH_END = '\x03'
+
+def fts_query(text):
+    """Turn search box text into an FTS5 query matching all of its words.
+
+    Each word is quoted, so punctuation and FTS operators in the text are
+    searched for rather than interpreted; a trailing * still matches a prefix.
+    """
+    terms = []
+    for word in text.split():
+        prefix = word.endswith('*') and len(word) > 1
+        word = word.rstrip('*')
+        if word:
+            terms.append('"' + word.replace('"', '""') + '"' + ('*' if prefix else ''))
+    return ' '.join(terms)
+
+@router.get('/api/admin/feedback/search')
+def search_feedback(
+    q: str,
+    statuses: Optional[list[str]] = Query(None, alias='status'),
+    limit: int = 20,
+    offset: int = 0,
+    user_id: int = Depends(require_admin_user),
+):
+    """Search feedback comments and email, best matches first.
+
+    Each match has a `snippet` of HTML, escaped, with the matched words in
+    <mark> tags. Pass `next_offset` back as `offset` for the next page.
+    """
+    check_feedback_statuses(statuses)
+    if not 1 <= limit <= FEEDBACK_PAGE_MAX:
+        raise HTTPException(status_code=400, detail=f"Limit must be between 1 and {FEEDBACK_PAGE_MAX}")
+    if offset < 0:
+        raise HTTPException(status_code=400, detail="Offset must not be negative")
+    match = fts_query(q)
+    if not match:
+        raise HTTPException(status_code=400, detail="Search text is required")
+
+    status_filter, parameters = queries.feedback_status_filter(statuses)
+    # One extra row tells us whether there is another page
+    parameters.update({
+        'match_start': SNIPPET_MATCH_START, 'match_end': SNIPPET_MATCH_END, 'match': match,
+        'limit': limit + 1, 'offset': offset,
+    })
+    name = queries.feedback_search_query_name(status_filter)
+    with db_transaction() as db:
+        rows = [dict(row) for row in queries.execute(db, name, parameters)]
+
+    for row in rows:
+        row['snippet'] = (
+            html.escape(row['snippet'])
+            .replace(SNIPPET_MATCH_START, '<mark>')
+            .replace(SNIPPET_MATCH_END, '</mark>')
+        )
+    next_offset = offset + limit if len(rows) > limit else None
+    return {'feedback': rows[:limit], 'next_offset': next_offset}
+
+
+@router.get('/api/admin/stats')
+def get_stats(user_id: int = Depends(require_admin_user)):
+    """Pool and cache statistics, for sizing them in config."""
+    stats = {
+        'db_pool': db_pool.stats(),
+        'db_read_pool': db_read_pool.stats(),
+        'password_hashing': password_hash_pool.stats(),
+        'token_cache': token_cache.stats(),
+        'user_cache': user_cache.stats(),
+        'oauth_states': oauth_state_store.stats(),
+        'login_throttle': login_throttle.stats(),
+        'queries': queries.stats(),
+    }
+    if db_writer is not None:
+        stats['db_writer'] = db_writer.stats()
+    if feedback_ingestor is not None:
+        stats['feedback_ingestion'] = feedback_ingestor.stats()
+    if feedback_ip_limiter is not None:
+        stats['feedback_ip_limiter'] = feedback_ip_limiter.stats()
+        stats['feedback_user_limiter'] = feedback_user_limiter.stats()
+    if recent_feedback is not None:
+        stats['recent_feedback'] = recent_feedback.stats()
+    return stats
+
+
+def require_metrics_access(request: Request):
+    """FastAPI dependency for the metrics: a scraper's bearer token, or else an admin's cookie."""
+    metrics_token = config.get('metricsToken')
+    authorization = request.headers.get('authorization', '')
+    if metrics_token and authorization.startswith('Bearer '):
+        if hmac.compare_digest(authorization[len('Bearer '):].encode('utf-8'), metrics_token.encode('utf-8')):
+            return
+        raise HTTPException(status_code=403, detail="Invalid metrics token")
+    require_admin_user(request)
+
+@router.get('/metrics', dependencies=[Depends(require_metrics_access)])
+def get_metrics():
+    """Request, database and hashing metrics for this process, in Prometheus text format."""
+    return Response(content=metrics.REGISTRY.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def shutdown_app():
+    """Stop the background threads and close the pools set up by configure_app."""
+    global feedback_ingestor, db_writer, password_hash_pool, user_cache, db_read_pool, db_pool
+
+    # Queued feedback is flushed through the writer and the pool, so it goes first
+    if feedback_ingestor is not None:
+        feedback_ingestor.stop()
+        feedback_ingestor = None
+    if db_writer is not None:
+        db_writer.stop()
+        db_writer = None
+    if password_hash_pool is not None:
+        password_hash_pool.shutdown()
+        password_hash_pool = None
+    if user_cache is not None:
+        user_cache.close()
+        user_cache = None
+    if db_read_pool is not None:
+        db_read_pool.close()
+        db_read_pool = None
+    if db_pool is not None:
+        db_pool.close()
+        db_pool = None
+    close_oauth_http_client()
+
+
+def prepare_database(db_filepath):
+    """Create the database if it doesn't exist yet, and bring its schema up to date."""
+    # A new database starts as a copy of the migrated template
+    if db_filepath != ':memory:' and not os.path.exists(db_filepath):
+        migrations.create_database(db_filepath)
+
+    # Bring the database schema up to date, this is a single query when it already is
+    applied = migrations.migrate(db_filepath)
+    if applied:
+        logging.info(f"Applied migrations: {', '.join(applied)}")
+
 def configure_app(config_dict):
     """Configure JWT and logging after config is loaded."""
+    shutdown_app()
+
     global config
     config = config_dict
 
     config['jwtSecret'] = os.getenv(config['jwtSecretVar'])
-    
+    # Scrapers present this token rather than an admin's cookie; without one /metrics is admin only
+    config['metricsToken'] = os.getenv(config['metricsTokenVar']) if 'metricsTokenVar' in config else None
+
+    # The cache holds tokens verified with the previous secret, so always start afresh
+    global token_cache
+    token_cache = TokenCache(max_size=int(config.get('tokenCacheSize', 10000)))
+
+    global db_pool
+    db_pool = ConnectionPool(
+        config['dbFilepath'],
+        size=int(config.get('dbPoolSize', 8)),
+        timeout=float(config.get('dbPoolTimeout', 10.0)),
+    )
+
+    global db_read_pool
+    db_read_pool = ConnectionPool(
+        config['dbFilepath'],
+        size=int(config.get('dbReadPoolSize', config.get('dbPoolSize', 8))),
+        timeout=float(config.get('dbPoolTimeout', 10.0)),
+        read_only=True,
+    )
+
+    hasher_params = password_hasher_params(config)
+    configure_password_hasher(hasher_params)
+
+    global password_hash_pool
+    password_hash_pool = PasswordHashPool(
+        workers=int(config.get('hashWorkers', 0)),
+        max_pending=int(config.get('hashQueueDepth', 64)),
+        hasher_params=hasher_params,
+    )
+
+    global asset_manifest
+    asset_manifest = build_assets.read_manifest(build_assets.STATIC_DIR)
+
+    global index_page
+    index_page = IndexPage()
+
     # Configure logging based on config
     if config.get('prettyLogging', False):
         logging.basicConfig(
@@ -703,49 +2404,172 @@ def configure_app(config_dict):
         logger = logging.getLogger(__name__)
         logger.info(f"Starting application with config: {config['dbFilepath']}")
 
-    # Initialize database schema if using in-memory database, temp file, or if it doesn't exist  
-    needs_init = (config['dbFilepath'] == ':memory:' or 
-                  not os.path.exists(config['dbFilepath']) or
-                  '/tmp/' in config['dbFilepath'])  # Force init for temp files
-    
-    if needs_init:
-        init_test_database()
-    
-def init_test_database():
-    """Initialize database schema by executing SQL migration files."""
-    with db_transaction() as db:
-        # Execute the create users table migration
-        migration_files = [
-            'sql/migrations/001-create-users-table.sql',
-            'sql/migrations/002-add-oauth-accounts.sql',
-            'sql/migrations/003-user-feedback.sql',
-        ]
-        for migration_file in migration_files:
-            with open(migration_file, 'r') as f:
-                sql_content = f.read()
-            db.executescript(sql_content)
+    prepare_database(config['dbFilepath'])
 
+    # Started after the schema exists, since these open their connections straight away
+    global user_cache
+    user_cache = UserCache(
+        config['dbFilepath'],
+        max_size=int(config.get('userCacheSize', 10000)),
+        ttl=float(config.get('userCacheTtl', 60)),
+    )
 
-if __name__ == '__main__':
+    global db_writer
+    if config.get('dbWriterThread', False):
+        db_writer = DatabaseWriter(config['dbFilepath'], batch_size=int(config.get('dbWriterBatchSize', 64)))
+
+    # Shared by every OAuth callback, so connections to Google are kept alive between logins
+    global oauth_http_client
+    oauth_http_client = create_oauth_http_client()
+
+    global oauth_state_store
+    oauth_state_ttl = float(config.get('oauthStateTtl', 600))
+    oauth_state_max_entries = int(config.get('oauthStateMaxEntries', 10000))
+    if config.get('oauthStateStore', 'memory') == 'sqlite':
+        oauth_state_store = SqliteOAuthStateStore(oauth_state_ttl, oauth_state_max_entries)
+    else:
+        oauth_state_store = MemoryOAuthStateStore(oauth_state_ttl, oauth_state_max_entries)
+
+    global trusted_proxies
+    trusted_proxies = tuple(ipaddress.ip_network(proxy, strict=False) for proxy in config.get('trustedProxies', []))
+
+    global login_throttle
+    login_failure_window = float(config.get('loginFailureWindow', 3600))
+    login_backoff_base = float(config.get('loginBackoffBase', 1))
+    login_backoff_max = float(config.get('loginBackoffMax', 900))
+    username_backoff = LoginBackoff(
+        int(config.get('loginFreeAttempts', 5)), login_backoff_base, login_backoff_max, login_failure_window,
+    )
+    # Many people can share an address, so an IP gets more attempts than a username
+    ip_backoff = LoginBackoff(
+        int(config.get('loginIpFreeAttempts', 20)), login_backoff_base, login_backoff_max, login_failure_window,
+    )
+    login_throttle_max_entries = int(config.get('loginThrottleMaxEntries', 100000))
+    if config.get('loginThrottleStore', 'memory') == 'sqlite':
+        login_throttle = SqliteLoginThrottle(username_backoff, ip_backoff, login_throttle_max_entries)
+    else:
+        login_throttle = MemoryLoginThrottle(username_backoff, ip_backoff, login_throttle_max_entries)
+
+    global feedback_ip_limiter, feedback_user_limiter, recent_feedback
+    feedback_rate = float(config.get('feedbackRatePerMinute', 10)) / 60
+    feedback_burst = int(config.get('feedbackBurst', 10))
+    feedback_rate_keys = int(config.get('feedbackRateLimitKeys', 100000))
+    feedback_ip_limiter = feedback_user_limiter = None
+    if feedback_rate > 0:
+        feedback_ip_limiter = RateLimiter(feedback_rate, feedback_burst, feedback_rate_keys)
+        feedback_user_limiter = RateLimiter(feedback_rate, feedback_burst, feedback_rate_keys)
+    recent_feedback = None
+    feedback_duplicate_window = float(config.get('feedbackDuplicateWindow', 600))
+    if feedback_duplicate_window > 0:
+        recent_feedback = RecentSet(feedback_duplicate_window, int(config.get('feedbackDuplicateMaxEntries', 100000)))
+
+    global feedback_ingestor
+    if config.get('feedbackWriteBehind', False):
+        feedback_ingestor = FeedbackIngestor(
+            batch_size=int(config.get('feedbackBatchSize', 100)),
+            flush_interval=float(config.get('feedbackFlushInterval', 0.5)),
+            max_queued=int(config.get('feedbackQueueSize', 10000)),
+            id_block_size=int(config.get('feedbackIdBlockSize', 100)),
+        )
 
-    if len(sys.argv) < 2:
-        print("Usage: python app.py <config_file.json>")
-        sys.exit(1)
 
-    config_file = sys.argv[1]
+class PrecompressedStaticFiles(StaticFiles):
+    """Static files, with the fingerprinted assets served precompressed and cached forever.
+
+    A file under dist/ has a hash of its content in its name, so it never
+    changes; build_assets.py writes its .br and .gz variants alongside it.
+    """
+
+    async def get_response(self, path, scope):
+        if path.split(os.sep)[0] != build_assets.DIST_DIR:
+            return await super().get_response(path, scope)
+
+        encoding = choose_content_encoding(Headers(scope=scope).get('accept-encoding', ''))
+        response = None
+        if encoding != 'identity':
+            try:
+                response = await super().get_response(path + build_assets.COMPRESSED_SUFFIXES[encoding], scope)
+                response.headers['Content-Encoding'] = encoding
+            except StarletteHTTPException:
+                response = None
+        if response is None:
+            response = await super().get_response(path, scope)
+
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+
+def create_app():
+    """Build the FastAPI application, with the static files mounted and every route included."""
+    fastapi_app = FastAPI(lifespan=lifespan)
+    fastapi_app.add_middleware(MetricsMiddleware)
+    # Mount static files
+    fastapi_app.mount("/static", PrecompressedStaticFiles(directory=build_assets.STATIC_DIR), name="static")
+    fastapi_app.include_router(router)
+    return fastapi_app
+
+app = create_app()
+
+
+CONFIG_FILE_ENV_VAR = 'APP_CONFIG_FILE'
+
+def load_config(config_file):
+    """Load a JSON config file, exiting with a message if it can't be read."""
     try:
         with open(config_file, 'r') as f:
-            config_dict = json.load(f)
+            return json.load(f)
     except Exception as e:
         print(f"Error loading configuration: {e}")
         sys.exit(1)
 
-    configure_app(config_dict)
+def create_configured_app():
+    """App factory for server worker processes.
+
+    Each worker calls this after it has been started, so the pools, caches and
+    threads set up by configure_app belong to that worker. The config file is
+    passed down in the APP_CONFIG_FILE environment variable.
+    """
+    configure_app(load_config(os.environ[CONFIG_FILE_ENV_VAR]))
+    return create_app()
+
+def run_server(config_file):
+    """Run the server with the settings from the config file.
 
-    # Run the application with settings from config
-    uvicorn.run(
-        app,
-        host='localhost',
-        port=config.get('port', 8080),
-        log_level="debug" if config.get('debug', False) else "info"
+    With `workers` above 1, uvicorn starts that many worker processes, each
+    building its own app through create_configured_app. A worker runs this
+    file as __mp_main__ before importing it as `app`, so nothing at module
+    level here may only run once; the metrics are in app_metrics.py for that.
+    """
+    config_dict = load_config(config_file)
+    workers = int(config_dict.get('workers', 1))
+
+    server_options = dict(
+        host=config_dict.get('host', 'localhost'),
+        port=config_dict.get('port', 8080),
+        log_level="debug" if config_dict.get('debug', False) else "info",
+        loop=config_dict.get('loop', 'auto'),  # 'auto' picks uvloop when installed
+        http=config_dict.get('http', 'auto'),  # 'auto' picks httptools when installed
+        backlog=int(config_dict.get('backlog', 2048)),
+        timeout_keep_alive=int(config_dict.get('keepAliveTimeout', 5)),
+        # On shutdown, in-flight requests get this long to finish before the lifespan drains the queues
+        timeout_graceful_shutdown=int(config_dict.get('gracefulShutdownTimeout', 30)),
     )
+
+    if workers > 1:
+        # Once, before the workers start, rather than in every worker at once
+        prepare_database(config_dict['dbFilepath'])
+        os.environ[CONFIG_FILE_ENV_VAR] = os.path.abspath(config_file)
+        uvicorn.run("app:create_configured_app", factory=True, workers=workers, **server_options)
+    else:
+        configure_app(config_dict)
+        uvicorn.run(app, **server_options)
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 2:
+        print("Usage: python app.py <config_file.json>")
+        sys.exit(1)
+
+    run_server(sys.argv[1])
@@ -0,0 +1,2 @@
+title = "My Application"
+favicon_emoji = "X"
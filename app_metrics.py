@@ -0,0 +1,31 @@
+"""The app's metrics.
+
+These are defined here rather than in app.py because app.py is also run as
+a script. Each server worker process started by `python app.py` runs the
+script again as __mp_main__ and then imports it as `app`, so a metric
+defined in app.py would be registered twice. This module is only ever
+imported by name, so there is one of each metric per process.
+"""
+import metrics
+
+REQUEST_DURATION = metrics.Histogram(
+    'http_request_duration_seconds', 'Time taken to handle a request',
+    labelnames=('method', 'route', 'status'),
+)
+REQUESTS_IN_FLIGHT = metrics.Gauge('http_requests_in_flight', 'Requests currently being handled')
+DB_TRANSACTION_DURATION = metrics.Histogram(
+    'db_transaction_duration_seconds', 'Time a connection is held inside db_transaction, excluding the wait for it',
+)
+DB_READ_DURATION = metrics.Histogram(
+    'db_read_duration_seconds', 'Time a read-only connection is held inside db_read, excluding the wait for it',
+)
+DB_POOL_WAIT = metrics.Histogram('db_pool_wait_seconds', 'Time spent waiting for a pooled database connection')
+PASSWORD_HASH_DURATION = metrics.Histogram(
+    'password_hash_duration_seconds', 'Time taken by argon2 hashing and verification, including any queueing',
+    labelnames=('operation',), buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+LOGIN_THROTTLED = metrics.Counter('login_throttled_total', 'Login attempts refused by the failure backoff')
+FEEDBACK_REJECTED = metrics.Counter(
+    'feedback_rejected_total', 'Feedback turned away before reaching the database',
+    labelnames=('reason',),
+)
@@ -0,0 +1,378 @@
+"""HTTP load test: run the server against a temporary database and measure it.
+
+The server is started as `python app.py` with a config derived from
+config.dev.json, on a free port and a fresh database cloned from the
+migration template. A number of virtual users, each with its own account,
+then make requests drawn from a weighted workload mix for a fixed time.
+
+The report gives requests per second and p50/p95/p99 latencies overall and
+per operation, as JSON and/or Markdown. Given a baseline report it exits
+non-zero if throughput has dropped, or p95 latency risen, by more than the
+allowed regression.
+
+Usage: python -m benchmarks.load [--mix mixed] [--concurrency 20] [--duration 10]
+           [--json report.json] [--markdown report.md]
+           [--baseline baseline.json] [--max-regression 20]
+(from the repository root)
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+AUTH_COOKIE_NAME = 'auth_token'
+PASSWORD = 'benchmark-password'
+username_counter = itertools.count()
+
+
+def unique_username(prefix):
+    return f"{prefix}{os.getpid()}x{next(username_counter)}"
+
+
+class VirtualUser:
+    """One simulated user: an account and the auth cookie from logging into it."""
+
+    def __init__(self, username):
+        self.username = username
+        self.token = None
+
+    def headers(self):
+        # The cookie is marked secure, which httpx honours, so it is sent by hand over plain http
+        return {'Cookie': f"{AUTH_COOKIE_NAME}={self.token}"} if self.token else {}
+
+    def remember(self, response):
+        token = response.cookies.get(AUTH_COOKIE_NAME)
+        if token:
+            self.token = token
+
+
+async def register(client, user):
+    username = unique_username('bench')
+    return await client.post('/api/register', json={
+        'username': username,
+        'password': PASSWORD,
+        'email': f"{username}@example.com",
+    })
+
+
+async def login(client, user):
+    response = await client.post('/api/login', json={'username': user.username, 'password': PASSWORD})
+    user.remember(response)
+    return response
+
+
+async def index(client, user):
+    return await client.get('/', headers={'Accept-Encoding': 'br, gzip', **user.headers()})
+
+
+async def anonymous_index(client, user):
+    return await client.get('/', headers={'Accept-Encoding': 'br, gzip'})
+
+
+async def me(client, user):
+    return await client.get('/api/me', headers=user.headers())
+
+
+async def profile(client, user):
+    return await client.post(
+        '/api/profile',
+        json={'fullname': f"Bench User {random.randrange(1000)}"},
+        headers=user.headers(),
+    )
+
+
+async def feedback(client, user):
+    return await client.post(
+        '/api/feedback',
+        json={'comments': f"Benchmark feedback {random.randrange(1000000)}"},
+        headers=user.headers(),
+    )
+
+
+# Each mix is a list of (weight, operation)
+WORKLOAD_MIXES = {
+    'mixed': [
+        (15, anonymous_index), (15, index), (30, me), (10, login),
+        (5, register), (10, profile), (15, feedback),
+    ],
+    'read': [(30, anonymous_index), (30, index), (40, me)],
+    'write': [(40, feedback), (40, profile), (20, register)],
+    'auth': [(60, login), (20, register), (20, me)],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Server:
+    """The app running in a subprocess against a fresh, temporary database."""
+
+    def __init__(self, workers=1, config_file=os.path.join(REPO_DIR, 'config.dev.json')):
+        self.tempdir = tempfile.TemporaryDirectory(prefix='load-test-')
+        with open(config_file, 'r') as f:
+            config = json.load(f)
+
+        self.port = free_port()
+        # Not there yet, so the server creates it as on a first deployment
+        db_filepath = os.path.join(self.tempdir.name, 'load.db')
+        config.update({
+            'dbFilepath': db_filepath,
+            'host': '127.0.0.1',
+            'port': self.port,
+            'workers': workers,
+            'debug': False,
+            'prettyLogging': False,
+            'logLevel': 1,
+            # Every virtual user posts from the same address, so measure the write path unthrottled
+            'feedbackRatePerMinute': 0,
+            'feedbackDuplicateWindow': 0,
+        })
+        self.config_path = os.path.join(self.tempdir.name, 'config.json')
+        with open(self.config_path, 'w') as f:
+            json.dump(config, f)
+
+        self.env = dict(os.environ)
+        self.env.setdefault(config['jwtSecretVar'], 'load-test-secret')
+        self.process = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self, timeout=30):
+        self.log = open(os.path.join(self.tempdir.name, 'server.log'), 'wb')
+        self.process = subprocess.Popen(
+            [sys.executable, 'app.py', self.config_path],
+            cwd=REPO_DIR, env=self.env, stdout=self.log, stderr=subprocess.STDOUT,
+        )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited with {self.process.returncode}, see {self.log.name}")
+            try:
+                if httpx.get(self.base_url + '/', timeout=1).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            time.sleep(0.1)
+        raise RuntimeError(f"Server did not start within {timeout}s")
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+            self.log.close()
+        self.tempdir.cleanup()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+async def create_users(client, count):
+    """Register and log in `count` virtual users, a few at a time."""
+    users = [VirtualUser(unique_username('user')) for _ in range(count)]
+    semaphore = asyncio.Semaphore(8)
+
+    async def sign_up(user):
+        async with semaphore:
+            response = await client.post('/api/register', json={
+                'username': user.username,
+                'password': PASSWORD,
+                'email': f"{user.username}@example.com",
+            })
+            response.raise_for_status()
+            user.remember(response)
+
+    await asyncio.gather(*(sign_up(user) for user in users))
+    return users
+
+
+async def run_user(client, user, mix, deadline, results):
+    operations = [operation for _, operation in mix]
+    weights = [weight for weight, _ in mix]
+    while time.perf_counter() < deadline:
+        operation = random.choices(operations, weights)[0]
+        start = time.perf_counter()
+        try:
+            response = await operation(client, user)
+            status = response.status_code
+        except httpx.HTTPError:
+            status = 0
+        results.append((operation.__name__, time.perf_counter() - start, status))
+
+
+async def run_load(base_url, mix, concurrency, duration, warmup=1.0):
+    """Drive the workload, returning (results, elapsed); results are (operation, seconds, status)."""
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        users = await create_users(client, concurrency)
+
+        if warmup:
+            await asyncio.gather(*(
+                run_user(client, user, mix, time.perf_counter() + warmup, []) for user in users
+            ))
+
+        results = []
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            run_user(client, user, mix, start + duration, results) for user in users
+        ))
+        return results, time.perf_counter() - start
+
+
+def percentile(sorted_values, fraction):
+    """The nearest-rank percentile of already sorted values."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def summarise(latencies, statuses, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': sum(1 for status in statuses if not 200 <= status < 400),
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def build_report(results, elapsed, mix_name, concurrency, workers):
+    by_operation = {}
+    for operation, seconds, status in results:
+        by_operation.setdefault(operation, ([], []))
+        by_operation[operation][0].append(seconds)
+        by_operation[operation][1].append(status)
+
+    return {
+        'mix': mix_name,
+        'concurrency': concurrency,
+        'workers': workers,
+        'duration_s': round(elapsed, 2),
+        'overall': summarise([r[1] for r in results], [r[2] for r in results], elapsed),
+        'operations': {
+            operation: summarise(latencies, statuses, elapsed)
+            for operation, (latencies, statuses) in sorted(by_operation.items())
+        },
+    }
+
+
+def compare_to_baseline(report, baseline, max_regression):
+    """The regressions of `report` against `baseline`, as messages; empty if there are none.
+
+    Throughput may drop, and p95 latency rise, by up to `max_regression` percent.
+    """
+    regressions = []
+    allowed = max_regression / 100
+    sections = [('overall', report['overall'], baseline.get('overall'))]
+    sections += [
+        (operation, stats, baseline.get('operations', {}).get(operation))
+        for operation, stats in report['operations'].items()
+    ]
+    for name, current, previous in sections:
+        if not previous:
+            continue
+        if previous['rps'] and current['rps'] < previous['rps'] * (1 - allowed):
+            regressions.append(f"{name}: {current['rps']} rps, baseline {previous['rps']} rps")
+        if previous['p95_ms'] and current['p95_ms'] > previous['p95_ms'] * (1 + allowed):
+            regressions.append(f"{name}: p95 {current['p95_ms']} ms, baseline {previous['p95_ms']} ms")
+    return regressions
+
+
+def markdown_report(report, regressions=None):
+    lines = [
+        f"## Load test: {report['mix']} mix",
+        '',
+        f"{report['concurrency']} concurrent users, {report['workers']} worker(s), {report['duration_s']}s",
+        '',
+        '| Operation | Requests | Errors | RPS | p50 (ms) | p95 (ms) | p99 (ms) |',
+        '|---|---:|---:|---:|---:|---:|---:|',
+    ]
+    rows = list(report['operations'].items()) + [('**overall**', report['overall'])]
+    for name, stats in rows:
+        lines.append(
+            f"| {name} | {stats['requests']} | {stats['errors']} | {stats['rps']} "
+            f"| {stats['p50_ms']} | {stats['p95_ms']} | {stats['p99_ms']} |"
+        )
+    if regressions is not None:
+        lines.append('')
+        if regressions:
+            lines.append('### Regressions against the baseline')
+            lines.extend(f"- {regression}" for regression in regressions)
+        else:
+            lines.append('No regressions against the baseline.')
+    return '\n'.join(lines) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--mix', choices=sorted(WORKLOAD_MIXES), default='mixed')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds to measure for")
+    parser.add_argument('--warmup', type=float, default=1.0, help="seconds to run before measuring")
+    parser.add_argument('--workers', type=int, default=1, help="server worker processes")
+    parser.add_argument('--url', help="test an already running server instead of starting one")
+    parser.add_argument('--json', help="write the JSON report here")
+    parser.add_argument('--markdown', help="write the Markdown report here")
+    parser.add_argument('--baseline', help="JSON report to compare against")
+    parser.add_argument('--max-regression', type=float, default=20.0, help="percent")
+    args = parser.parse_args()
+
+    mix = WORKLOAD_MIXES[args.mix]
+
+    def load(base_url):
+        return asyncio.run(run_load(base_url, mix, args.concurrency, args.duration, args.warmup))
+
+    if args.url:
+        results, elapsed = load(args.url)
+    else:
+        with Server(workers=args.workers) as server:
+            results, elapsed = load(server.base_url)
+
+    report = build_report(results, elapsed, args.mix, args.concurrency, args.workers)
+
+    regressions = None
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compare_to_baseline(report, json.load(f), args.max_regression)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    markdown = markdown_report(report, regressions)
+    if args.markdown:
+        with open(args.markdown, 'w') as f:
+            f.write(markdown)
+    print(markdown)
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
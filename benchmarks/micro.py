@@ -0,0 +1,307 @@
+"""Micro-benchmarks for the per-request primitives in app.py.
+
+Each benchmark times one function call, after a warm-up, as the best of
+several repeats. Along with the time it counts the SQL statements run
+and the JWT decodes made per call. These counts are exact, so any
+increase, such as an accidental extra query, is a regression however
+fast the machine. Times are compared against the baseline with an
+allowance, since they vary between runs and machines.
+
+The app is configured from config.dev.json against a temporary database
+cloned from the migration template.
+
+Usage: python -m benchmarks.micro [--json results.json] [--baseline baseline.json]
+           [--max-regression 25] [benchmark ...]
+(from the repository root)
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+
+import jwt
+from fastapi import Response
+from starlette.requests import Request
+
+import app
+import migrations
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Counts:
+    """Counts of the SQL statements executed and JWTs decoded, across every connection."""
+
+    def __init__(self):
+        self.queries = 0
+        self.jwt_decodes = 0
+
+    def trace(self, statement):
+        self.queries += 1
+
+    @contextlib.contextmanager
+    def installed(self):
+        """Count queries on every connection app opens, and every jwt.decode."""
+        real_open = app.open_db_connection
+        real_decode = jwt.decode
+
+        def counting_open(*args, **kwargs):
+            db = real_open(*args, **kwargs)
+            db.set_trace_callback(self.trace)
+            return db
+
+        def counting_decode(*args, **kwargs):
+            self.jwt_decodes += 1
+            return real_decode(*args, **kwargs)
+
+        app.open_db_connection = counting_open
+        jwt.decode = counting_decode
+        try:
+            yield self
+        finally:
+            app.open_db_connection = real_open
+            jwt.decode = real_decode
+
+
+def make_request(path='/', cookie=None, accept_encoding='br, gzip'):
+    headers = [(b'accept-encoding', accept_encoding.encode('latin-1'))]
+    if cookie is not None:
+        headers.append((b'cookie', f"{app.AUTH_COOKIE_NAME}={cookie}".encode('latin-1')))
+    return Request({
+        'type': 'http',
+        'method': 'GET',
+        'path': path,
+        'query_string': b'',
+        'headers': headers,
+    })
+
+
+def make_token(user_id, expires_in):
+    payload = {
+        'user_id': user_id,
+        'exp': datetime.datetime.now(datetime.UTC) + expires_in,
+    }
+    return jwt.encode(payload, app.config['jwtSecret'], algorithm=app.config['jwtAlgorithm'])
+
+
+class Fixture:
+    """A configured app, with a user and the tokens and requests the benchmarks use."""
+
+    PASSWORD = 'benchmark-password'
+
+    def __init__(self, config_file=os.path.join(REPO_DIR, 'config.dev.json')):
+        self.tempdir = tempfile.TemporaryDirectory(prefix='micro-bench-')
+        with open(config_file, 'r') as f:
+            config = json.load(f)
+        db_filepath = os.path.join(self.tempdir.name, 'micro.db')
+        migrations.create_database(db_filepath)
+        config.update({'dbFilepath': db_filepath, 'prettyLogging': False, 'logLevel': 1, 'debug': False})
+        os.environ.setdefault(config['jwtSecretVar'], 'micro-benchmark-secret')
+        self.config = config
+
+    def setup(self):
+        app.configure_app(self.config)
+        self.hashed_password = app.hash_password(self.PASSWORD)
+        with app.db_transaction() as db:
+            cursor = db.execute(
+                "insert into users (username, email, password) values (?, ?, ?)",
+                ('bench', 'bench@example.com', self.hashed_password),
+            )
+            self.user_id = cursor.lastrowid
+
+        self.valid_token = make_token(self.user_id, datetime.timedelta(days=1))
+        self.expired_token = make_token(self.user_id, datetime.timedelta(days=-1))
+        self.anonymous_request = make_request()
+        self.valid_request = make_request(cookie=self.valid_token)
+        self.expired_request = make_request(cookie=self.expired_token)
+        self.garbage_request = make_request(cookie='not-a-token')
+
+    def close(self):
+        app.shutdown_app()
+        self.tempdir.cleanup()
+
+
+def bench_cookie_valid(fixture):
+    return lambda: app.get_user_id_from_cookie(fixture.valid_request)
+
+def bench_cookie_valid_uncached(fixture):
+    # Swapped in around each call, a cache that keeps nothing, so every call decodes the token
+    no_cache = app.TokenCache(max_size=0)
+
+    def call():
+        cache, app.token_cache = app.token_cache, no_cache
+        try:
+            return app.get_user_id_from_cookie(fixture.valid_request)
+        finally:
+            app.token_cache = cache
+    return call
+
+def bench_cookie_expired(fixture):
+    return lambda: app.get_user_id_from_cookie(fixture.expired_request)
+
+def bench_cookie_garbage(fixture):
+    return lambda: app.get_user_id_from_cookie(fixture.garbage_request)
+
+def bench_set_auth_cookie(fixture):
+    return lambda: app.set_auth_cookie(Response(), fixture.user_id)
+
+def bench_verify_password(fixture):
+    return lambda: app.verify_password(fixture.hashed_password, fixture.PASSWORD)
+
+def bench_get_current_user(fixture):
+    def call():
+        with app.db_transaction() as db:
+            app.get_current_user(db, fixture.user_id)
+    return call
+
+def bench_load_user(fixture):
+    return lambda: app.load_user(fixture.user_id)
+
+def bench_serve_index_anonymous(fixture):
+    return lambda: app.serve_index(fixture.anonymous_request)
+
+def bench_serve_index_user(fixture):
+    return lambda: app.serve_index(fixture.valid_request)
+
+def bench_db_transaction(fixture):
+    def call():
+        with app.db_transaction():
+            pass
+    return call
+
+def bench_allocate_username(clashes):
+    """A username for an OAuth sign-up whose email prefix `clashes` users already have."""
+    def setup(fixture):
+        base = f"clash{clashes}x"
+        with app.db_transaction() as db:
+            db.executemany(
+                "insert into users (username, email) values (?, ?)",
+                ((f"{base}{n or ''}", f"{base}{n}@example.com") for n in range(clashes)),
+            )
+        return lambda: app.run_write(lambda db: app.allocate_username(db, base))
+    return setup
+
+
+# name: (setup returning the function to time, calls per repeat)
+BENCHMARKS = {
+    'cookie_valid': (bench_cookie_valid, 20000),
+    'cookie_valid_uncached': (bench_cookie_valid_uncached, 5000),
+    'cookie_expired': (bench_cookie_expired, 5000),
+    'cookie_garbage': (bench_cookie_garbage, 20000),
+    'set_auth_cookie': (bench_set_auth_cookie, 5000),
+    'verify_password': (bench_verify_password, 5),
+    'get_current_user': (bench_get_current_user, 5000),
+    'load_user': (bench_load_user, 20000),
+    'serve_index_anonymous': (bench_serve_index_anonymous, 5000),
+    'serve_index_user': (bench_serve_index_user, 2000),
+    'db_transaction': (bench_db_transaction, 5000),
+    # The same cost however many users share the base
+    'allocate_username_10': (bench_allocate_username(10), 2000),
+    'allocate_username_1000': (bench_allocate_username(1000), 2000),
+    'allocate_username_100000': (bench_allocate_username(100000), 2000),
+}
+
+
+def measure(function, calls, repeats, counts):
+    """Time `calls` calls `repeats` times, returning the best per-call time and the counts per call."""
+    # Warm up, so connections are open and caches filled before anything is counted
+    for _ in range(max(1, calls // 10)):
+        function()
+
+    queries, decodes = counts.queries, counts.jwt_decodes
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(calls):
+            function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    total_calls = calls * repeats
+    return {
+        'per_call_us': round(best / calls * 1e6, 3),
+        'queries_per_call': round((counts.queries - queries) / total_calls, 3),
+        'jwt_decodes_per_call': round((counts.jwt_decodes - decodes) / total_calls, 3),
+    }
+
+
+def run_benchmarks(names, repeats=5, scale=1.0):
+    counts = Counts()
+    fixture = Fixture()
+    results = {}
+    with counts.installed():
+        fixture.setup()
+        try:
+            for name in names:
+                setup, calls = BENCHMARKS[name]
+                results[name] = measure(setup(fixture), max(1, int(calls * scale)), repeats, counts)
+        finally:
+            fixture.close()
+    return results
+
+
+def compare_to_baseline(results, baseline, max_regression):
+    """The regressions of `results` against `baseline`, as messages; empty if there are none.
+
+    Any increase in queries or JWT decodes per call is a regression; the time
+    per call may rise by up to `max_regression` percent.
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        for count in ('queries_per_call', 'jwt_decodes_per_call'):
+            if current[count] > previous[count]:
+                regressions.append(f"{name}: {current[count]} {count}, baseline {previous[count]}")
+        if current['per_call_us'] > previous['per_call_us'] * (1 + max_regression / 100):
+            regressions.append(f"{name}: {current['per_call_us']} us per call, baseline {previous['per_call_us']} us")
+    return regressions
+
+
+def main():
+    # The app serves its static files relative to the working directory
+    os.chdir(REPO_DIR)
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('benchmarks', nargs='*', help=f"any of: {', '.join(BENCHMARKS)} (default all)")
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--scale', type=float, default=1.0, help="multiply the calls per repeat")
+    parser.add_argument('--json', help="write the results here")
+    parser.add_argument('--baseline', help="results to compare against")
+    parser.add_argument('--max-regression', type=float, default=25.0, help="percent, for the time per call")
+    args = parser.parse_args()
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+    results = run_benchmarks(args.benchmarks or list(BENCHMARKS), args.repeats, args.scale)
+
+    print(f"{'benchmark':<24} {'us/call':>12} {'queries':>8} {'decodes':>8}")
+    for name, result in results.items():
+        print(
+            f"{name:<24} {result['per_call_us']:>12} "
+            f"{result['queries_per_call']:>8} {result['jwt_decodes_per_call']:>8}"
+        )
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compare_to_baseline(results, json.load(f), args.max_regression)
+        if regressions:
+            print("\nRegressions against the baseline:")
+            for regression in regressions:
+                print(f"- {regression}")
+            sys.exit(1)
+        print("\nNo regressions against the baseline.")
+
+
+if __name__ == '__main__':
+    main()
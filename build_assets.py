@@ -0,0 +1,99 @@
+"""Fingerprint and precompress the built static assets for deployment.
+
+Each asset is copied into static/dist with a hash of its contents in the
+name, along with a brotli (.br) and gzip (.gz) variant, so the server can
+send it precompressed and browsers can cache it forever. The
+static/dist/manifest.json written last maps each asset's plain name to its
+fingerprinted path, for the index page to link to.
+
+Usage: python build_assets.py [asset ...]
+"""
+import brotli
+import gzip
+import hashlib
+import json
+import os
+import sys
+
+STATIC_DIR = 'static'
+DIST_DIR = 'dist'
+MANIFEST_FILENAME = 'manifest.json'
+ASSETS = ['main.js', 'styles.min.css']
+COMPRESSED_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+def fingerprinted_name(name, content):
+    """The asset's filename with a hash of its content before the extension."""
+    stem, extension = os.path.splitext(name)
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    return f"{stem}.{digest}{extension}"
+
+
+def write_file(path, content):
+    """Write a file under a temporary name and move it into place, so it is never seen half written."""
+    building_path = path + '.tmp'
+    with open(building_path, 'wb') as f:
+        f.write(content)
+    os.replace(building_path, path)
+
+
+def read_manifest(static_dir=STATIC_DIR):
+    """The current manifest, or an empty one if the assets have not been built."""
+    try:
+        with open(os.path.join(static_dir, DIST_DIR, MANIFEST_FILENAME), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def prune(static_dir, keep):
+    """Remove the fingerprinted files that no manifest in `keep` refers to."""
+    kept = set()
+    for path in keep:
+        name = os.path.basename(path)
+        kept.update([name] + [name + suffix for suffix in COMPRESSED_SUFFIXES.values()])
+
+    dist_dir = os.path.join(static_dir, DIST_DIR)
+    for name in os.listdir(dist_dir):
+        if name != MANIFEST_FILENAME and name not in kept:
+            os.unlink(os.path.join(dist_dir, name))
+
+
+def build_assets(static_dir=STATIC_DIR, assets=ASSETS):
+    """Fingerprint and compress `assets`, write the manifest and return it.
+
+    The previous build's files are kept, so pages already rendered with the
+    old manifest can still load their assets; anything older is removed.
+    """
+    dist_dir = os.path.join(static_dir, DIST_DIR)
+    os.makedirs(dist_dir, exist_ok=True)
+    previous = read_manifest(static_dir)
+
+    manifest = {}
+    for name in assets:
+        with open(os.path.join(static_dir, name), 'rb') as f:
+            content = f.read()
+        hashed_name = fingerprinted_name(name, content)
+        path = os.path.join(dist_dir, hashed_name)
+        if not os.path.exists(path):
+            write_file(path + COMPRESSED_SUFFIXES['br'], brotli.compress(content, quality=11))
+            write_file(path + COMPRESSED_SUFFIXES['gzip'], gzip.compress(content, compresslevel=9, mtime=0))
+            write_file(path, content)
+        manifest[name] = f"{DIST_DIR}/{hashed_name}"
+
+    write_file(os.path.join(dist_dir, MANIFEST_FILENAME), json.dumps(manifest, indent=2).encode('utf-8'))
+    prune(static_dir, list(manifest.values()) + list(previous.values()))
+    return manifest
+
+
+if __name__ == '__main__':
+
+    assets = sys.argv[1:] or ASSETS
+    try:
+        manifest = build_assets(STATIC_DIR, assets)
+    except FileNotFoundError as e:
+        print(f"Missing asset, build it first: {e.filename}")
+        sys.exit(1)
+
+    for name, path in manifest.items():
+        print(f"{name} -> {path}")
@@ -0,0 +1,72 @@
+"""Suggest argon2 parameters for this host, given a target verify latency.
+
+Parallelism and memory cost are held fixed (memory is halved only if even
+one pass is too slow) while the time cost is raised one pass at a time, up
+to the most that still verifies within the target. Paste the suggested
+settings into the config; existing hashes are upgraded as users log in.
+
+Usage: python calibrate_argon2.py [target_ms] [--memory-cost KiB] [--parallelism N]
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+import argon2
+
+MIN_MEMORY_COST = 19 * 1024  # KiB, the OWASP minimum for argon2id
+MAX_TIME_COST = 20
+
+
+def verify_seconds(time_cost, memory_cost, parallelism, samples=5):
+    """The median time to verify a password hashed with these parameters."""
+    hasher = argon2.PasswordHasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+    password_hash = hasher.hash('calibration-password')
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        hasher.verify(password_hash, 'calibration-password')
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def calibrate(target_seconds, memory_cost, parallelism, report=print):
+    """The strongest (time_cost, memory_cost) verifying within `target_seconds`, and its time."""
+    while True:
+        seconds = verify_seconds(1, memory_cost, parallelism)
+        report(f"time_cost=1 memory_cost={memory_cost} KiB: {seconds * 1000:.1f} ms")
+        if seconds <= target_seconds or memory_cost // 2 < MIN_MEMORY_COST:
+            break
+        memory_cost //= 2
+
+    best = (1, seconds)
+    for time_cost in range(2, MAX_TIME_COST + 1):
+        seconds = verify_seconds(time_cost, memory_cost, parallelism)
+        report(f"time_cost={time_cost} memory_cost={memory_cost} KiB: {seconds * 1000:.1f} ms")
+        if seconds > target_seconds:
+            break
+        best = (time_cost, seconds)
+
+    time_cost, seconds = best
+    return time_cost, memory_cost, seconds
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('target_ms', nargs='?', type=float, default=250.0)
+    parser.add_argument('--memory-cost', type=int, default=argon2.DEFAULT_MEMORY_COST, help="KiB")
+    parser.add_argument('--parallelism', type=int, default=min(argon2.DEFAULT_PARALLELISM, os.cpu_count() or 1))
+    args = parser.parse_args()
+
+    time_cost, memory_cost, seconds = calibrate(args.target_ms / 1000, args.memory_cost, args.parallelism)
+
+    print(f"\nVerifies in {seconds * 1000:.1f} ms (target {args.target_ms:g} ms). Suggested config:")
+    print(json.dumps({
+        'argon2TimeCost': time_cost,
+        'argon2MemoryCost': memory_cost,
+        'argon2Parallelism': args.parallelism,
+    }, indent=2))
+    if seconds > args.target_ms / 1000:
+        print("Even the cheapest parameters allowed are slower than the target on this host.")
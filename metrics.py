@@ -0,0 +1,199 @@
+"""Low-overhead counters, gauges and histograms, rendered in Prometheus text format.
+
+Every thread updates its own shard of a metric, so recording a value takes
+no lock: the event loop, the thread pool and the background writer threads
+never contend with each other. Reading (a scrape) sums the shards. A new
+shard takes a lock, once per thread per metric. When a thread exits, its
+shards are folded into each metric's retired totals, so threads started
+and retired by the pools don't make the shards grow without bound.
+
+The values are per process; with several workers each one reports its own.
+"""
+import bisect
+import math
+import threading
+import weakref
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Registry:
+    """The metrics to be rendered by a scrape."""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if any(existing.name == metric.name for existing in self._metrics):
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics.append(metric)
+
+    def render(self):
+        """All the metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label_value(value)}"' for name, value in pairs) + '}'
+
+
+class _ShardOwner:
+    """Referenced only from a thread's thread-local, so collected when the thread exits."""
+
+    __slots__ = ('__weakref__',)
+
+
+class Metric:
+    """Base for the metric types: holds the per-thread shards of {label values: value}."""
+
+    type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._shards_lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = {}
+            owner = _ShardOwner()
+            with self._shards_lock:
+                self._shards.append(shard)
+            weakref.finalize(owner, self._retire, shard).atexit = False
+            self._local.owner = owner
+            self._local.shard = shard
+            return shard
+
+    def _retire(self, shard):
+        """Fold the shard of a thread that has exited into the retired totals."""
+        with self._shards_lock:
+            self._shards = [existing for existing in self._shards if existing is not shard]
+            self._merge(self._retired, shard)
+
+    def _snapshots(self):
+        # Copying a dict is atomic, so this is safe while the owning thread writes
+        with self._shards_lock:
+            return [dict(shard) for shard in self._shards] + [dict(self._retired)]
+
+
+class Counter(Metric):
+    """A value that only goes up."""
+
+    type = 'counter'
+
+    def inc(self, amount=1, labels=()):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _merge(self, totals, shard):
+        for labels, value in shard.items():
+            totals[labels] = totals.get(labels, 0) + value
+
+    def values(self):
+        """{label values: total} summed over the shards."""
+        totals = {}
+        for shard in self._snapshots():
+            self._merge(totals, shard)
+        return totals
+
+    def value(self, labels=()):
+        return self.values().get(labels, 0)
+
+    def samples(self):
+        for labels, value in sorted(self.values().items()):
+            yield f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}"
+
+
+class Gauge(Counter):
+    """A value that goes up and down, such as the number of requests in flight.
+
+    Each shard holds that thread's net change, so a gauge may be incremented
+    on one thread and decremented on another.
+    """
+
+    type = 'gauge'
+
+    def dec(self, amount=1, labels=()):
+        self.inc(-amount, labels)
+
+
+class Histogram(Metric):
+    """Observations counted into cumulative buckets, with their sum and count."""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, labels=()):
+        shard = self._shard()
+        series = shard.get(labels)
+        if series is None:
+            # One count per bucket plus the +Inf bucket, then the sum
+            series = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def _merge(self, totals, shard):
+        # Replaced rather than added to in place, as a scrape may be reading the old list
+        for labels, series in shard.items():
+            total = totals.get(labels)
+            totals[labels] = list(series) if total is None else [a + b for a, b in zip(total, series)]
+
+    def series(self):
+        """{label values: (per-bucket counts, sum)} summed over the shards."""
+        totals = {}
+        for shard in self._snapshots():
+            self._merge(totals, shard)
+        return {labels: (series[:-1], series[-1]) for labels, series in totals.items()}
+
+    def count(self, labels=()):
+        counts, _ = self.series().get(labels, ([], 0.0))
+        return sum(counts)
+
+    def samples(self):
+        for labels, (counts, total) in sorted(self.series().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                bucket_labels = format_labels(self.labelnames, labels, [('le', format_value(float(bound)))])
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            label_text = format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum{label_text} {format_value(total)}"
+            yield f"{self.name}_count{label_text} {cumulative}"
@@ -0,0 +1,221 @@
+"""Versioned schema migrations for the SQLite database.
+
+Migrations are the `sql/migrations/*.sql` files, applied in filename order.
+Each one applied is recorded in the schema_migrations table together with a
+checksum of its contents, so startup only has to compare that table with the
+files on disk, and a migration edited after it was applied is reported
+rather than silently skipped.
+
+New databases, for tests or other short-lived instances, are cloned from a
+template database that is migrated once per distinct set of migration files,
+rather than running every migration again.
+
+Usage: python migrations.py <config_file.json>
+"""
+import collections
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sql', 'migrations')
+
+Migration = collections.namedtuple('Migration', ['version', 'path', 'sql', 'checksum'])
+
+
+class MigrationError(Exception):
+    """The database's recorded migrations don't match the migration files."""
+
+
+def discover_migrations(migrations_dir=MIGRATIONS_DIR):
+    """The migrations in `migrations_dir`, in the order they are applied."""
+    migrations = []
+    for filename in sorted(os.listdir(migrations_dir)):
+        if not filename.endswith('.sql'):
+            continue
+        path = os.path.join(migrations_dir, filename)
+        with open(path, 'r') as f:
+            sql = f.read()
+        version = filename[:-len('.sql')]
+        checksum = hashlib.sha256(sql.encode('utf-8')).hexdigest()
+        migrations.append(Migration(version, path, sql, checksum))
+    return migrations
+
+
+def split_statements(sql):
+    """Split a migration script into its statements, so they can run inside our transaction.
+
+    (executescript would commit before running the script.)
+    """
+    statements = []
+    statement = ''
+    for line in sql.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            statements.append(statement.strip())
+            statement = ''
+    leftover = [line for line in statement.splitlines() if line.strip() and not line.strip().startswith('--')]
+    if leftover:
+        raise MigrationError(f"Incomplete statement at the end of the migration: {statement.strip()}")
+    return statements
+
+
+def applied_migrations(db):
+    """The recorded {version: checksum} of applied migrations, or None if nothing is recorded yet."""
+    table = db.execute(
+        "select 1 from sqlite_master where type = 'table' and name = 'schema_migrations'"
+    ).fetchone()
+    if not table:
+        return None
+    return dict(db.execute("select version, checksum from schema_migrations").fetchall())
+
+
+def check_checksums(migrations, applied):
+    for migration in migrations:
+        recorded = applied.get(migration.version)
+        if recorded is not None and recorded != migration.checksum:
+            raise MigrationError(f"Migration {migration.version} has been changed since it was applied")
+
+
+def creates_existing_tables(db, migration):
+    """Whether every table the migration creates already exists."""
+    tables = re.findall(r'create\s+table\s+(?:if\s+not\s+exists\s+)?(\w+)', migration.sql, re.IGNORECASE)
+    existing = {row[0] for row in db.execute("select name from sqlite_master where type = 'table'")}
+    return bool(tables) and all(table in existing for table in tables)
+
+
+def adopt_existing_schema(db, migrations):
+    """Record the migrations an existing, unversioned database already has.
+
+    Databases created before migrations were versioned had them applied
+    without being recorded; those are the ones whose tables already exist.
+    """
+    adopted = {}
+    for migration in migrations:
+        if not creates_existing_tables(db, migration):
+            break
+        adopted[migration.version] = migration.checksum
+    return adopted
+
+
+def migrate(db_filepath, migrations_dir=MIGRATIONS_DIR):
+    """Apply any pending migrations in one transaction, returning the versions applied.
+
+    When the database is already current this is one read of schema_migrations.
+    """
+    migrations = discover_migrations(migrations_dir)
+    db = sqlite3.connect(db_filepath, isolation_level=None)
+    try:
+        db.execute("PRAGMA busy_timeout = 5000")
+
+        applied = applied_migrations(db)
+        if applied is not None:
+            check_checksums(migrations, applied)
+            if all(migration.version in applied for migration in migrations):
+                return []
+
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            # Read again now we hold the write lock, another worker may have just migrated
+            applied = applied_migrations(db)
+            if applied is None:
+                db.execute("""
+                    create table schema_migrations (
+                        version text primary key,
+                        checksum text not null,
+                        applied_at datetime default current_timestamp
+                    )
+                """)
+                applied = adopt_existing_schema(db, migrations)
+                db.executemany(
+                    "insert into schema_migrations (version, checksum) values (?, ?)",
+                    applied.items(),
+                )
+            check_checksums(migrations, applied)
+
+            pending = [migration for migration in migrations if migration.version not in applied]
+            for migration in pending:
+                for statement in split_statements(migration.sql):
+                    db.execute(statement)
+                db.execute(
+                    "insert into schema_migrations (version, checksum) values (?, ?)",
+                    (migration.version, migration.checksum),
+                )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return [migration.version for migration in pending]
+    finally:
+        db.close()
+
+
+def template_database(migrations_dir=MIGRATIONS_DIR, cache_dir=None):
+    """The path of a fully migrated template database, building it if need be.
+
+    Templates are cached in `cache_dir` (by default under the system temp
+    directory) by a hash of the migration files, so one is only built again
+    when a migration is added or changed.
+    """
+    migrations = discover_migrations(migrations_dir)
+    fingerprint = hashlib.sha256()
+    for migration in migrations:
+        fingerprint.update(f"{migration.version}:{migration.checksum}\n".encode('utf-8'))
+
+    if cache_dir is None:
+        cache_dir = os.path.join(tempfile.gettempdir(), 'sqlite-templates')
+    os.makedirs(cache_dir, exist_ok=True)
+    template_path = os.path.join(cache_dir, f"template-{fingerprint.hexdigest()[:16]}.db")
+
+    if not os.path.exists(template_path):
+        # Build under a temporary name, so nobody can clone a half-built template
+        fd, building_path = tempfile.mkstemp(dir=cache_dir, suffix='.db')
+        os.close(fd)
+        try:
+            migrate(building_path, migrations_dir)
+            os.replace(building_path, template_path)
+        except BaseException:
+            os.unlink(building_path)
+            raise
+    return template_path
+
+
+def clone_database(template_path, db_filepath):
+    """Copy a template database to `db_filepath` using SQLite's backup API."""
+    source = sqlite3.connect(f"file:{template_path}?mode=ro", uri=True)
+    target = sqlite3.connect(db_filepath)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+def create_database(db_filepath, migrations_dir=MIGRATIONS_DIR):
+    """Create a new, fully migrated database at `db_filepath` from the template."""
+    clone_database(template_database(migrations_dir), db_filepath)
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 2:
+        print("Usage: python migrations.py <config_file.json>")
+        sys.exit(1)
+
+    config_file = sys.argv[1]
+    try:
+        with open(config_file, 'r') as f:
+            config_dict = json.load(f)
+    except Exception as e:
+        print(f"Error loading configuration: {e}")
+        sys.exit(1)
+
+    applied = migrate(config_dict['dbFilepath'])
+    if applied:
+        for version in applied:
+            print(f"Applied {version}")
+    else:
+        print("Database schema is up to date")
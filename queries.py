@@ -0,0 +1,385 @@
+"""Every SQL query the app runs, by name.
+
+Queries are registered here and run with `execute(db, name, parameters)`,
+so each one is timed in the db_query_duration_seconds metric, and so the
+whole set can be checked with EXPLAIN QUERY PLAN against the migrated
+schema. A query is "hot" unless registered otherwise: it runs on a request
+path, so it must use an index rather than scan a table. A query registered
+as an ordered walk may scan an index instead, in the order it asks for, as
+that stops at its LIMIT; it must have no filter for the walk to skip past.
+
+Pragmas and transaction control (BEGIN, SAVEPOINT, ...) are not queries
+and are run directly.
+
+Usage: python queries.py [database]  (checks the plans; default a fresh template)
+"""
+import collections
+import json
+import re
+import sqlite3
+import sys
+import time
+
+import metrics
+
+Query = collections.namedtuple('Query', ['name', 'sql', 'hot', 'ordered_walk'])
+
+QUERIES = {}
+
+QUERY_DURATION = metrics.Histogram(
+    'db_query_duration_seconds', 'Time to execute each registered query, up to its first row',
+    labelnames=('query',), buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 1.0),
+)
+
+
+def register(name, sql, hot=True, ordered_walk=False):
+    if name in QUERIES:
+        raise ValueError(f"Query {name} is already registered")
+    QUERIES[name] = Query(name, sql, hot, ordered_walk)
+
+
+def execute(db, name, parameters=()):
+    """Run the named query, recording how long it took."""
+    query = QUERIES[name]
+    start = time.perf_counter()
+    try:
+        return db.execute(query.sql, parameters)
+    finally:
+        QUERY_DURATION.observe(time.perf_counter() - start, (name,))
+
+
+def executemany(db, name, parameters):
+    query = QUERIES[name]
+    start = time.perf_counter()
+    try:
+        return db.executemany(query.sql, parameters)
+    finally:
+        QUERY_DURATION.observe(time.perf_counter() - start, (name,))
+
+
+def stats():
+    """{name: {count, seconds_total}} for each query run so far in this process."""
+    return {
+        labels[0]: {'count': sum(counts), 'seconds_total': total}
+        for labels, (counts, total) in sorted(QUERY_DURATION.series().items())
+    }
+
+
+def explain(db, name):
+    """The EXPLAIN QUERY PLAN details of the named query, with every parameter bound to null."""
+    query = QUERIES[name]
+    parameters = {parameter: None for parameter in re.findall(r':(\w+)', query.sql)}
+    return [row[3] for row in db.execute(f"EXPLAIN QUERY PLAN {query.sql}", parameters)]
+
+
+def table_scans(plan, ordered_walk=False):
+    """The steps of a plan that read every row of a table (or every entry of an index).
+
+    For a query registered as an ordered walk, an index scan with no sort
+    after it stops at the query's LIMIT, so isn't counted. Any other query
+    with a LIMIT may still read the whole index looking for rows that match.
+    """
+    ordered_walk = ordered_walk and not any('TEMP B-TREE' in detail for detail in plan)
+    return [
+        detail for detail in plan
+        if detail.startswith('SCAN ') and 'VIRTUAL TABLE' not in detail and detail != 'SCAN CONSTANT ROW'
+        and not (ordered_walk and ' INDEX ' in detail)
+    ]
+
+
+def check_plans(db):
+    """{name: scans} for every hot query whose plan scans a table."""
+    problems = {}
+    for name, query in QUERIES.items():
+        if query.hot:
+            scans = table_scans(explain(db, name), query.ordered_walk)
+            if scans:
+                problems[name] = scans
+    return problems
+
+
+# Users
+
+register('user_by_id', """
+    select id, username, fullname, admin from users where id = :user_id
+""")
+
+register('user_login_by_username', """
+    select id, username, email, fullname, password, admin from users where username = :username
+""")
+
+register('username_exists', """
+    select exists(select 1 from users where username = :username) as user_exists
+""")
+
+register('user_insert', """
+    insert into users (username, email, fullname, password, admin)
+    values (:username, :email, :fullname, :password, false)
+""")
+
+register('user_password_by_id', """
+    select password from users where id = :user_id
+""")
+
+register('user_password_update', """
+    update users set password = :password where id = :user_id
+""")
+
+# Only if the hash is still the one that was verified
+register('user_password_rehash', """
+    update users set password = :password where id = :user_id and password = :old_password
+""")
+
+register('user_fullname_update', """
+    update users set fullname = :fullname where id = :user_id
+""")
+
+register('user_by_oauth_account', """
+    select u.id, u.username, u.email, u.fullname, u.admin
+    from users u
+    join user_oauth_accounts uoa on u.id = uoa.user_id
+    where uoa.provider = :provider and uoa.provider_user_id = :provider_user_id
+""")
+
+register('user_by_email', """
+    select id, username, email, fullname, admin from users where email = :email
+""")
+
+register('user_insert_from_oauth', """
+    insert into users (email, fullname, username, admin)
+    values (:email, :fullname, :username, false)
+    returning id, username, email, fullname, admin
+""")
+
+register('username_suffix_claim', """
+    update username_suffixes set last_suffix = last_suffix + 1 where base = :base returning last_suffix
+""")
+
+# The usernames that are the base followed by a digit are one range of the
+# username index (':' sorts straight after '9'); of those only all-digit
+# suffixes count, and only up to 18 digits, so the counter stays within a
+# 64-bit integer
+register('username_highest_suffix', """
+    select max(cast(substr(username, length(:base) + 1) as integer)) from users
+    where username >= :base || '0' and username < :base || ':'
+        and substr(username, length(:base) + 1) not glob '*[^0-9]*'
+        and length(substr(username, length(:base) + 1)) <= 18
+""")
+
+register('username_suffix_set', """
+    insert into username_suffixes (base, last_suffix) values (:base, :last_suffix)
+    on conflict (base) do update set last_suffix = excluded.last_suffix
+""")
+
+register('oauth_account_insert', """
+    insert into user_oauth_accounts (user_id, provider, provider_user_id, email)
+    values (:user_id, :provider, :provider_user_id, :email)
+""")
+
+# Bulk import and export (users_cli.py)
+
+register('users_taken', """
+    select username, email from users
+    where username in (select value from json_each(:usernames))
+        or email in (select value from json_each(:emails))
+""")
+
+register('users_export_page', """
+    select id, username, email, fullname, admin, created_at, password from users
+    where id > :after_id order by id limit :limit
+""")
+
+# The id column isn't an alias of the rowid, and is null, so page by rowid
+register('oauth_accounts_export_page', """
+    select rowid, user_id, provider, provider_user_id, email, created_at from user_oauth_accounts
+    where rowid > :after_rowid order by rowid limit :limit
+""")
+
+# Cache versions
+
+register('cache_version_bump', """
+    insert into cache_versions (name, version) values (:name, 1)
+    on conflict (name) do update set version = version + 1
+    returning version
+""")
+
+register('cache_version', """
+    select version from cache_versions where name = :name
+""")
+
+# OAuth states
+
+register('oauth_state_insert', """
+    insert into oauth_states (state, expires_at) values (:state, :expires_at)
+""")
+
+register('oauth_state_consume', """
+    delete from oauth_states where state = :state returning expires_at
+""")
+
+register('oauth_states_delete_expired', """
+    delete from oauth_states where rowid in (
+        select rowid from oauth_states where expires_at <= :now limit :batch_size
+    )
+""")
+
+register('oauth_states_delete_beyond_max', """
+    delete from oauth_states where rowid in (
+        select rowid from oauth_states order by expires_at desc limit -1 offset :max_entries
+    )
+""", hot=False)
+
+register('oauth_states_count', """
+    select count(*) from oauth_states
+""", hot=False)
+
+# Login failures
+
+register('login_failures_blocked_until', """
+    select max(blocked_until) from login_failures
+    where key in (select value from json_each(:keys)) and expires_at > :now
+""")
+
+# Writing first takes the write lock straight away, so the count can't race
+register('login_failure_record', """
+    insert into login_failures (key, failures, expires_at) values (:key, 1, :expires_at)
+    on conflict (key) do update set
+        failures = case when expires_at <= :now then 1 else failures + 1 end,
+        blocked_until = case when expires_at <= :now then 0 else blocked_until end,
+        expires_at = excluded.expires_at
+    returning failures
+""")
+
+register('login_failure_block', """
+    update login_failures set blocked_until = :blocked_until where key = :key
+""")
+
+register('login_failures_forget', """
+    delete from login_failures where key in (select value from json_each(:keys))
+""")
+
+register('login_failures_delete_expired', """
+    delete from login_failures where rowid in (
+        select rowid from login_failures where expires_at <= :now limit :batch_size
+    )
+""")
+
+register('login_failures_delete_beyond_max', """
+    delete from login_failures where rowid in (
+        select rowid from login_failures order by expires_at desc limit -1 offset :max_entries
+    )
+""", hot=False)
+
+register('login_failures_count', """
+    select count(*) from login_failures
+""", hot=False)
+
+# Feedback
+
+register('feedback_insert', """
+    insert into user_feedback (user_id, email, comments, user_agent, ip_address, status)
+    values (:user_id, :email, :comments, :user_agent, :ip_address, :status)
+""")
+
+register('feedback_insert_with_id', """
+    insert into user_feedback (id, user_id, email, comments, user_agent, ip_address, status)
+    values (:id, :user_id, :email, :comments, :user_agent, :ip_address, :status)
+""")
+
+# sqlite_sequence has no index, but only a row per autoincrement table
+register('feedback_sequence', """
+    select seq from sqlite_sequence where name = 'user_feedback'
+""", hot=False)
+
+register('feedback_sequence_insert', """
+    insert into sqlite_sequence (name, seq) values ('user_feedback', :seq)
+""")
+
+register('feedback_sequence_update', """
+    update sqlite_sequence set seq = :seq where name = 'user_feedback'
+""", hot=False)
+
+FEEDBACK_COLUMNS = ('id', 'user_id', 'email', 'comments', 'user_agent', 'ip_address', 'status', 'created_at')
+
+
+# Filtering on one status is an index range in (created_at, id) order, so
+# needs no sort; on several, the rows from each range have to be sorted.
+FEEDBACK_STATUS_CONDITIONS = {
+    None: None,
+    'status': "status = :status",
+    'statuses': "status in (select value from json_each(:statuses))",
+}
+
+
+def feedback_status_filter(statuses):
+    """The status filter variant and its parameters for a list of statuses (or None)."""
+    if not statuses:
+        return None, {}
+    if len(statuses) == 1:
+        return 'status', {'status': statuses[0]}
+    return 'statuses', {'statuses': json.dumps(statuses)}
+
+
+def feedback_page_query_name(newest_first, status_filter, after):
+    """The name of the keyset page query for this combination of options."""
+    return (
+        f"feedback_page_{'newest' if newest_first else 'oldest'}"
+        f"{'_by_' + status_filter if status_filter else ''}{'_after' if after else ''}"
+    )
+
+
+# A query for each combination, so every one is fixed SQL that can be checked.
+# Only those without a condition can stop after :limit rows of the index walk
+for newest_first in (True, False):
+    for status_filter, status_condition in FEEDBACK_STATUS_CONDITIONS.items():
+        for after in (False, True):
+            conditions = []
+            if status_condition:
+                conditions.append(status_condition)
+            if after:
+                conditions.append(f"(created_at, id) {'<' if newest_first else '>'} (:created_at, :id)")
+            direction = 'desc' if newest_first else 'asc'
+            register(feedback_page_query_name(newest_first, status_filter, after), f"""
+                select {', '.join(FEEDBACK_COLUMNS)} from user_feedback
+                {'where ' + ' and '.join(conditions) if conditions else ''}
+                order by created_at {direction}, id {direction}
+                limit :limit
+            """, ordered_walk=not conditions)
+
+def feedback_search_query_name(status_filter):
+    return f"feedback_search{'_by_' + status_filter if status_filter else ''}"
+
+
+# Comments matter more than email when ranking; the snippet (column -1) is
+# taken from whichever of them matched
+for status_filter, status_condition in FEEDBACK_STATUS_CONDITIONS.items():
+    register(feedback_search_query_name(status_filter), f"""
+        select {', '.join('f.' + column for column in FEEDBACK_COLUMNS)},
+            snippet(user_feedback_search, -1, :match_start, :match_end, '…', 16) as snippet
+        from user_feedback_search
+        join user_feedback f on f.id = user_feedback_search.rowid
+        where user_feedback_search match :match
+            {'and f.' + status_condition if status_condition else ''}
+        order by bm25(user_feedback_search, 1.0, 0.5), f.id desc
+        limit :limit offset :offset
+    """)
+
+
+if __name__ == '__main__':
+
+    import migrations
+
+    db_filepath = sys.argv[1] if len(sys.argv) > 1 else migrations.template_database()
+    db = sqlite3.connect(f"file:{db_filepath}?mode=ro", uri=True)
+
+    for name, query in QUERIES.items():
+        print(f"{name}{'' if query.hot else ' (not hot)'}")
+        for detail in explain(db, name):
+            print(f"    {detail}")
+
+    problems = check_plans(db)
+    if problems:
+        print("\nHot queries scanning a table:")
+        for name, scans in problems.items():
+            print(f"    {name}: {'; '.join(scans)}")
+        sys.exit(1)
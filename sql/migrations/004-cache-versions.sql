@@ -0,0 +1,8 @@
+-- Cache Versions Table Migration
+-- A counter per in-process cache, bumped in the same transaction as any write
+-- that makes cached entries stale, so that every worker can notice the change
+
+create table cache_versions (
+    name text primary key, -- which cache, e.g. 'users'
+    version integer not null default 0
+);
@@ -0,0 +1,10 @@
+-- OAuth States Table Migration
+-- Pending OAuth logins, shared by every worker so that a callback can be
+-- handled by a different worker from the one that started the login
+
+create table oauth_states (
+    state text primary key,
+    expires_at real not null -- unix timestamp
+);
+
+create index idx_oauth_states_expires_at on oauth_states(expires_at);
@@ -0,0 +1,7 @@
+-- Index for listing feedback newest first, optionally filtered by status.
+-- The rowid (id) is implicitly the last column, so (status, created_at, id)
+-- keyset pagination is a single index range scan.
+create index idx_user_feedback_status_created_at on user_feedback(status, created_at);
+
+-- Every lookup by status alone can use the new index instead
+drop index idx_user_feedback_status;
@@ -0,0 +1,30 @@
+-- Full-text search over feedback comments and email.
+-- An external-content FTS5 table: it stores only the index and reads the
+-- text from user_feedback, kept in step by the triggers below.
+create virtual table user_feedback_search using fts5(
+    comments,
+    email,
+    content = 'user_feedback',
+    content_rowid = 'id',
+    tokenize = 'porter unicode61'
+);
+
+create trigger user_feedback_search_insert after insert on user_feedback begin
+    insert into user_feedback_search (rowid, comments, email)
+    values (new.id, new.comments, new.email);
+end;
+
+create trigger user_feedback_search_delete after delete on user_feedback begin
+    insert into user_feedback_search (user_feedback_search, rowid, comments, email)
+    values ('delete', old.id, old.comments, old.email);
+end;
+
+create trigger user_feedback_search_update after update of comments, email on user_feedback begin
+    insert into user_feedback_search (user_feedback_search, rowid, comments, email)
+    values ('delete', old.id, old.comments, old.email);
+    insert into user_feedback_search (rowid, comments, email)
+    values (new.id, new.comments, new.email);
+end;
+
+-- Index the feedback already there
+insert into user_feedback_search (user_feedback_search) values ('rebuild');
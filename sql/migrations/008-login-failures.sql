@@ -0,0 +1,12 @@
+-- Login Failures Table Migration
+-- Recent failed logins per username and per IP address, shared by every
+-- worker so that login throttling can't be dodged by hitting another one
+
+create table login_failures (
+    key text primary key, -- 'username:<name>' or 'ip:<address>'
+    failures integer not null,
+    blocked_until real not null default 0, -- unix timestamp
+    expires_at real not null -- unix timestamp, forgotten after this
+);
+
+create index idx_login_failures_expires_at on login_failures(expires_at);
@@ -0,0 +1,8 @@
+-- Username Suffixes Table Migration
+-- The last numeric suffix given out for each username taken by more than
+-- one OAuth sign-up, e.g. 3 after 'john', 'john1', 'john2', 'john3'
+
+create table username_suffixes (
+    base text primary key,
+    last_suffix integer not null
+);
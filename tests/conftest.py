@@ -8,17 +8,36 @@ import time
 from fastapi.testclient import TestClient
 
 # Add the parent directory to the path so we can import app
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+# app_details.py is rendered by copier in a generated project; in the template
+# itself, render one for the tests, visible to server subprocesses as well
+if not os.path.exists(os.path.join(REPO_DIR, 'app_details.py')):
+    app_details_dir = tempfile.mkdtemp(prefix='app-details-')
+    with open(os.path.join(REPO_DIR, 'app_details.py.tmpl'), 'r', encoding='utf-8') as f:
+        template = f.read()
+    with open(os.path.join(app_details_dir, 'app_details.py'), 'w', encoding='utf-8') as f:
+        f.write(template.replace('{{app_title}}', 'Test Application').replace('{{emoji_icon}}', '🚀'))
+    sys.path.insert(0, app_details_dir)
+    os.environ['PYTHONPATH'] = os.pathsep.join(filter(None, [app_details_dir, os.environ.get('PYTHONPATH')]))
 
 import app
+import migrations
+
+@pytest.fixture(scope='session')
+def template_db_path():
+    """A migrated template database, built once and cloned for each test"""
+    return migrations.template_database()
 
 @pytest.fixture
-def test_config():
+def test_config(template_db_path):
     """Test configuration for temporary database file"""
     # Use a temporary file instead of :memory: to avoid threading issues
     import tempfile
     db_fd, db_path = tempfile.mkstemp(suffix='.db')
     os.close(db_fd)  # Close the file descriptor, SQLite will open it
+    migrations.clone_database(template_db_path, db_path)
     
     config = {
         "base_url": "https://dev.poleprediction.com",
@@ -33,11 +52,12 @@ def test_config():
     
     yield config
     
-    # Cleanup: remove the temporary database file
-    try:
-        os.unlink(db_path)
-    except OSError:
-        pass
+    # Cleanup: remove the temporary database file and its WAL sidecars
+    for path in (db_path, db_path + '-wal', db_path + '-shm'):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
 
 @pytest.fixture
 def client(test_config):
@@ -46,3 +66,28 @@ def client(test_config):
     app.configure_app(test_config)
     # Return FastAPI test client
     return TestClient(app.app)
+
+@pytest.fixture
+def behind_proxy():
+    """Wraps an ASGI app so that its requests arrive from a reverse proxy's address"""
+    def wrap(asgi_app, proxy='127.0.0.1'):
+        async def proxied(scope, receive, send):
+            if scope['type'] == 'http':
+                scope = dict(scope, client=(proxy, 50000))
+            await asgi_app(scope, receive, send)
+        return proxied
+    return wrap
+
+@pytest.fixture
+def admin_client(client):
+    """A test client logged in as an admin"""
+    response = client.post('/api/register', json={
+        "username": "admin",
+        "password": "adminpassword",
+        "email": "admin@example.com",
+    })
+    user_id = response.json()['user']['id']
+    with app.db_transaction() as db:
+        db.execute("update users set admin = 1 where id = ?", (user_id,))
+    app.user_cache.invalidate(user_id)
+    return client
@@ -0,0 +1,51 @@
+import pytest
+from benchmarks import load, micro
+
+
+def stats(rps, p95_ms):
+    return {'requests': 100, 'errors': 0, 'rps': rps, 'p50_ms': 1.0, 'p95_ms': p95_ms, 'p99_ms': p95_ms}
+
+
+class TestLoadReport:
+    """Test cases for the load test's report and baseline comparison"""
+
+    def test_percentiles(self):
+        """Test the nearest-rank percentiles"""
+        values = [n / 1000 for n in range(1, 101)]
+        report = load.summarise(values, [200] * 99 + [500], elapsed=2.0)
+
+        assert report['rps'] == 50.0
+        assert report['errors'] == 1
+        assert (report['p50_ms'], report['p95_ms'], report['p99_ms']) == (50.0, 95.0, 99.0)
+
+    def test_regressions_beyond_allowance(self):
+        """Test that a throughput drop or latency rise beyond the allowance is reported"""
+        baseline = {'overall': stats(100, 10), 'operations': {'me': stats(50, 5)}}
+        report = {'overall': stats(85, 11), 'operations': {'me': stats(30, 7), 'login': stats(1, 1000)}}
+
+        regressions = load.compare_to_baseline(report, baseline, max_regression=20)
+
+        assert regressions == [
+            "me: 30 rps, baseline 50 rps",
+            "me: p95 7 ms, baseline 5 ms",
+        ]
+
+
+class TestMicroBenchmarks:
+    """Test cases for the micro-benchmarks' baseline comparison"""
+
+    def test_extra_query_is_a_regression(self):
+        """Test that any extra query or decode fails, while time has an allowance"""
+        baseline = {'load_user': {'per_call_us': 3.0, 'queries_per_call': 1.0, 'jwt_decodes_per_call': 0.0}}
+        results = {'load_user': {'per_call_us': 3.5, 'queries_per_call': 2.0, 'jwt_decodes_per_call': 0.0}}
+
+        regressions = micro.compare_to_baseline(results, baseline, max_regression=25)
+
+        assert regressions == ["load_user: 2.0 queries_per_call, baseline 1.0"]
+
+    def test_uncached_cookie_decodes_every_call(self):
+        """Test that the uncached cookie benchmark checks the token each call, unlike the cached one"""
+        results = micro.run_benchmarks(['cookie_valid', 'cookie_valid_uncached'], repeats=1, scale=0.01)
+
+        assert results['cookie_valid']['jwt_decodes_per_call'] == 0.0
+        assert results['cookie_valid_uncached']['jwt_decodes_per_call'] == 1.0
@@ -0,0 +1,98 @@
+import pytest
+import sqlite3
+import threading
+from fastapi import HTTPException
+import app
+
+
+class TestConnectionPool:
+    """Test cases for the pooled SQLite connections behind db_transaction"""
+
+    def test_connections_are_reused(self, client):
+        """Test that repeated transactions check out the same connection"""
+        with app.db_transaction() as db:
+            first = db
+        with app.db_transaction() as db:
+            second = db
+
+        assert first is second
+        stats = app.db_pool.stats()
+        assert stats['open'] == 1
+        assert stats['checkouts'] >= 2
+
+    def test_pragmas_are_applied(self, client):
+        """Test that pooled connections are opened with the tuned pragmas"""
+        with app.db_transaction() as db:
+            assert db.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+            # NORMAL is 1
+            assert db.execute("PRAGMA synchronous").fetchone()[0] == 1
+            assert db.execute("PRAGMA busy_timeout").fetchone()[0] == 5000
+
+    def test_pool_exhaustion_times_out(self, test_config):
+        """Test that waiting for a connection gives up with a 503"""
+        test_config['dbPoolSize'] = 1
+        test_config['dbPoolTimeout'] = 0.05
+        app.configure_app(test_config)
+
+        with app.db_transaction():
+            errors = []
+
+            def checkout():
+                try:
+                    with app.db_transaction():
+                        pass
+                except HTTPException as e:
+                    errors.append(e.status_code)
+
+            thread = threading.Thread(target=checkout)
+            thread.start()
+            thread.join()
+
+        assert errors == [503]
+        assert app.db_pool.stats()['timeouts'] == 1
+
+    def test_open_transaction_is_rolled_back_on_release(self, client):
+        """Test that a connection returned mid-transaction doesn't hand its transaction to the next borrower"""
+        db = app.db_pool.acquire()
+        db.execute("insert into users (username, email, password) values ('half', 'half@example.com', '')")
+        app.db_pool.release(db)
+
+        with app.db_transaction() as db:
+            assert not db.in_transaction
+            assert db.execute("select count(*) from users where username = 'half'").fetchone()[0] == 0
+
+    def test_admin_stats_require_admin(self, client):
+        """Test that pool statistics are not public"""
+        response = client.get('/api/admin/stats')
+
+        assert response.status_code == 401
+
+
+class TestReadOnlyPool:
+    """Test cases for the read-only connections used by the GET routes"""
+
+    def test_read_connections_refuse_writes(self, client):
+        """Test that a read-only connection can read but not write"""
+        with app.db_read() as db:
+            assert db.execute("PRAGMA query_only").fetchone()[0] == 1
+            assert db.execute("select count(*) from users").fetchone()[0] == 0
+            with pytest.raises(sqlite3.OperationalError):
+                db.execute("insert into users (username, email) values ('x', 'x')")
+
+    def test_reads_proceed_while_write_lock_held(self, client):
+        """Test that /api/me reads while another connection holds the write lock"""
+        client.post('/api/register', json={
+            "username": "testuser",
+            "password": "testpassword123",
+            "email": "test@example.com",
+        })
+        app.user_cache.invalidate(1)
+        read_checkouts = app.db_read_pool.stats()['checkouts']
+
+        with app.db_transaction() as db:
+            db.execute("update users set fullname = 'Pending' where id = 1")
+            response = client.get('/api/me')
+
+        assert response.status_code == 200
+        assert response.json()['fullname'] is None
+        assert app.db_read_pool.stats()['checkouts'] == read_checkouts + 1
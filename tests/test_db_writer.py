@@ -0,0 +1,110 @@
+import pytest
+import threading
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+import app
+
+
+@pytest.fixture
+def writer_client(test_config):
+    """A test client with the single-writer mode enabled"""
+    test_config['dbWriterThread'] = True
+    app.configure_app(test_config)
+    yield TestClient(app.app)
+    app.db_writer.stop()
+    app.db_writer = None
+
+
+class TestDatabaseWriter:
+    """Test cases for the single-writer queue"""
+
+    def test_routes_write_through_writer(self, writer_client):
+        """Test that registration and feedback go through the writer thread"""
+        user_data = {
+            "username": "testuser",
+            "password": "testpassword123",
+            "email": "test@example.com",
+            "fullname": "Test User"
+        }
+        response = writer_client.post('/api/register', json=user_data)
+        assert response.status_code == 200
+
+        first = writer_client.post('/api/feedback', json={"comments": "First"})
+        second = writer_client.post('/api/feedback', json={"comments": "Second"})
+        assert second.json()['feedback_id'] == first.json()['feedback_id'] + 1
+
+        duplicate = writer_client.post('/api/register', json=user_data)
+        assert duplicate.status_code == 409
+
+        assert app.db_writer.stats()['writes'] == 3
+
+    def test_batch_isolates_failing_write(self, writer_client):
+        """Test that queued writes share one commit but not each other's errors"""
+        release_writer = threading.Event()
+        writer_blocked = threading.Event()
+
+        def block_writer(db):
+            writer_blocked.set()
+            release_writer.wait()
+
+        def insert_feedback(comments):
+            def operation(db):
+                query = "insert into user_feedback (comments) values (?)"
+                return db.execute(query, (comments,)).lastrowid
+            return operation
+
+        def fail(db):
+            db.execute("insert into user_feedback (comments) values ('rolled back')")
+            raise HTTPException(status_code=400, detail="Rejected")
+
+        results = {}
+
+        def submit(name, operation):
+            try:
+                results[name] = app.db_writer.submit(operation)
+            except HTTPException as e:
+                results[name] = e.status_code
+
+        blocker = threading.Thread(target=submit, args=('blocker', block_writer))
+        blocker.start()
+        writer_blocked.wait()
+
+        batches_before = app.db_writer.stats()['batches']
+        threads = [
+            threading.Thread(target=submit, args=('first', insert_feedback('one'))),
+            threading.Thread(target=submit, args=('failing', fail)),
+            threading.Thread(target=submit, args=('second', insert_feedback('two'))),
+        ]
+        for thread in threads:
+            thread.start()
+        while app.db_writer.stats()['queued'] < len(threads):
+            pass
+        release_writer.set()
+        for thread in threads + [blocker]:
+            thread.join()
+
+        assert results['failing'] == 400
+        assert isinstance(results['first'], int)
+        assert isinstance(results['second'], int)
+        # One batch for the blocking write, then a single batch for the three queued behind it
+        assert app.db_writer.stats()['batches'] == batches_before + 2
+
+        with app.db_transaction() as db:
+            comments = [row['comments'] for row in db.execute("select comments from user_feedback")]
+        assert sorted(comments) == ['one', 'two']
+
+    def test_broken_savepoint_fails_batch_not_writer(self, writer_client):
+        """Test that an error outside any one write fails its batch but leaves the writer running"""
+        def release_savepoint(db):
+            # The writer's own RELEASE of the savepoint then fails
+            db.execute("RELEASE queued_write")
+
+        with pytest.raises(HTTPException) as error:
+            app.db_writer.submit(release_savepoint)
+        assert error.value.status_code == 500
+
+        feedback_id = app.db_writer.submit(
+            lambda db: db.execute("insert into user_feedback (comments) values ('after')").lastrowid
+        )
+        assert isinstance(feedback_id, int)
+        assert app.db_writer.stats()['failed_commits'] == 1
@@ -0,0 +1,392 @@
+import pytest
+import json
+import threading
+from fastapi.testclient import TestClient
+import app
+
+
+@pytest.fixture
+def write_behind_client(test_config):
+    """A test client with write-behind feedback ingestion enabled"""
+    test_config['feedbackWriteBehind'] = True
+    test_config['feedbackIdBlockSize'] = 10
+    test_config['feedbackFlushInterval'] = 60
+    app.configure_app(test_config)
+    return TestClient(app.app)
+
+
+def stored_feedback():
+    with app.db_transaction() as db:
+        return [dict(row) for row in db.execute("select id, comments from user_feedback order by id")]
+
+
+class TestFeedback:
+    """Test cases for feedback submission"""
+
+    def test_submit_feedback(self, client):
+        """Test that feedback is stored straight away by default"""
+        response = client.post('/api/feedback', json={"comments": "  Great app  ", "email": ""})
+
+        assert response.status_code == 200
+        feedback_id = response.json()['feedback_id']
+        assert stored_feedback() == [{'id': feedback_id, 'comments': 'Great app'}]
+
+    def test_empty_comments_rejected(self, client):
+        """Test that blank comments are refused"""
+        response = client.post('/api/feedback', json={"comments": "   "})
+
+        assert response.status_code == 400
+
+
+class TestFeedbackWriteBehind:
+    """Test cases for the write-behind feedback ingestion"""
+
+    def test_ids_returned_before_insert(self, write_behind_client):
+        """Test that submissions get their final ids and are inserted on shutdown"""
+        ids = [
+            write_behind_client.post('/api/feedback', json={"comments": f"Comment {n}"}).json()['feedback_id']
+            for n in range(3)
+        ]
+
+        assert ids == [1, 2, 3]
+        assert stored_feedback() == []
+
+        app.shutdown_app()
+        app.db_pool = app.ConnectionPool(app.config['dbFilepath'], size=1, timeout=1)
+
+        assert stored_feedback() == [
+            {'id': 1, 'comments': 'Comment 0'},
+            {'id': 2, 'comments': 'Comment 1'},
+            {'id': 3, 'comments': 'Comment 2'},
+        ]
+
+    def test_reserved_ids_are_not_reused(self, write_behind_client):
+        """Test that a direct insert skips past the reserved block"""
+        write_behind_client.post('/api/feedback', json={"comments": "Queued"})
+
+        with app.db_transaction() as db:
+            cursor = db.execute("insert into user_feedback (comments) values ('Direct')")
+
+        assert cursor.lastrowid == 11
+
+    def test_next_block_is_reserved_ahead(self, write_behind_client, test_config):
+        """Test that ids run on through the next block, reserved before the current one runs out"""
+        test_config['feedbackRatePerMinute'] = 0
+        app.configure_app(test_config)
+        ids = [
+            write_behind_client.post('/api/feedback', json={"comments": f"Comment {n}"}).json()['feedback_id']
+            for n in range(6)
+        ]
+        assert app.feedback_ingestor._spare_id == 11
+
+        ids += [
+            write_behind_client.post('/api/feedback', json={"comments": f"Comment {n}"}).json()['feedback_id']
+            for n in range(6, 15)
+        ]
+
+        assert ids == list(range(1, 16))
+
+    def test_failed_flush_is_retried(self, write_behind_client, monkeypatch):
+        """Test that a batch that fails once, with any error, is written on the retry"""
+        monkeypatch.setattr(app.FeedbackIngestor, 'retry_delay', 0)
+        real_run_write = app.run_write
+        calls = []
+
+        def flaky_run_write(operation):
+            calls.append(operation)
+            if len(calls) == 2:
+                raise RuntimeError("Transient failure")
+            return real_run_write(operation)
+
+        monkeypatch.setattr(app, 'run_write', flaky_run_write)
+        write_behind_client.post('/api/feedback', json={"comments": "Retried"})
+
+        app.feedback_ingestor.stop()
+
+        assert stored_feedback() == [{'id': 1, 'comments': 'Retried'}]
+        assert app.feedback_ingestor.stats()['failed_rows'] == 0
+
+    def test_bad_row_loses_only_itself(self, write_behind_client, monkeypatch):
+        """Test that a row that can't be inserted doesn't take the rest of its batch with it"""
+        monkeypatch.setattr(app.FeedbackIngestor, 'retry_delay', 0)
+        for n in range(3):
+            write_behind_client.post('/api/feedback', json={"comments": f"Comment {n}"})
+        with app.db_transaction() as db:
+            db.execute("insert into user_feedback (id, comments) values (2, 'Taken')")
+
+        app.feedback_ingestor.stop()
+
+        assert stored_feedback() == [
+            {'id': 1, 'comments': 'Comment 0'},
+            {'id': 2, 'comments': 'Taken'},
+            {'id': 3, 'comments': 'Comment 2'},
+        ]
+        stats = app.feedback_ingestor.stats()
+        assert (stats['flushed_rows'], stats['failed_rows']) == (2, 1)
+
+    def test_full_queue_is_rejected(self, test_config, monkeypatch):
+        """Test that submissions beyond the queue size get a 503"""
+        flush_allowed = threading.Event()
+        original_flush = app.FeedbackIngestor._flush
+
+        def blocked_flush(self, batch):
+            flush_allowed.wait()
+            original_flush(self, batch)
+
+        test_config['feedbackWriteBehind'] = True
+        test_config['feedbackQueueSize'] = 1
+        test_config['feedbackBatchSize'] = 1
+        app.configure_app(test_config)
+        monkeypatch.setattr(app.FeedbackIngestor, '_flush', blocked_flush)
+        client = TestClient(app.app)
+
+        try:
+            # The first is taken by the (blocked) flush, the second fills the queue
+            assert client.post('/api/feedback', json={"comments": "First"}).status_code == 200
+            while app.feedback_ingestor.stats()['queued']:
+                pass
+            assert client.post('/api/feedback', json={"comments": "Second"}).status_code == 200
+            response = client.post('/api/feedback', json={"comments": "One too many"})
+
+            assert response.status_code == 503
+            assert app.feedback_ingestor.stats()['rejected'] == 1
+        finally:
+            flush_allowed.set()
+
+
+def insert_feedback_rows(rows):
+    """Insert (created_at, status) rows directly, returning their ids"""
+    with app.db_transaction() as db:
+        return [
+            db.execute(
+                "insert into user_feedback (comments, status, created_at) values (?, ?, ?)",
+                (f"Comment {n}", status, created_at),
+            ).lastrowid
+            for n, (created_at, status) in enumerate(rows)
+        ]
+
+
+class TestAdminFeedback:
+    """Test cases for listing and exporting feedback"""
+
+    def test_listing_requires_admin(self, client):
+        """Test that feedback is not readable by ordinary users"""
+        assert client.get('/api/admin/feedback').status_code == 401
+        assert client.get('/api/admin/feedback/export').status_code == 401
+
+    def test_pages_follow_cursor(self, admin_client):
+        """Test that pages walk newest first without gaps or repeats, across equal timestamps"""
+        ids = insert_feedback_rows(
+            [('2025-01-01 10:00:00', 'new')] * 3 + [('2025-01-02 10:00:00', 'new')] * 2
+        )
+
+        seen = []
+        cursor = None
+        while True:
+            params = {'limit': 2}
+            if cursor:
+                params['cursor'] = cursor
+            page = admin_client.get('/api/admin/feedback', params=params).json()
+            seen.extend(row['id'] for row in page['feedback'])
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+
+        assert seen == [ids[4], ids[3], ids[2], ids[1], ids[0]]
+
+    def test_status_filter(self, admin_client):
+        """Test that only feedback with the requested statuses is listed"""
+        ids = insert_feedback_rows([
+            ('2025-01-01 10:00:00', 'new'),
+            ('2025-01-01 11:00:00', 'reviewed'),
+            ('2025-01-01 12:00:00', 'resolved'),
+        ])
+
+        response = admin_client.get('/api/admin/feedback', params=[('status', 'new'), ('status', 'resolved')])
+
+        assert [row['id'] for row in response.json()['feedback']] == [ids[2], ids[0]]
+        assert admin_client.get('/api/admin/feedback', params={'status': 'bogus'}).status_code == 400
+
+    def test_invalid_cursor(self, admin_client):
+        """Test that a mangled cursor is a client error"""
+        response = admin_client.get('/api/admin/feedback', params={'cursor': 'not-a-cursor'})
+
+        assert response.status_code == 400
+
+    def test_export_streams_in_chunks(self, admin_client, monkeypatch):
+        """Test that the export covers every row, oldest first, across chunks"""
+        monkeypatch.setattr(app, 'FEEDBACK_EXPORT_CHUNK', 2)
+        ids = insert_feedback_rows([('2025-01-01 10:00:00', 'new')] * 5)
+
+        response = admin_client.get('/api/admin/feedback/export')
+
+        assert response.headers['content-type'] == 'application/x-ndjson'
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert [row['id'] for row in rows] == ids
+
+    def test_export_csv(self, admin_client):
+        """Test the CSV export has a header and a line per row"""
+        insert_feedback_rows([('2025-01-01 10:00:00', 'new'), ('2025-01-02 10:00:00', 'reviewed')])
+
+        response = admin_client.get('/api/admin/feedback/export', params={'format': 'csv', 'status': 'reviewed'})
+
+        lines = response.text.splitlines()
+        assert lines[0] == 'id,user_id,email,comments,user_agent,ip_address,status,created_at'
+        assert len(lines) == 2
+        assert lines[1].endswith(',reviewed,2025-01-02 10:00:00')
+
+
+class TestFeedbackSearch:
+    """Test cases for the full-text feedback search"""
+
+    def test_matches_are_ranked_with_snippets(self, admin_client):
+        """Test that better matches come first and matched words are marked"""
+        for comments in ["The login button is broken", "Login login login fails <b>always</b>", "Nice colours"]:
+            admin_client.post('/api/feedback', json={"comments": comments})
+
+        response = admin_client.get('/api/admin/feedback/search', params={'q': 'login'})
+
+        matches = response.json()['feedback']
+        assert [match['comments'] for match in matches] == [
+            "Login login login fails <b>always</b>",
+            "The login button is broken",
+        ]
+        assert matches[0]['snippet'] == "<mark>Login</mark> <mark>login</mark> <mark>login</mark> fails &lt;b&gt;always&lt;/b&gt;"
+
+    def test_email_match_is_marked_in_snippet(self, admin_client):
+        """Test that a match on the email gives a snippet from the email"""
+        admin_client.post('/api/feedback', json={"comments": "Nice colours", "email": "jane@example.com"})
+
+        response = admin_client.get('/api/admin/feedback/search', params={'q': 'jane'})
+
+        assert response.json()['feedback'][0]['snippet'] == "<mark>jane</mark>@example.com"
+
+    def test_index_follows_updates_and_deletes(self, admin_client):
+        """Test that the triggers keep the index in step with the table"""
+        feedback_id = admin_client.post('/api/feedback', json={"comments": "Original words"}).json()['feedback_id']
+
+        def search(text):
+            response = admin_client.get('/api/admin/feedback/search', params={'q': text})
+            return [match['id'] for match in response.json()['feedback']]
+
+        with app.db_transaction() as db:
+            db.execute("update user_feedback set comments = 'Replacement text' where id = ?", (feedback_id,))
+        assert search('original') == []
+        assert search('replacement') == [feedback_id]
+
+        with app.db_transaction() as db:
+            db.execute("delete from user_feedback where id = ?", (feedback_id,))
+        assert search('replacement') == []
+
+    def test_query_syntax_is_not_interpreted(self, admin_client):
+        """Test that FTS operators and quotes in the search text are searched for, not parsed"""
+        admin_client.post('/api/feedback', json={"comments": "Crashes on save AND quit"})
+
+        for text in ['"unbalanced', 'save AND', 'NEAR(', 'sav*']:
+            response = admin_client.get('/api/admin/feedback/search', params={'q': text})
+            assert response.status_code == 200, text
+
+        assert admin_client.get('/api/admin/feedback/search', params={'q': '   '}).status_code == 400
+
+    def test_pagination(self, admin_client):
+        """Test that next_offset walks through every match"""
+        for n in range(5):
+            admin_client.post('/api/feedback', json={"comments": f"Slow page number {n}"})
+
+        first = admin_client.get('/api/admin/feedback/search', params={'q': 'slow', 'limit': 3}).json()
+        second = admin_client.get(
+            '/api/admin/feedback/search', params={'q': 'slow', 'limit': 3, 'offset': first['next_offset']}
+        ).json()
+
+        assert len(first['feedback']) == 3
+        assert len(second['feedback']) == 2
+        assert second['next_offset'] is None
+        ids = {match['id'] for match in first['feedback'] + second['feedback']}
+        assert len(ids) == 5
+
+
+class TestFeedbackLimits:
+    """Test cases for turning away feedback spam before it reaches the database"""
+
+    def test_ip_rate_limit(self, test_config, behind_proxy):
+        """Test that a burst beyond the limit gets a 429 without touching the database"""
+        test_config['feedbackBurst'] = 2
+        test_config['trustedProxies'] = ['127.0.0.1']
+        app.configure_app(test_config)
+        client = TestClient(behind_proxy(app.app))
+        rejected = app.FEEDBACK_REJECTED.value(('ip_rate',))
+
+        for n in range(2):
+            assert client.post('/api/feedback', json={"comments": f"Spam {n}"}).status_code == 200
+        checkouts = app.db_pool.stats()['checkouts']
+        response = client.post('/api/feedback', json={"comments": "Spam 2"})
+
+        assert response.status_code == 429
+        assert int(response.headers['retry-after']) > 0
+        assert app.db_pool.stats()['checkouts'] == checkouts
+        assert app.FEEDBACK_REJECTED.value(('ip_rate',)) == rejected + 1
+
+        other_ip = client.post('/api/feedback', json={"comments": "Hello"}, headers={'X-Forwarded-For': '10.0.0.1'})
+        assert other_ip.status_code == 200
+
+    def test_made_up_forwarded_for_shares_the_limit(self, test_config):
+        """Test that without a trusted proxy, X-Forwarded-For doesn't get a client a fresh allowance"""
+        test_config['feedbackBurst'] = 2
+        app.configure_app(test_config)
+        client = TestClient(app.app)
+
+        for n in range(2):
+            response = client.post('/api/feedback', json={"comments": f"Spam {n}"}, headers={'X-Forwarded-For': f'10.0.0.{n}'})
+            assert response.status_code == 200
+        response = client.post('/api/feedback', json={"comments": "Spam 2"}, headers={'X-Forwarded-For': '10.0.0.2'})
+
+        assert response.status_code == 429
+        with app.db_transaction() as db:
+            assert {row[0] for row in db.execute("select ip_address from user_feedback")} == {'testclient'}
+
+    def test_duplicate_comments_rejected(self, client):
+        """Test that the same comments twice from one sender within the window are turned away"""
+        assert client.post('/api/feedback', json={"comments": "Buy now"}).status_code == 200
+        response = client.post('/api/feedback', json={"comments": "  Buy now "})
+
+        assert response.status_code == 429
+        assert len(stored_feedback()) == 1
+
+    def test_same_comments_from_other_senders_accepted(self, client):
+        """Test that the duplicate check is per sender, not across everyone"""
+        assert client.post('/api/feedback', json={"comments": "Thanks"}).status_code == 200
+        # Now signed in, so a different sender
+        client.post('/api/register', json={
+            "username": "testuser", "password": "testpassword123", "email": "test@example.com",
+        })
+
+        assert client.post('/api/feedback', json={"comments": "Thanks"}).status_code == 200
+        assert client.post('/api/feedback', json={"comments": "Thanks"}).status_code == 429
+
+    def test_failed_write_is_not_a_duplicate(self, client, monkeypatch):
+        """Test that feedback which couldn't be stored can be sent again straight away"""
+        real_run_write = app.run_write
+
+        def unavailable(operation):
+            raise app.HTTPException(status_code=503, detail="Server busy, please retry")
+
+        monkeypatch.setattr(app, 'run_write', unavailable)
+        assert client.post('/api/feedback', json={"comments": "Retry me"}).status_code == 503
+
+        monkeypatch.setattr(app, 'run_write', real_run_write)
+        assert client.post('/api/feedback', json={"comments": "Retry me"}).status_code == 200
+
+    def test_idle_buckets_are_evicted(self):
+        """Test that the limiter's memory is bounded"""
+        limiter = app.RateLimiter(rate=1000, burst=1, max_keys=2)
+        for key in ['a', 'b', 'c']:
+            limiter.allow(key)
+
+        assert limiter.stats()['keys'] <= 2
+
+    def test_recent_set_expires(self):
+        """Test that a value may be repeated once its window has passed"""
+        recent = app.RecentSet(ttl=0, max_entries=10)
+
+        assert recent.add("Hello")
+        assert recent.add("Hello")
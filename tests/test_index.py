@@ -0,0 +1,63 @@
+import pytest
+import gzip
+import app
+
+
+class TestServeIndex:
+    """Test cases for serving the precompiled index page"""
+
+    def test_anonymous_page_skips_database(self, client):
+        """Test that an anonymous page load never checks out a connection"""
+        checkouts = app.db_pool.stats()['checkouts']
+
+        response = client.get('/app/profile')
+
+        assert response.status_code == 200
+        assert 'const user_flags = {};' in response.text
+        assert app.db_pool.stats()['checkouts'] == checkouts
+
+    def test_anonymous_page_revalidates_with_etag(self, client):
+        """Test that a matching If-None-Match gets a 304"""
+        headers = {'Accept-Encoding': 'gzip'}
+        response = client.get('/', headers=headers)
+        etag = response.headers['etag']
+
+        assert response.headers['content-encoding'] == 'gzip'
+        assert etag.endswith('-gzip"')
+
+        headers['If-None-Match'] = etag
+        revalidated = client.get('/', headers=headers)
+
+        assert revalidated.status_code == 304
+        assert revalidated.content == b''
+
+    def test_precompressed_variants_match(self, client):
+        """Test that each encoding holds the same page under its own ETag"""
+        identity, identity_etag = app.index_page.anonymous['identity']
+        gzipped, gzip_etag = app.index_page.anonymous['gzip']
+
+        assert gzip.decompress(gzipped) == identity
+        assert identity_etag != gzip_etag
+
+    def test_logged_in_page_has_user_flags(self, client):
+        """Test that the user's flags are spliced into the page"""
+        user_data = {
+            "username": "testuser",
+            "password": "testpassword123",
+            "email": "test@example.com",
+            "fullname": "Test User"
+        }
+        client.post('/api/register', json=user_data)
+
+        response = client.get('/')
+
+        assert response.status_code == 200
+        assert '"username": "testuser"' in response.text
+        assert 'etag' not in response.headers
+
+    def test_choose_content_encoding(self):
+        """Test Accept-Encoding negotiation"""
+        assert app.choose_content_encoding('gzip, deflate, br') == 'br'
+        assert app.choose_content_encoding('gzip, br;q=0') == 'gzip'
+        assert app.choose_content_encoding('*') == 'br'
+        assert app.choose_content_encoding('') == 'identity'
@@ -0,0 +1,134 @@
+import pytest
+import ipaddress
+import time
+from starlette.requests import Request
+from fastapi.testclient import TestClient
+import app
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def throttled_client(request, test_config, behind_proxy):
+    """A test client behind a trusted proxy with a registered user, using each throttle store in turn"""
+    test_config['loginThrottleStore'] = request.param
+    test_config['loginFreeAttempts'] = 2
+    test_config['loginIpFreeAttempts'] = 4
+    test_config['loginBackoffBase'] = 60
+    test_config['trustedProxies'] = ['127.0.0.1']
+    app.configure_app(test_config)
+    client = TestClient(behind_proxy(app.app))
+    client.post('/api/register', json={
+        "username": "testuser",
+        "password": "testpassword123",
+        "email": "test@example.com",
+    })
+    return client
+
+
+def attempt(client, username='testuser', password='wrong', ip='10.0.0.1'):
+    return client.post(
+        '/api/login',
+        json={"username": username, "password": password},
+        headers={'X-Forwarded-For': ip},
+    )
+
+
+class TestLoginThrottle:
+    """Test cases for backing off repeated failed logins"""
+
+    def test_username_blocked_after_failures(self, throttled_client, monkeypatch):
+        """Test that once blocked, even the right password is refused without a lookup or verify"""
+        for _ in range(2):
+            assert attempt(throttled_client).status_code == 401
+
+        verified = []
+        monkeypatch.setattr(app.password_hash_pool, 'verify', lambda *args: verified.append(1))
+        response = attempt(throttled_client, password='testpassword123', ip='10.0.0.2')
+
+        assert response.status_code == 429
+        assert 0 < int(response.headers['retry-after']) <= 60
+        assert verified == []
+
+    def test_ip_blocked_across_usernames(self, throttled_client):
+        """Test that an address guessing at many usernames is blocked"""
+        for n in range(4):
+            assert attempt(throttled_client, username=f'nobody{n}').status_code == 401
+
+        assert attempt(throttled_client, username='someone-else').status_code == 429
+        assert attempt(throttled_client, ip='10.0.0.9', password='testpassword123').status_code == 200
+
+    def test_success_forgives_username_only(self, throttled_client):
+        """Test that logging in clears the username's failures but not the address's"""
+        assert attempt(throttled_client).status_code == 401
+        assert attempt(throttled_client, password='testpassword123').status_code == 200
+        assert attempt(throttled_client).status_code == 401
+
+        keys = app.login_throttle_keys('testuser', '10.0.0.1')
+        assert app.login_throttle.retry_after(keys) == 0
+
+    def test_backoff_doubles(self):
+        """Test the delays after the free attempts"""
+        backoff = app.LoginBackoff(free_attempts=2, base_delay=1, max_delay=5, window=60)
+
+        assert [backoff.delay(failures) for failures in range(1, 7)] == [0, 1, 2, 4, 5, 5]
+
+    def test_failures_are_forgotten(self, test_config):
+        """Test that failures older than the window no longer count, in either store"""
+        app.configure_app(test_config)
+        backoff = app.LoginBackoff(free_attempts=1, base_delay=60, max_delay=60, window=0)
+        for throttle in [
+            app.MemoryLoginThrottle(backoff, backoff, max_entries=10),
+            app.SqliteLoginThrottle(backoff, backoff, max_entries=10),
+        ]:
+            throttle.record_failure(['username:a'])
+            throttle.record_failure(['username:a'])
+            time.sleep(0.01)
+
+            assert throttle.retry_after(['username:a']) == 0
+
+    def test_forwarded_for_is_ignored_without_a_trusted_proxy(self, test_config):
+        """Test that a client can't dodge the address limit by making up X-Forwarded-For"""
+        test_config['loginIpFreeAttempts'] = 2
+        test_config['loginBackoffBase'] = 60
+        app.configure_app(test_config)
+        client = TestClient(app.app)
+
+        for n in range(2):
+            assert attempt(client, username=f'nobody{n}', ip=f'10.0.0.{n}').status_code == 401
+
+        assert attempt(client, username='someone-else', ip='10.0.0.99').status_code == 429
+
+
+def request_from(peer, headers):
+    return Request({
+        'type': 'http',
+        'client': (peer, 50000),
+        'headers': [(name.lower().encode(), value.encode()) for name, value in headers],
+    })
+
+
+class TestClientIp:
+    """Test cases for working out the client's address"""
+
+    def test_peer_is_used_unless_trusted(self, monkeypatch):
+        """Test that forwarding headers from an untrusted peer are ignored"""
+        monkeypatch.setattr(app, 'trusted_proxies', ())
+        request = request_from('203.0.113.5', [('X-Forwarded-For', '10.0.0.1'), ('X-Real-IP', '10.0.0.2')])
+
+        assert app.client_ip(request) == '203.0.113.5'
+
+    def test_rightmost_untrusted_address_is_used(self, monkeypatch):
+        """Test that addresses the client prepended to X-Forwarded-For are skipped"""
+        monkeypatch.setattr(app, 'trusted_proxies', (ipaddress.ip_network('10.1.0.0/16'),))
+        request = request_from('10.1.0.1', [
+            ('X-Forwarded-For', '1.2.3.4, 198.51.100.7'),
+            ('X-Forwarded-For', '10.1.0.2'),
+        ])
+
+        assert app.client_ip(request) == '198.51.100.7'
+
+    def test_real_ip_from_trusted_proxy(self, monkeypatch):
+        """Test that X-Real-IP is used from a trusted proxy that doesn't send X-Forwarded-For"""
+        monkeypatch.setattr(app, 'trusted_proxies', (ipaddress.ip_network('127.0.0.1'),))
+
+        assert app.client_ip(request_from('127.0.0.1', [('X-Real-IP', '198.51.100.7')])) == '198.51.100.7'
+        assert app.client_ip(request_from('127.0.0.1', [])) == '127.0.0.1'
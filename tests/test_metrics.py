@@ -0,0 +1,106 @@
+import pytest
+import threading
+from fastapi.testclient import TestClient
+import app
+import metrics
+
+
+class TestMetricTypes:
+    """Test cases for the sharded counters and histograms"""
+
+    def test_counter_sums_thread_shards(self):
+        """Test that increments from several threads are all counted"""
+        counter = metrics.Counter('test_total', 'Test counter', labelnames=('kind',), registry=None)
+
+        def increment():
+            for _ in range(1000):
+                counter.inc(labels=('a',))
+
+        threads = [threading.Thread(target=increment) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert counter.value(('a',)) == 4000
+
+    def test_exited_threads_shards_are_folded(self):
+        """Test that the shards of threads that have exited are retired, keeping their values"""
+        counter = metrics.Counter('test_total', 'Test counter', registry=None)
+        histogram = metrics.Histogram('test_seconds', 'Test histogram', buckets=(1.0,), registry=None)
+
+        def record():
+            counter.inc()
+            histogram.observe(0.5)
+            histogram.observe(2)
+
+        for _ in range(50):
+            thread = threading.Thread(target=record)
+            thread.start()
+            thread.join()
+
+        assert counter._shards == [] and histogram._shards == []
+        assert counter.value() == 50
+        assert histogram.series()[()] == ([50, 50], 125.0)
+
+    def test_histogram_renders_cumulative_buckets(self):
+        """Test the Prometheus text for a histogram"""
+        registry = metrics.Registry()
+        histogram = metrics.Histogram('test_seconds', 'Test histogram', buckets=(0.1, 1.0), registry=registry)
+        histogram.observe(0.05)
+        histogram.observe(0.1)
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        assert registry.render().splitlines() == [
+            '# HELP test_seconds Test histogram',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{le="0.1"} 2',
+            'test_seconds_bucket{le="1"} 3',
+            'test_seconds_bucket{le="+Inf"} 4',
+            'test_seconds_sum 5.65',
+            'test_seconds_count 4',
+        ]
+
+    def test_gauge_goes_down(self):
+        """Test that a gauge can be decremented on another thread"""
+        gauge = metrics.Gauge('test_in_flight', 'Test gauge', registry=None)
+        gauge.inc()
+        thread = threading.Thread(target=gauge.dec)
+        thread.start()
+        thread.join()
+
+        assert gauge.value() == 0
+
+
+class TestMetricsEndpoint:
+    """Test cases for the request instrumentation and /metrics"""
+
+    def test_metrics_require_admin(self, client):
+        """Test that metrics are not public"""
+        assert client.get('/metrics').status_code == 401
+
+    def test_admin_can_scrape(self, admin_client):
+        """Test that requests are recorded against their route template"""
+        admin_client.get('/app/some/page')
+        before = app.REQUEST_DURATION.count(('GET', '/app/{path:path}', '200'))
+        admin_client.get('/app/another/page')
+
+        response = admin_client.get('/metrics')
+
+        assert response.status_code == 200
+        assert response.headers['content-type'].startswith('text/plain')
+        assert app.REQUEST_DURATION.count(('GET', '/app/{path:path}', '200')) == before + 1
+        assert 'http_request_duration_seconds_bucket{method="GET",route="/app/{path:path}",status="200",le="+Inf"}' in response.text
+        assert 'db_transaction_duration_seconds_count' in response.text
+        assert 'password_hash_duration_seconds_count{operation="hash"}' in response.text
+
+    def test_scraper_token(self, test_config, monkeypatch):
+        """Test that a scraper can use the configured bearer token instead of a cookie"""
+        monkeypatch.setenv('TEST_METRICS_TOKEN', 'scrape-me')
+        test_config['metricsTokenVar'] = 'TEST_METRICS_TOKEN'
+        app.configure_app(test_config)
+        client = TestClient(app.app)
+
+        assert client.get('/metrics', headers={'Authorization': 'Bearer scrape-me'}).status_code == 200
+        assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 403
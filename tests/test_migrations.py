@@ -0,0 +1,115 @@
+import pytest
+import os
+import shutil
+import sqlite3
+import migrations
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'test.db')
+
+
+@pytest.fixture
+def migrations_dir(tmp_path):
+    """A copy of the real migrations that a test can add to"""
+    path = tmp_path / 'migrations'
+    shutil.copytree(migrations.MIGRATIONS_DIR, path)
+    return path
+
+
+def table_names(db_path):
+    db = sqlite3.connect(db_path)
+    names = {row[0] for row in db.execute("select name from sqlite_master where type = 'table'")}
+    db.close()
+    return names
+
+
+class TestMigrations:
+    """Test cases for the versioned migration runner"""
+
+    def test_fresh_database_gets_every_migration(self, db_path):
+        """Test that a new database is migrated and the versions recorded"""
+        applied = migrations.migrate(db_path)
+
+        assert applied == [migration.version for migration in migrations.discover_migrations()]
+        assert {'users', 'user_oauth_accounts', 'user_feedback', 'schema_migrations'} <= table_names(db_path)
+
+    def test_current_database_is_a_no_op(self, db_path):
+        """Test that migrating again applies nothing"""
+        migrations.migrate(db_path)
+
+        assert migrations.migrate(db_path) == []
+
+    def test_new_migration_is_applied(self, db_path, migrations_dir):
+        """Test that only a newly added migration runs on an existing database"""
+        migrations.migrate(db_path, migrations_dir)
+        (migrations_dir / '999-add-widgets.sql').write_text(
+            "-- Widgets\ncreate table widgets (id integer primary key);\ncreate index idx_widgets on widgets(id);\n"
+        )
+
+        assert migrations.migrate(db_path, migrations_dir) == ['999-add-widgets']
+        assert 'widgets' in table_names(db_path)
+
+    def test_failed_migration_is_rolled_back(self, db_path, migrations_dir):
+        """Test that pending migrations are applied all or nothing"""
+        migrations.migrate(db_path, migrations_dir)
+        (migrations_dir / '998-good.sql').write_text("create table good (id integer primary key);\n")
+        (migrations_dir / '999-bad.sql').write_text("create table users (id integer primary key);\n")
+
+        with pytest.raises(sqlite3.OperationalError):
+            migrations.migrate(db_path, migrations_dir)
+
+        assert 'good' not in table_names(db_path)
+
+    def test_edited_migration_is_reported(self, db_path, migrations_dir):
+        """Test that changing an applied migration is an error"""
+        migrations.migrate(db_path, migrations_dir)
+        edited = migrations_dir / '003-user-feedback.sql'
+        edited.write_text(edited.read_text() + "\n-- edited\n")
+
+        with pytest.raises(migrations.MigrationError):
+            migrations.migrate(db_path, migrations_dir)
+
+    def test_unversioned_database_is_adopted(self, db_path):
+        """Test that a database built before versioning only gets the newer migrations"""
+        legacy = migrations.discover_migrations()[:3]
+        db = sqlite3.connect(db_path)
+        for migration in legacy:
+            db.executescript(migration.sql)
+        db.close()
+
+        applied = migrations.migrate(db_path)
+
+        assert applied == [migration.version for migration in migrations.discover_migrations()[3:]]
+
+
+class TestTemplateDatabase:
+    """Test cases for cloning new databases from a migrated template"""
+
+    def test_template_is_built_once(self, migrations_dir, tmp_path):
+        """Test that the same migrations give back the same cached template"""
+        first = migrations.template_database(migrations_dir, cache_dir=tmp_path / 'templates')
+        built_at = os.path.getmtime(first)
+
+        second = migrations.template_database(migrations_dir, cache_dir=tmp_path / 'templates')
+
+        assert first == second
+        assert os.path.getmtime(second) == built_at
+
+    def test_changed_migrations_get_a_new_template(self, migrations_dir, tmp_path):
+        """Test that adding a migration builds a fresh template"""
+        first = migrations.template_database(migrations_dir, cache_dir=tmp_path / 'templates')
+        (migrations_dir / '999-add-widgets.sql').write_text("create table widgets (id integer primary key);\n")
+
+        second = migrations.template_database(migrations_dir, cache_dir=tmp_path / 'templates')
+
+        assert first != second
+        assert 'widgets' in table_names(second)
+
+    def test_clone_is_current(self, db_path):
+        """Test that a cloned database needs no migrations"""
+        migrations.create_database(db_path)
+
+        assert 'users' in table_names(db_path)
+        assert migrations.migrate(db_path) == []
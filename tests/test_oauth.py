@@ -0,0 +1,195 @@
+import pytest
+import time
+import httpx
+import urllib.parse
+from fastapi.testclient import TestClient
+import app
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def state_store_client(request, test_config):
+    """A test client using each kind of OAuth state store"""
+    test_config['oauthStateStore'] = request.param
+    app.configure_app(test_config)
+    return TestClient(app.app)
+
+
+def start_login(client):
+    """Start a Google login, returning the state it was given"""
+    response = client.get('/api/auth/google/login', follow_redirects=False)
+    assert response.status_code == 307
+    query = urllib.parse.urlparse(response.headers['location']).query
+    return urllib.parse.parse_qs(query)['state'][0]
+
+
+class TestOAuthStateStore:
+    """Test cases for the pending OAuth state stores"""
+
+    def test_state_can_only_be_used_once(self, state_store_client):
+        """Test that a state is consumed by its callback"""
+        state = start_login(state_store_client)
+
+        assert app.oauth_state_store.consume(state) is True
+        assert app.oauth_state_store.consume(state) is False
+
+    def test_unknown_state_is_rejected(self, state_store_client):
+        """Test that a callback with a state we never issued fails"""
+        response = state_store_client.get('/api/auth/google/callback?code=abc&state=made-up')
+
+        assert response.status_code == 400
+        assert response.json()['detail'] == 'Invalid OAuth callback'
+
+    def test_expired_state_is_rejected(self, test_config):
+        """Test that a state is no good past its TTL, in either store"""
+        app.configure_app(test_config)
+        for store in [app.MemoryOAuthStateStore(ttl=0, max_entries=10), app.SqliteOAuthStateStore(ttl=0, max_entries=10)]:
+            store.add('expired')
+            assert store.consume('expired') is False
+
+    def test_memory_store_is_bounded(self):
+        """Test that the oldest states are dropped beyond the size cap"""
+        store = app.MemoryOAuthStateStore(ttl=600, max_entries=2)
+        for state in ['first', 'second', 'third']:
+            store.add(state)
+
+        assert store.stats()['pending'] == 2
+        assert store.consume('first') is False
+        assert store.consume('third') is True
+
+    def test_sqlite_store_sweeps_in_batches(self, test_config):
+        """Test that expired and excess states are swept from the table"""
+        app.configure_app(test_config)
+        store = app.SqliteOAuthStateStore(ttl=600, max_entries=3, sweep_batch_size=2)
+        with app.db_transaction() as db:
+            db.executemany(
+                "insert into oauth_states (state, expires_at) values (?, ?)",
+                [(f"expired-{n}", time.time() - 1) for n in range(5)] +
+                [(f"pending-{n}", time.time() + 600 + n) for n in range(5)],
+            )
+
+        store.sweep()
+
+        with app.db_transaction() as db:
+            states = sorted(row['state'] for row in db.execute("select state from oauth_states"))
+        assert states == ['pending-2', 'pending-3', 'pending-4']
+
+
+class TestGoogleOAuthCallback:
+    """Test cases for the Google OAuth code exchange, against a stub provider"""
+
+    @pytest.fixture
+    def stub_provider_client(self, test_config):
+        test_config['googleTokenUrl'] = 'https://oauth.test/token'
+        test_config['googleUserinfoUrl'] = 'https://oauth.test/userinfo'
+        app.configure_app(test_config)
+        self.requests = []
+
+        def provider(request):
+            self.requests.append(request)
+            if request.url.path == '/token':
+                return httpx.Response(200, json={'access_token': 'stub-token', 'token_type': 'Bearer'})
+            assert request.headers['authorization'] == 'Bearer stub-token'
+            return httpx.Response(200, json={'id': 'google-123', 'email': 'jane@example.com', 'name': 'Jane'})
+
+        app.oauth_http_client = httpx.AsyncClient(transport=httpx.MockTransport(provider))
+        return TestClient(app.app)
+
+    def test_callback_logs_in_new_user(self, stub_provider_client):
+        """Test that a callback exchanges the code and signs the user in"""
+        state = start_login(stub_provider_client)
+
+        response = stub_provider_client.get(
+            f'/api/auth/google/callback?code=the-code&state={state}', follow_redirects=False
+        )
+
+        assert response.status_code == 303
+        assert app.AUTH_COOKIE_NAME in response.cookies
+        assert [request.url.path for request in self.requests] == ['/token', '/userinfo']
+        assert b'code=the-code' in self.requests[0].content
+
+        me = stub_provider_client.get('/api/me')
+        assert me.json()['username'] == 'jane'
+
+    def test_reconfigure_closes_previous_client(self, test_config):
+        """Test that configuring the app again doesn't leak the old client's connection pool"""
+        app.configure_app(test_config)
+        previous = app.oauth_http_client
+
+        app.configure_app(test_config)
+
+        assert previous.is_closed
+        assert not app.oauth_http_client.is_closed
+
+    def test_provider_error_fails_login(self, stub_provider_client):
+        """Test that an error from the provider is a failed login, not a crash"""
+        app.oauth_http_client = httpx.AsyncClient(
+            transport=httpx.MockTransport(lambda request: httpx.Response(400, json={'error': 'invalid_grant'}))
+        )
+        state = start_login(stub_provider_client)
+
+        response = stub_provider_client.get(f'/api/auth/google/callback?code=bad&state={state}')
+
+        assert response.status_code == 500
+        assert response.json()['detail'] == 'OAuth authentication failed'
+
+
+def oauth_username(email, provider_user_id):
+    result = app.process_oauth_login('google', {'id': provider_user_id, 'email': email, 'name': 'Someone'})
+    return result['user']['username']
+
+def insert_user(username):
+    with app.db_transaction() as db:
+        db.execute(
+            "insert into users (username, email) values (?, ?)", (username, f"{username}@elsewhere.com")
+        )
+
+
+class TestUsernameAllocation:
+    """Test cases for choosing a username for a new OAuth user"""
+
+    def test_clashing_usernames_get_suffixes(self, client):
+        """Test that sign-ups sharing an email prefix get the next suffix in turn"""
+        usernames = [oauth_username(f"john@example{n}.com", f"google-{n}") for n in range(4)]
+
+        assert usernames == ['john', 'john1', 'john2', 'john3']
+
+    def test_counter_starts_after_existing_suffixes(self, client):
+        """Test that the first clash carries on from the highest numeric suffix already taken"""
+        for username in ['john', 'john7', 'john12', 'john99x', 'johnny']:
+            insert_user(username)
+
+        assert oauth_username('john@example.com', 'google-1') == 'john13'
+        assert oauth_username('john@example.org', 'google-2') == 'john14'
+
+    def test_suffix_too_long_for_a_counter_is_ignored(self, client):
+        """Test that a numeric suffix beyond 64-bit integers doesn't overflow the counter"""
+        for username in ['john', 'john5', 'john99999999999999999999']:
+            insert_user(username)
+
+        assert oauth_username('john@example.com', 'google-1') == 'john6'
+
+    def test_counter_skips_username_taken_elsewhere(self, client):
+        """Test that a suffix taken by a registration is not given out again"""
+        assert oauth_username('john@example.com', 'google-1') == 'john'
+        assert oauth_username('john@example.org', 'google-2') == 'john1'
+        insert_user('john2')
+
+        assert oauth_username('john@example.net', 'google-3') == 'john3'
+
+    def test_query_count_does_not_grow_with_clashes(self, client):
+        """Test that choosing a username takes the same queries with 5 or 500 clashes"""
+        def allocation_queries(base, clashes):
+            insert_user(base)
+            for n in range(1, clashes):
+                insert_user(f"{base}{n}")
+            with app.db_transaction() as db:
+                app.allocate_username(db, base)
+                statements = []
+                db.set_trace_callback(statements.append)
+                try:
+                    app.allocate_username(db, base)
+                finally:
+                    db.set_trace_callback(None)
+            return len(statements)
+
+        assert allocation_queries('few', 5) == allocation_queries('many', 500)
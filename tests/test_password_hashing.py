@@ -0,0 +1,140 @@
+import pytest
+import asyncio
+import sqlite3
+from fastapi.testclient import TestClient
+import app
+
+
+@pytest.fixture
+def process_pool_client(test_config):
+    """A test client hashing passwords in a one-process pool"""
+    test_config['hashWorkers'] = 1
+    app.configure_app(test_config)
+    yield TestClient(app.app)
+    app.password_hash_pool.shutdown()
+
+
+class TestPasswordHashPool:
+    """Test cases for running argon2 outside the request thread pool"""
+
+    def test_register_and_login_in_process_pool(self, process_pool_client):
+        """Test that hashing and verification work in worker processes"""
+        user_data = {
+            "username": "testuser",
+            "password": "testpassword123",
+            "email": "test@example.com",
+            "fullname": "Test User"
+        }
+        assert process_pool_client.post('/api/register', json=user_data).status_code == 200
+
+        login_data = {"username": "testuser", "password": "testpassword123"}
+        assert process_pool_client.post('/api/login', json=login_data).status_code == 200
+
+        login_data['password'] = "wrongpassword"
+        assert process_pool_client.post('/api/login', json=login_data).status_code == 401
+
+        assert app.password_hash_pool.stats()['completed'] == 3
+
+    def test_full_queue_is_rejected(self, client):
+        """Test that a saturated hash queue fails fast with a 503"""
+        app.password_hash_pool.pending = app.password_hash_pool.max_pending
+
+        user_data = {
+            "username": "testuser",
+            "password": "testpassword123",
+            "email": "test@example.com",
+        }
+        response = client.post('/api/register', json=user_data)
+
+        assert response.status_code == 503
+        assert app.password_hash_pool.stats()['rejected'] == 1
+
+
+def stored_password_hash(username):
+    with app.db_transaction() as db:
+        return db.execute("select password from users where username = ?", (username,)).fetchone()[0]
+
+
+class TestArgon2Parameters:
+    """Test cases for configured argon2 parameters and rehashing"""
+
+    user_data = {
+        "username": "testuser",
+        "password": "testpassword123",
+        "email": "test@example.com",
+    }
+
+    def test_hashes_use_configured_parameters(self, test_config):
+        """Test that new hashes are made with the parameters from config"""
+        test_config['argon2TimeCost'] = 1
+        test_config['argon2MemoryCost'] = 8192
+        test_config['argon2Parallelism'] = 1
+        app.configure_app(test_config)
+        client = TestClient(app.app)
+
+        client.post('/api/register', json=self.user_data)
+
+        assert '$m=8192,t=1,p=1$' in stored_password_hash('testuser')
+
+    def test_process_pool_uses_configured_parameters(self, test_config):
+        """Test that hashing worker processes are given the parameters"""
+        test_config['hashWorkers'] = 1
+        test_config['argon2TimeCost'] = 1
+        test_config['argon2MemoryCost'] = 8192
+        test_config['argon2Parallelism'] = 1
+        app.configure_app(test_config)
+        client = TestClient(app.app)
+
+        client.post('/api/register', json=self.user_data)
+
+        assert '$m=8192,t=1,p=1$' in stored_password_hash('testuser')
+
+    def test_login_upgrades_old_hash(self, test_config):
+        """Test that a login with an outdated hash stores a new one, and still works afterwards"""
+        test_config['argon2TimeCost'] = 1
+        test_config['argon2MemoryCost'] = 8192
+        test_config['argon2Parallelism'] = 1
+        app.configure_app(test_config)
+        TestClient(app.app).post('/api/register', json=self.user_data)
+
+        test_config['argon2TimeCost'] = 2
+        app.configure_app(test_config)
+        client = TestClient(app.app)
+        login_data = {"username": "testuser", "password": "testpassword123"}
+
+        assert client.post('/api/login', json=login_data).status_code == 200
+        assert '$m=8192,t=2,p=1$' in stored_password_hash('testuser')
+        assert client.post('/api/login', json=login_data).status_code == 200
+
+    def test_failed_rehash_does_not_fail_login(self, test_config, monkeypatch):
+        """Test that an unexpected error while rehashing leaves the login successful and the old hash in place"""
+        test_config['argon2TimeCost'] = 1
+        test_config['argon2MemoryCost'] = 8192
+        test_config['argon2Parallelism'] = 1
+        app.configure_app(test_config)
+        TestClient(app.app).post('/api/register', json=self.user_data)
+        old_hash = stored_password_hash('testuser')
+
+        test_config['argon2TimeCost'] = 2
+        app.configure_app(test_config)
+        client = TestClient(app.app)
+
+        def broken_write(operation):
+            raise sqlite3.OperationalError("disk I/O error")
+
+        monkeypatch.setattr(app, 'run_write', broken_write)
+        response = client.post('/api/login', json={"username": "testuser", "password": "testpassword123"})
+
+        assert response.status_code == 200
+        assert stored_password_hash('testuser') == old_hash
+
+    def test_rehash_leaves_changed_password_alone(self, client):
+        """Test that a rehash doesn't overwrite a password changed in the meantime"""
+        client.post('/api/register', json=self.user_data)
+        with app.db_transaction() as db:
+            user_id = db.execute("select id from users where username = 'testuser'").fetchone()[0]
+        current_hash = stored_password_hash('testuser')
+
+        asyncio.run(app.rehash_password(user_id, 'an-older-hash', 'testpassword123'))
+
+        assert stored_password_hash('testuser') == current_hash
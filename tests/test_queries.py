@@ -0,0 +1,57 @@
+import pytest
+import sqlite3
+import queries
+
+
+@pytest.fixture
+def template_db(template_db_path):
+    db = sqlite3.connect(f"file:{template_db_path}?mode=ro", uri=True)
+    yield db
+    db.close()
+
+
+class TestQueryRegistry:
+    """Test cases for the named queries and their plans"""
+
+    def test_every_query_explains(self, template_db):
+        """Test that every registered query is valid SQL against the migrated schema"""
+        for name in queries.QUERIES:
+            queries.explain(template_db, name)
+
+    def test_hot_queries_do_not_scan_tables(self, template_db):
+        """Test that no query run on a request path scans a table"""
+        assert queries.check_plans(template_db) == {}
+
+    def test_table_scan_is_reported(self):
+        """Test that a full scan is caught, but not an ordered walk's index scan stopped by its limit"""
+        assert queries.table_scans(['SCAN users']) == ['SCAN users']
+        plan = ['SCAN user_feedback USING INDEX idx_user_feedback_created_at']
+        assert queries.table_scans(plan, ordered_walk=True) == []
+        assert queries.table_scans(plan + ['USE TEMP B-TREE FOR ORDER BY'], ordered_walk=True) == plan
+
+    def test_filtered_limit_scan_is_reported(self, template_db, monkeypatch):
+        """Test that an index walk with a filter isn't excused by its limit, as it may read every row"""
+        monkeypatch.setitem(queries.QUERIES, 'feedback_by_comments', queries.Query('feedback_by_comments', """
+            select id from user_feedback where comments = :comments order by created_at desc limit :limit
+        """, hot=True, ordered_walk=False))
+
+        assert queries.check_plans(template_db) == {
+            'feedback_by_comments': ['SCAN user_feedback USING INDEX idx_user_feedback_created_at'],
+        }
+
+    def test_duplicate_name_is_refused(self):
+        """Test that a query can't be registered twice under one name"""
+        with pytest.raises(ValueError):
+            queries.register('user_by_id', "select 1")
+
+    def test_executions_are_counted(self, client):
+        """Test that running a query shows up in its stats"""
+        before = queries.stats().get('username_exists', {'count': 0})['count']
+
+        client.post('/api/register', json={
+            "username": "testuser",
+            "password": "testpassword123",
+            "email": "test@example.com",
+        })
+
+        assert queries.stats()['username_exists']['count'] == before + 2
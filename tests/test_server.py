@@ -0,0 +1,66 @@
+import pytest
+import json
+import runpy
+import httpx
+from fastapi.testclient import TestClient
+import app
+import migrations
+from benchmarks import load
+
+
+class TestAppFactory:
+    """Test cases for the app factory used by server worker processes"""
+
+    def test_configured_app_serves_requests(self, test_config, tmp_path, monkeypatch):
+        """Test that a worker's app is configured from the config file in the environment"""
+        config_file = tmp_path / 'config.json'
+        config_file.write_text(json.dumps(test_config))
+        monkeypatch.setenv(app.CONFIG_FILE_ENV_VAR, str(config_file))
+
+        worker_app = app.create_configured_app()
+        client = TestClient(worker_app)
+
+        assert worker_app is not app.app
+        assert app.config['dbFilepath'] == test_config['dbFilepath']
+        response = client.post('/api/register', json={"username": "worker", "password": "secret", "email": "worker@example.com"})
+        assert response.status_code == 200
+        assert client.get('/api/me').json()['username'] == 'worker'
+
+
+    def test_database_is_migrated_before_workers_start(self, test_config, tmp_path, monkeypatch):
+        """Test that the parent creates the database once, rather than every worker at once"""
+        test_config['dbFilepath'] = str(tmp_path / 'new.db')
+        test_config['workers'] = 2
+        config_file = tmp_path / 'config.json'
+        config_file.write_text(json.dumps(test_config))
+        monkeypatch.setenv(app.CONFIG_FILE_ENV_VAR, '')
+        started = []
+        monkeypatch.setattr(app.uvicorn, 'run', lambda target, **options: started.append(
+            (target, options['workers'], migrations.migrate(test_config['dbFilepath']))
+        ))
+
+        app.run_server(str(config_file))
+
+        assert started == [("app:create_configured_app", 2, [])]
+
+
+class TestServerProcess:
+    """Test cases for starting the server with `python app.py`"""
+
+    def test_app_script_runs_again_as_worker_main(self):
+        """Test that app.py's module-level code can run a second time, as it does in each worker as __mp_main__"""
+        runpy.run_path(app.__file__, run_name='__mp_main__')
+
+    def test_multiple_workers_start(self):
+        """Test that worker processes, which import app.py twice, come up and share the database and secret"""
+        with load.Server(workers=2) as server, httpx.Client(base_url=server.base_url) as client:
+            assert client.get('/').status_code == 200
+            response = client.post('/api/register', json={
+                "username": "worker", "password": "secret", "email": "worker@example.com",
+            })
+            assert response.status_code == 200
+            user = load.VirtualUser('worker')
+            user.remember(response)
+            # Each request may be handled by either worker
+            for _ in range(4):
+                assert client.get('/api/me', headers=user.headers()).json()['username'] == 'worker'
@@ -0,0 +1,97 @@
+import pytest
+import brotli
+import gzip
+import os
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import app
+import build_assets
+
+MAIN_JS = b"console.log('hello');\n" * 50
+
+
+@pytest.fixture
+def static_dir(tmp_path):
+    """A static directory with built assets"""
+    (tmp_path / 'main.js').write_bytes(MAIN_JS)
+    (tmp_path / 'styles.min.css').write_bytes(b"body{margin:0}")
+    build_assets.build_assets(str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def static_client(static_dir):
+    """A test client serving the built static directory"""
+    static_app = FastAPI()
+    static_app.mount("/static", app.PrecompressedStaticFiles(directory=str(static_dir)), name="static")
+    return TestClient(static_app)
+
+
+class TestBuildAssets:
+    """Test cases for fingerprinting and precompressing the static assets"""
+
+    def test_manifest_names_hashed_copies(self, static_dir):
+        """Test that each asset gets a content-hashed copy with compressed variants"""
+        manifest = build_assets.read_manifest(str(static_dir))
+
+        path = static_dir / manifest['main.js']
+        assert manifest['main.js'].startswith('dist/main.')
+        assert path.read_bytes() == MAIN_JS
+        assert brotli.decompress((static_dir / (manifest['main.js'] + '.br')).read_bytes()) == MAIN_JS
+        assert gzip.decompress((static_dir / (manifest['main.js'] + '.gz')).read_bytes()) == MAIN_JS
+
+    def test_old_builds_are_pruned(self, static_dir):
+        """Test that the previous build is kept but the one before is removed"""
+        first = build_assets.read_manifest(str(static_dir))['main.js']
+        (static_dir / 'main.js').write_bytes(b"second")
+        second = build_assets.build_assets(str(static_dir))['main.js']
+        (static_dir / 'main.js').write_bytes(b"third")
+        build_assets.build_assets(str(static_dir))
+
+        assert not os.path.exists(static_dir / first)
+        assert os.path.exists(static_dir / second)
+
+
+class TestStaticFiles:
+    """Test cases for serving the fingerprinted assets"""
+
+    def test_brotli_served_when_accepted(self, static_client, static_dir):
+        """Test that the precompressed brotli file is sent, marked immutable"""
+        path = build_assets.read_manifest(str(static_dir))['main.js']
+
+        response = static_client.get(f'/static/{path}', headers={'Accept-Encoding': 'gzip, br'})
+
+        assert response.status_code == 200
+        assert response.headers['content-encoding'] == 'br'
+        assert response.headers['content-type'].startswith('text/javascript')
+        assert 'immutable' in response.headers['cache-control']
+        assert response.headers['vary'] == 'Accept-Encoding'
+        assert response.content == MAIN_JS
+
+    def test_identity_served_without_accept_encoding(self, static_client, static_dir):
+        """Test that a client accepting no compression gets the plain file"""
+        path = build_assets.read_manifest(str(static_dir))['main.js']
+
+        response = static_client.get(f'/static/{path}', headers={'Accept-Encoding': 'identity'})
+
+        assert 'content-encoding' not in response.headers
+        assert response.content == MAIN_JS
+
+    def test_unhashed_files_are_not_immutable(self, static_client):
+        """Test that files outside dist/ are served as before"""
+        response = static_client.get('/static/main.js')
+
+        assert response.status_code == 200
+        assert 'cache-control' not in response.headers
+
+    def test_index_links_fingerprinted_assets(self, client, static_dir, monkeypatch):
+        """Test that the index page refers to the assets through the manifest"""
+        manifest = build_assets.read_manifest(str(static_dir))
+        monkeypatch.setitem(app.config, 'debug', False)
+        monkeypatch.setattr(app, 'asset_manifest', manifest)
+        monkeypatch.setattr(app, 'index_page', app.IndexPage())
+
+        response = client.get('/')
+
+        assert f'/static/{manifest["main.js"]}' in response.text
+        assert f'/static/{manifest["styles.min.css"]}' in response.text
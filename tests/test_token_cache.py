@@ -0,0 +1,63 @@
+import pytest
+import time
+import jwt
+import app
+
+
+class TestTokenCache:
+    """Test cases for the verified-token cache"""
+
+    def test_repeat_requests_skip_verification(self, client, monkeypatch):
+        """Test that a session's token is only decoded once"""
+        user_data = {
+            "username": "testuser",
+            "password": "testpassword123",
+            "email": "test@example.com",
+        }
+        client.post('/api/register', json=user_data)
+
+        decodes = []
+        real_decode = jwt.decode
+
+        def counting_decode(*args, **kwargs):
+            decodes.append(1)
+            return real_decode(*args, **kwargs)
+
+        monkeypatch.setattr(jwt, 'decode', counting_decode)
+
+        for _ in range(3):
+            assert client.get('/api/me').status_code == 200
+
+        assert len(decodes) == 1
+        assert app.token_cache.stats()['hits'] == 2
+
+    def test_invalid_tokens_are_not_cached(self, client):
+        """Test that a garbage token is rejected every time"""
+        client.cookies.set(app.AUTH_COOKIE_NAME, 'not-a-token')
+
+        assert client.get('/api/me').status_code == 401
+        assert client.get('/api/me').status_code == 401
+        assert app.token_cache.stats()['size'] == 0
+
+    def test_entries_expire(self):
+        """Test that an entry is dropped once its token has expired"""
+        cache = app.TokenCache(max_size=10)
+        cache.put('expired', 1, time.time() - 1)
+        cache.put('valid', 2, time.time() + 60)
+
+        assert cache.get('expired') is None
+        assert cache.get('valid') == 2
+        assert cache.stats()['expired'] == 1
+        assert cache.stats()['size'] == 1
+
+    def test_size_is_bounded(self):
+        """Test that the least recently used entry is evicted"""
+        cache = app.TokenCache(max_size=2)
+        cache.put('first', 1, None)
+        cache.put('second', 2, None)
+        cache.get('first')
+        cache.put('third', 3, None)
+
+        assert cache.get('second') is None
+        assert cache.get('first') == 1
+        assert cache.get('third') == 3
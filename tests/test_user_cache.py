@@ -0,0 +1,61 @@
+import pytest
+import sqlite3
+import app
+
+
+@pytest.fixture
+def logged_in_client(client):
+    """A test client with a freshly registered user logged in"""
+    user_data = {
+        "username": "testuser",
+        "password": "testpassword123",
+        "email": "test@example.com",
+        "fullname": "Test User"
+    }
+    response = client.post('/api/register', json=user_data)
+    assert response.status_code == 200
+    return client
+
+
+class TestUserCache:
+    """Test cases for the in-process user-record cache"""
+
+    def test_cached_user_skips_database(self, logged_in_client):
+        """Test that /api/me is served from the cache after registration"""
+        checkouts = app.db_pool.stats()['checkouts']
+
+        response = logged_in_client.get('/api/me')
+
+        assert response.status_code == 200
+        assert response.json()['username'] == 'testuser'
+        assert app.db_pool.stats()['checkouts'] == checkouts
+
+    def test_profile_update_writes_through(self, logged_in_client):
+        """Test that the cache reflects a profile update without being cleared"""
+        response = logged_in_client.post('/api/profile', json={"fullname": "New Name"})
+        assert response.status_code == 200
+
+        assert logged_in_client.get('/api/me').json()['fullname'] == 'New Name'
+        assert app.user_cache.stats()['clears'] == 0
+
+    def test_other_worker_write_clears_cache(self, logged_in_client, test_config):
+        """Test that a write committed by another process is noticed"""
+        assert logged_in_client.get('/api/me').json()['fullname'] == 'Test User'
+
+        other_worker = sqlite3.connect(test_config['dbFilepath'])
+        other_worker.row_factory = sqlite3.Row
+        other_worker.execute("update users set fullname = 'Renamed' where username = 'testuser'")
+        app.bump_cache_version(other_worker, 'users')
+        other_worker.commit()
+        other_worker.close()
+
+        assert logged_in_client.get('/api/me').json()['fullname'] == 'Renamed'
+        assert app.user_cache.stats()['clears'] == 1
+
+    def test_entries_expire(self, test_config, client):
+        """Test that an entry is not served past its TTL"""
+        cache = app.UserCache(test_config['dbFilepath'], max_size=10, ttl=0)
+        cache.put({'id': 1, 'username': 'testuser', 'fullname': None, 'admin': False})
+
+        assert cache.get(1) is None
+        cache.close()
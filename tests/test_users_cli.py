@@ -0,0 +1,161 @@
+import pytest
+import io
+import json
+import app
+import users_cli
+
+
+def run_import(text, input_format, chunk_size=2, executor=None):
+    reports = []
+    importer = users_cli.UserImporter(executor, report=reports.append)
+    importer.import_rows(users_cli.read_rows(io.StringIO(text), input_format), chunk_size)
+    return importer, reports
+
+
+class TestUserImport:
+    """Test cases for bulk importing users"""
+
+    def test_csv_import_creates_users_who_can_log_in(self, client):
+        """Test that imported users are stored with hashed passwords"""
+        text = (
+            "username,email,fullname,password\n"
+            "alice,alice@example.com,Alice,alice-password\n"
+            "bob,bob@example.com,,bob-password\n"
+            "carol,carol@example.com,Carol,carol-password\n"
+        )
+
+        importer, reports = run_import(text, 'csv')
+
+        assert (importer.imported, importer.duplicates, importer.invalid) == (3, 0, 0)
+        assert reports == []
+        response = client.post('/api/login', json={"username": "carol", "password": "carol-password"})
+        assert response.status_code == 200
+        assert response.json()['user']['fullname'] == 'Carol'
+
+    def test_duplicates_are_reported_and_skipped(self, client):
+        """Test that clashes with the database or earlier rows skip the row rather than aborting"""
+        client.post('/api/register', json={
+            "username": "alice", "password": "testpassword123", "email": "alice@example.com",
+        })
+        text = "\n".join(json.dumps(row) for row in [
+            {"username": "alice", "email": "other@example.com", "password": "pw-one"},
+            {"username": "bob", "email": "bob@example.com", "password": "pw-two"},
+            {"username": "bobby", "email": "bob@example.com", "password": "pw-three"},
+            {"username": "dave", "email": "alice@example.com"},
+            {"username": "erin", "email": "erin@example.com"},
+        ])
+
+        importer, reports = run_import(text, 'jsonl')
+
+        assert (importer.imported, importer.duplicates, importer.invalid) == (2, 3, 0)
+        assert reports == [
+            "line 1: username 'alice' is already taken",
+            "line 3: email 'bob@example.com' is earlier in the file",
+            "line 4: email 'alice@example.com' is already taken",
+        ]
+
+    def test_invalid_rows_are_reported(self, client):
+        """Test that rows missing fields or that aren't objects are counted as invalid"""
+        text = '{"username": "alice"}\nnot json\n[1, 2]\n{"username": "bob", "email": "bob@example.com"}\n'
+
+        importer, reports = run_import(text, 'jsonl')
+
+        assert (importer.imported, importer.invalid) == (1, 3)
+        assert reports == [
+            "line 1: username and email are required",
+            "line 2: not a JSON object",
+            "line 3: not a JSON object",
+        ]
+
+    def test_bad_passwords_are_reported(self, client):
+        """Test that an empty password or a hash that doesn't parse is invalid, not a passwordless user"""
+        good_hash = app.hash_password('carol-password')
+        text = "\n".join(json.dumps(row) for row in [
+            {"username": "alice", "email": "alice@example.com", "password": ""},
+            {"username": "bob", "email": "bob@example.com", "password_hash": "$argon2id$not-a-hash"},
+            {"username": "dan", "email": "dan@example.com", "password_hash": good_hash[:good_hash.rindex('$') + 1]},
+            {"username": "carol", "email": "carol@example.com", "password": "", "password_hash": good_hash},
+        ])
+
+        importer, reports = run_import(text, 'jsonl')
+
+        assert (importer.imported, importer.invalid) == (1, 3)
+        assert reports == [
+            "line 1: password is empty",
+            "line 2: password_hash is not an argon2 hash",
+            "line 3: password_hash is not an argon2 hash",
+        ]
+        response = client.post('/api/login', json={"username": "carol", "password": "carol-password"})
+        assert response.status_code == 200
+
+    def test_import_hashes_in_process_pool(self, test_config):
+        """Test that passwords can be hashed by worker processes"""
+        app.configure_app(test_config)
+        executor = users_cli.hashing_executor(1, test_config)
+        try:
+            importer, _ = run_import(
+                "username,email,password\nalice,alice@example.com,alice-password\n", 'csv', executor=executor
+            )
+        finally:
+            executor.shutdown()
+
+        assert importer.imported == 1
+        with app.db_transaction() as db:
+            stored = db.execute("select password from users where username = 'alice'").fetchone()[0]
+        assert app.verify_password(stored, 'alice-password')
+
+
+class TestUserExport:
+    """Test cases for streaming users and OAuth accounts out"""
+
+    def test_export_round_trips_through_import(self, client, monkeypatch):
+        """Test that users exported with their hashes can be imported and still log in"""
+        monkeypatch.setattr(users_cli, 'EXPORT_CHUNK', 1)
+        client.post('/api/register', json={
+            "username": "alice", "password": "testpassword123", "email": "alice@example.com",
+        })
+        client.post('/api/register', json={
+            "username": "bob", "password": "testpassword123", "email": "bob@example.com",
+        })
+
+        out = io.StringIO()
+        users_cli.write_rows(users_cli.export_rows('users', True), out, 'jsonl', None)
+        exported = [json.loads(line) for line in out.getvalue().splitlines()]
+        assert [user['username'] for user in exported] == ['alice', 'bob']
+        assert exported[0]['admin'] is False
+        assert exported[0]['password_hash'].startswith('$argon2')
+
+        with app.db_transaction() as db:
+            db.execute("delete from users")
+        importer, _ = run_import(out.getvalue(), 'jsonl')
+
+        assert importer.imported == 2
+        response = client.post('/api/login', json={"username": "bob", "password": "testpassword123"})
+        assert response.status_code == 200
+
+    def test_export_csv_leaves_out_password_hashes(self, client):
+        """Test the CSV export of users, which has no hashes unless asked for"""
+        client.post('/api/register', json={
+            "username": "alice", "password": "testpassword123", "email": "alice@example.com",
+        })
+
+        out = io.StringIO()
+        columns = users_cli.EXPORT_COLUMNS['users']
+        users_cli.write_rows(users_cli.export_rows('users'), out, 'csv', columns)
+
+        lines = out.getvalue().splitlines()
+        assert lines[0] == 'id,username,email,fullname,admin,created_at'
+        assert lines[1].startswith('1,alice,alice@example.com,,False,')
+        assert '$argon2' not in out.getvalue()
+
+    def test_export_oauth_accounts(self, client):
+        """Test that OAuth accounts are exported with their user ids"""
+        app.process_oauth_login('google', {'id': 'google-1', 'email': 'jane@example.com', 'name': 'Jane'})
+        app.process_oauth_login('google', {'id': 'google-2', 'email': 'john@example.com', 'name': 'John'})
+
+        accounts = list(users_cli.export_rows('oauth_accounts'))
+
+        assert [(account['provider_user_id'], account['email']) for account in accounts] == [
+            ('google-1', 'jane@example.com'), ('google-2', 'john@example.com'),
+        ]
+        assert accounts[0]['user_id'] == 1
@@ -0,0 +1,287 @@
+"""Bulk import and export of user accounts.
+
+Import reads users from CSV (with a header row) or JSON Lines, one row at
+a time. Each row has a username and email, and optionally a fullname and
+either a password or a password_hash (an argon2 hash, as exported). A
+user without either can't log in with a password; an empty password is
+reported as invalid. Rows are taken a chunk at a time:
+
+- Usernames or emails already in use, in the database or earlier in the
+  file, are reported and skipped rather than aborting the import.
+- The remaining passwords are hashed across a process pool with the
+  configured argon2 parameters.
+- The chunk is inserted with one executemany in its own transaction.
+  Hashing happens before the transaction, so the write lock is only held
+  for the insert.
+
+Export streams the users or user_oauth_accounts table, in id order, as
+JSON Lines or CSV. Password hashes are only included if asked for.
+
+Usage: python users_cli.py import <config_file.json> <file> [--format csv|jsonl]
+           [--chunk-size 500] [--workers N]
+       python users_cli.py export <config_file.json> users|oauth_accounts [--format jsonl|csv]
+           [--output file] [--with-password-hashes]
+"""
+import argparse
+import concurrent.futures
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+
+import argon2
+
+import app
+import queries
+
+IMPORT_FIELDS = ('username', 'email', 'fullname', 'password', 'password_hash')
+# Passwords sent to a hashing worker at a time, rather than a round trip each
+HASH_BATCH_SIZE = 16
+EXPORT_CHUNK = 1000
+EXPORT_COLUMNS = {
+    'users': ('id', 'username', 'email', 'fullname', 'admin', 'created_at'),
+    'oauth_accounts': ('user_id', 'provider', 'provider_user_id', 'email', 'created_at'),
+}
+
+
+def file_format(path):
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+def read_rows(f, input_format):
+    """(line number, row) for each row of the file; a row that isn't valid JSON is None."""
+    if input_format == 'csv':
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(f, 1):
+        if line.strip():
+            try:
+                yield line_number, json.loads(line)
+            except json.JSONDecodeError:
+                yield line_number, None
+
+
+def check_row(row):
+    """(user, None) for a row that can be imported, or (None, the reason it can't)."""
+    if not isinstance(row, dict):
+        return None, "not a JSON object"
+    user = {field: row.get(field) or None for field in IMPORT_FIELDS}
+    if any(value is not None and not isinstance(value, str) for value in user.values()):
+        return None, "every field must be a string"
+    if not user['username'] or not user['email']:
+        return None, "username and email are required"
+    if user['password'] and user['password_hash']:
+        return None, "give a password or a password_hash, not both"
+    # Left out, a user has no password (as for OAuth accounts); given but empty is a mistake
+    if row.get('password') == '' and not user['password_hash']:
+        return None, "password is empty"
+    if user['password_hash'] and not is_argon2_hash(user['password_hash']):
+        return None, "password_hash is not an argon2 hash"
+    return user, None
+
+
+def is_argon2_hash(password_hash):
+    """Whether the hash parses as argon2, with at least argon2's minimum salt and hash lengths."""
+    try:
+        parameters = argon2.extract_parameters(password_hash)
+    except argon2.exceptions.InvalidHashError:
+        return False
+    return parameters.salt_len >= 8 and parameters.hash_len >= 4
+
+
+class UserImporter:
+    """Imports users a chunk at a time, counting and reporting the rows it skips.
+
+    With `executor` None passwords are hashed in this process.
+    """
+
+    def __init__(self, executor=None, report=None):
+        self.executor = executor
+        self.report = report or (lambda message: print(message, file=sys.stderr))
+        self.seen_usernames = set()
+        self.seen_emails = set()
+        self.imported = 0
+        self.duplicates = 0
+        self.invalid = 0
+
+    def import_rows(self, rows, chunk_size):
+        """Import every (line number, row); returns the number of users imported."""
+        rows = iter(rows)
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                return self.imported
+            self.import_chunk(chunk)
+
+    def import_chunk(self, chunk):
+        users = []
+        for line_number, row in chunk:
+            user, problem = check_row(row)
+            if problem:
+                self.invalid += 1
+                self.report(f"line {line_number}: {problem}")
+            elif user['username'] in self.seen_usernames:
+                self.duplicate(line_number, f"username {user['username']!r} is earlier in the file")
+            elif user['email'] in self.seen_emails:
+                self.duplicate(line_number, f"email {user['email']!r} is earlier in the file")
+            else:
+                self.seen_usernames.add(user['username'])
+                self.seen_emails.add(user['email'])
+                users.append((line_number, user))
+
+        # Checked before hashing, so no time is spent hashing passwords that won't be used
+        with app.db_read() as db:
+            users = self.drop_taken(db, users)
+        if not users:
+            return
+
+        passwords = [user['password'] for _, user in users if user['password']]
+        if self.executor is None:
+            hashes = iter([app.hash_password(password) for password in passwords])
+        else:
+            hashes = self.executor.map(app.hash_password, passwords, chunksize=HASH_BATCH_SIZE)
+        rows = [
+            (line_number, {
+                'username': user['username'],
+                'email': user['email'],
+                'fullname': user['fullname'],
+                'password': next(hashes) if user['password'] else user['password_hash'],
+            })
+            for line_number, user in users
+        ]
+
+        def insert_users(db):
+            # Again, in case a user has signed up with one since
+            fresh = self.drop_taken(db, rows)
+            queries.executemany(db, 'user_insert', [row for _, row in fresh])
+            return len(fresh)
+
+        self.imported += app.run_write(insert_users)
+
+    def drop_taken(self, db, users):
+        """The (line number, user) pairs whose username and email are both unused in the database."""
+        taken = queries.execute(db, 'users_taken', {
+            'usernames': json.dumps([user['username'] for _, user in users]),
+            'emails': json.dumps([user['email'] for _, user in users]),
+        }).fetchall()
+        taken_usernames = {row['username'] for row in taken}
+        taken_emails = {row['email'] for row in taken}
+
+        fresh = []
+        for line_number, user in users:
+            if user['username'] in taken_usernames:
+                self.duplicate(line_number, f"username {user['username']!r} is already taken")
+            elif user['email'] in taken_emails:
+                self.duplicate(line_number, f"email {user['email']!r} is already taken")
+            else:
+                fresh.append((line_number, user))
+        return fresh
+
+    def duplicate(self, line_number, message):
+        self.duplicates += 1
+        self.report(f"line {line_number}: {message}")
+
+
+def hashing_executor(workers, config_dict):
+    """A process pool hashing with the configured argon2 parameters, or None for no workers."""
+    if workers <= 0:
+        return None
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=app.configure_password_hasher,
+        initargs=(app.password_hasher_params(config_dict),),
+    )
+
+
+def export_rows(table, with_password_hashes=False):
+    """Every row of `users` or `oauth_accounts`, in id order, read a chunk at a time."""
+    if table == 'users':
+        query_name, position = 'users_export_page', 'id'
+    else:
+        query_name, position = 'oauth_accounts_export_page', 'rowid'
+    after = 0
+    while True:
+        with app.db_read() as db:
+            rows = queries.execute(db, query_name, {f"after_{position}": after, 'limit': EXPORT_CHUNK}).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            exported = {column: row[column] for column in EXPORT_COLUMNS[table]}
+            if table == 'users':
+                exported['admin'] = bool(exported['admin'])
+                if with_password_hashes:
+                    exported['password_hash'] = row['password']
+            yield exported
+        after = rows[-1][position]
+
+
+def write_rows(rows, out, output_format, columns):
+    if output_format == 'csv':
+        writer = csv.DictWriter(out, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    else:
+        for row in rows:
+            out.write(json.dumps(row) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = commands.add_parser('import', help="create users from a CSV or JSON Lines file")
+    import_parser.add_argument('config_file')
+    import_parser.add_argument('file')
+    import_parser.add_argument('--format', choices=['csv', 'jsonl'], help="default from the file extension")
+    import_parser.add_argument('--chunk-size', type=int, default=500, help="users per transaction")
+    import_parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="hashing processes")
+
+    export_parser = commands.add_parser('export', help="write out users or their OAuth accounts")
+    export_parser.add_argument('config_file')
+    export_parser.add_argument('table', choices=sorted(EXPORT_COLUMNS))
+    export_parser.add_argument('--format', choices=['csv', 'jsonl'], help="default from --output, else jsonl")
+    export_parser.add_argument('--output', help="default standard output")
+    export_parser.add_argument('--with-password-hashes', action='store_true', help="users only")
+
+    args = parser.parse_args()
+    if args.command == 'import' and args.chunk_size < 1:
+        parser.error("--chunk-size must be at least 1")
+
+    config_dict = app.load_config(args.config_file)
+    app.configure_app(config_dict)
+    try:
+        if args.command == 'import':
+            executor = hashing_executor(args.workers, config_dict)
+            importer = UserImporter(executor)
+            try:
+                with open(args.file, 'r', newline='', encoding='utf-8') as f:
+                    importer.import_rows(read_rows(f, args.format or file_format(args.file)), args.chunk_size)
+            finally:
+                if executor is not None:
+                    executor.shutdown()
+            print(
+                f"Imported {importer.imported} users; skipped {importer.duplicates} duplicates"
+                f" and {importer.invalid} invalid rows"
+            )
+        else:
+            output_format = args.format or (file_format(args.output) if args.output else 'jsonl')
+            columns = list(EXPORT_COLUMNS[args.table])
+            if args.table == 'users' and args.with_password_hashes:
+                columns.append('password_hash')
+            rows = export_rows(args.table, args.with_password_hashes)
+            if args.output:
+                with open(args.output, 'w', newline='', encoding='utf-8') as out:
+                    write_rows(rows, out, output_format, columns)
+            else:
+                write_rows(rows, sys.stdout, output_format, columns)
+    finally:
+        app.shutdown_app()
+
+
+if __name__ == '__main__':
+    main()